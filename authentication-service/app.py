@@ -1,5 +1,11 @@
 import strawberry
+from contextlib import asynccontextmanager
 from helper import *
+from metrics import track_work
+from ratelimit import RATE_LIMIT_ENABLED, RateLimitMiddleware
+from common.extensions import MetricsExtension, TracingExtension
+from common.metrics import AsgiMetricsMiddleware, metrics_endpoint
+from common.tracing import AsgiTracingMiddleware, configure_tracing
 from werkzeug.security import check_password_hash, generate_password_hash
 from typing import Optional
 from starlette.applications import Starlette
@@ -38,7 +44,8 @@ class Mutation:
                 return UserType(info="User already exists")
 
             # Generate hashed password and TOTP secret
-            password_hash = generate_password_hash(password)
+            with track_work("password_hash"):
+                password_hash = generate_password_hash(password)
             totp_secret = generate_totp_secret()
 
             # Assign the default role and get permissions
@@ -72,7 +79,9 @@ class Mutation:
 
 
             # Verify password
-            if not check_password_hash(stored_password_hash, password):
+            with track_work("password_check"):
+                password_ok = check_password_hash(stored_password_hash, password)
+            if not password_ok:
                 return UserType(info="Invalid credentials")
 
             # Verify TOTP code
@@ -114,12 +123,31 @@ class Mutation:
             return UserType(info="Failed to generate QR code")
 
 # Create GraphQL schema
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+tracing_enabled = configure_tracing("authentication-service")
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    extensions=[MetricsExtension] + ([TracingExtension] if tracing_enabled else [])
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    if email_filter:
+        # Fills in the background; lookups use the database until it's done
+        email_filter.start(get_db_connection)
+    yield
+
 
 # Starlette ASGI app setup
-app = Starlette(debug=True)
+app = Starlette(debug=True, lifespan=lifespan)
 graphql_app = GraphQL(schema)
 app.add_route("/authentication", graphql_app)
+app.add_route("/metrics", metrics_endpoint)
+# Added first so it runs innermost: refusals are still measured and traced
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, path="/authentication")
+app.add_middleware(AsgiMetricsMiddleware, paths=["/authentication", "/metrics"])
+app.add_middleware(AsgiTracingMiddleware, paths=["/authentication", "/metrics"])
 
 # Main entry point
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+import hashlib
+import math
+import os
+import threading
+import time
+
+from metrics import EMAIL_FILTER_LOOKUPS
+
+# Bloom filter of registered emails, so lookups for emails nobody signed up
+# with (most of a credential-stuffing run) are answered without Postgres.
+# A filter never forgets an email it was given, so "absent" is definite and
+# only "maybe" goes on to the database.
+EMAIL_FILTER_ENABLED = os.getenv('EMAIL_FILTER_ENABLED', '0') == '1'
+# Sized for this many users at this false-positive rate; past it the rate
+# climbs but answers stay correct
+EMAIL_FILTER_CAPACITY = int(os.getenv('EMAIL_FILTER_CAPACITY', '1000000'))
+EMAIL_FILTER_ERROR_RATE = float(os.getenv('EMAIL_FILTER_ERROR_RATE', '0.001'))
+# Keep the filter in Redis, shared by every replica. Without it each process
+# only learns of signups it handled itself and would call a user another
+# replica signed up absent, so a filter in process memory also needs
+# EMAIL_FILTER_SINGLE_REPLICA=1 as the deployment's word that there is one.
+EMAIL_FILTER_REDIS_URL = os.getenv('EMAIL_FILTER_REDIS_URL')
+EMAIL_FILTER_SINGLE_REPLICA = os.getenv('EMAIL_FILTER_SINGLE_REPLICA', '0') == '1'
+
+# Rows fetched per round trip while streaming the users table
+STREAM_BATCH = 10_000
+# Lookups give up on Redis quickly; a build sends big batches and may wait
+REDIS_TIMEOUT = 0.1
+REDIS_BUILD_TIMEOUT = 10
+# A replica rebuilding the Redis filter holds this long at most
+REBUILD_LOCK_SECONDS = 600
+# How often a replica that finds the Redis filter missing tries to rebuild it
+REBUILD_RETRY_SECONDS = 30
+
+
+def filter_size(capacity, error_rate):
+    """(bits, hash count) for ``capacity`` entries at ``error_rate``."""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+
+def bit_positions(email, bits, hashes):
+    # Double hashing off one digest: h1 + i*h2 behaves like k independent hashes
+    digest = hashlib.blake2b(email.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class BloomFilter:
+    """Bit array in process memory."""
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+        self.ready = False
+
+    @property
+    def nbytes(self):
+        return len(self.array)
+
+    def add(self, email):
+        for position in bit_positions(email, self.bits, self.hashes):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def add_many(self, emails):
+        for email in emails:
+            self.add(email)
+
+    def finish_build(self):
+        self.ready = True
+
+    def contains(self, email):
+        """True/False once built, None while the answer has to come from the DB."""
+        if not self.ready:
+            return None
+        return all(self.array[p >> 3] & (1 << (p & 7)) for p in bit_positions(email, self.bits, self.hashes))
+
+
+class RedisBloomFilter:
+    """The same bit array as a Redis string, read and written with BITFIELD.
+
+    Bit ``bits`` (one past the filter) marks a finished build. It lives in
+    the same key, so if Redis loses or evicts the filter the marker goes
+    with it and lookups fall back to the database until it is rebuilt.
+    """
+
+    def __init__(self, redis_client, bits, hashes, build_client=None):
+        self.redis = redis_client
+        self.build_redis = build_client or redis_client
+        self.bits = bits
+        self.hashes = hashes
+        # Filters of different sizes don't mix
+        self.key = f"email-filter:{bits}:{hashes}"
+
+    @property
+    def nbytes(self):
+        return (self.bits + 1 + 7) // 8
+
+    @property
+    def ready(self):
+        return bool(self.build_redis.bitfield(self.key).get("u1", self.bits).execute()[0])
+
+    def add(self, email):
+        self._set(self.redis, [email])
+
+    def add_many(self, emails):
+        self._set(self.build_redis, emails)
+
+    def _set(self, client, emails):
+        operation = client.bitfield(self.key)
+        for email in emails:
+            for position in bit_positions(email, self.bits, self.hashes):
+                operation.set("u1", position, 1)
+        operation.execute()
+
+    def finish_build(self):
+        self.build_redis.bitfield(self.key).set("u1", self.bits, 1).execute()
+
+    def claim_build(self):
+        """Whether this replica should build the filter; False if built or another one is on it."""
+        if self.ready:
+            return False
+        return bool(self.build_redis.set(f"{self.key}:building", 1, nx=True, ex=REBUILD_LOCK_SECONDS))
+
+    def release_build(self):
+        self.build_redis.delete(f"{self.key}:building")
+
+    def contains(self, email):
+        operation = self.redis.bitfield(self.key).get("u1", self.bits)
+        for position in bit_positions(email, self.bits, self.hashes):
+            operation.get("u1", position)
+        built, *found = operation.execute()
+        if not built:
+            return None
+        return all(found)
+
+
+class EmailFilter:
+    """What the user lookups ask before going to the database.
+
+    ``start`` streams the users table into the filter on a background
+    thread; lookups go to the database until that is done. Any error in
+    the filter means "maybe", never "absent".
+    """
+
+    def __init__(self, bloom):
+        self.bloom = bloom
+        self.shared = isinstance(bloom, RedisBloomFilter)
+        self._connect = None
+        self._building = threading.Lock()
+        self._next_rebuild = 0.0
+
+    def start(self, connect):
+        self._connect = connect
+        threading.Thread(target=self._build, name="email-filter-build", daemon=True).start()
+
+    def _build(self):
+        if not self._building.acquire(blocking=False):
+            return
+        try:
+            if self.shared and not self.bloom.claim_build():
+                return
+            try:
+                self._stream()
+            finally:
+                if self.shared:
+                    self.bloom.release_build()
+        except Exception as e:
+            print(f"Error building email filter, lookups go to the database: {e}")
+        finally:
+            self._building.release()
+
+    def _stream(self):
+        conn = self._connect()
+        # A named cursor is server-side in psycopg2: rows arrive in batches
+        cursor = conn.cursor(name="email_filter_build")
+        try:
+            cursor.execute("SELECT email FROM users")
+            count = 0
+            while True:
+                rows = cursor.fetchmany(STREAM_BATCH)
+                if not rows:
+                    break
+                self.bloom.add_many(row[0] for row in rows)
+                count += len(rows)
+        finally:
+            cursor.close()
+            conn.close()
+        self.bloom.finish_build()
+        if count > EMAIL_FILTER_CAPACITY:
+            print(f"Email filter holds {count} emails, over its capacity of {EMAIL_FILTER_CAPACITY}; "
+                  f"raise EMAIL_FILTER_CAPACITY to keep the false-positive rate down")
+        print(f"Email filter built from {count} users ({self.bloom.nbytes} bytes)")
+
+    def add(self, email):
+        """Record a new email. Call before the row is inserted, so no lookup misses it."""
+        try:
+            self.bloom.add(email)
+        except Exception as e:
+            print(f"Error adding to email filter: {e}")
+            if self.shared:
+                self._discard()
+
+    def _discard(self):
+        # Other replicas would trust a filter missing this email; drop it to be rebuilt
+        try:
+            self.bloom.redis.delete(self.bloom.key)
+        except Exception as e:
+            print(f"Error discarding email filter: {e}")
+
+    def lookup(self, email):
+        """False if ``email`` is definitely not registered, True if it may be, None if unknown."""
+        try:
+            found = self.bloom.contains(email)
+        except Exception as e:
+            print(f"Error reading email filter: {e}")
+            EMAIL_FILTER_LOOKUPS.labels("unavailable").inc()
+            return None
+        if found is None:
+            EMAIL_FILTER_LOOKUPS.labels("unavailable").inc()
+            self._rebuild_shared()
+            return None
+        EMAIL_FILTER_LOOKUPS.labels("maybe" if found else "absent").inc()
+        return found
+
+    def _rebuild_shared(self):
+        # The Redis filter was lost or isn't finished; a replica rebuilds it
+        now = time.monotonic()
+        if not self.shared or self._connect is None or now < self._next_rebuild:
+            return
+        self._next_rebuild = now + REBUILD_RETRY_SECONDS
+        threading.Thread(target=self._build, name="email-filter-build", daemon=True).start()
+
+
+def _email_filter():
+    if not EMAIL_FILTER_ENABLED:
+        return None
+    bits, hashes = filter_size(EMAIL_FILTER_CAPACITY, EMAIL_FILTER_ERROR_RATE)
+    if EMAIL_FILTER_REDIS_URL:
+        import redis
+        client = redis.from_url(EMAIL_FILTER_REDIS_URL, socket_timeout=REDIS_TIMEOUT,
+                                socket_connect_timeout=REDIS_TIMEOUT)
+        build_client = redis.from_url(EMAIL_FILTER_REDIS_URL, socket_timeout=REDIS_BUILD_TIMEOUT)
+        return EmailFilter(RedisBloomFilter(client, bits, hashes, build_client))
+    if not EMAIL_FILTER_SINGLE_REPLICA:
+        print("Email filter off: set EMAIL_FILTER_REDIS_URL, or EMAIL_FILTER_SINGLE_REPLICA=1 "
+              "if this is the only replica")
+        return None
+    return EmailFilter(BloomFilter(bits, hashes))
+
+
+email_filter = _email_filter()
@@ -6,10 +6,17 @@ import qrcode
 import base64
 from io import BytesIO
 from barbicanclient import client
+from cryptography.fernet import Fernet
 from keystoneauth1.identity import v3
 from keystoneauth1 import session
 from dotenv import load_dotenv
 from typing import List
+from emailfilter import email_filter
+from metrics import EMAIL_FILTER_FALSE_POSITIVES, instrument_connection, track_work
+from secretcache import TOTP_SECRET_CACHE_ENABLED, TOTP_SECRET_CACHE_KEY_NAME, TotpSecretCache, version_store
+from totpcache import totp_verifier
+from common.metrics import track_outbound
+from common.tracing import inject_headers
 
 # Load environment variables
 load_dotenv()
@@ -52,7 +59,7 @@ def get_db_connection():
             host=POSTGRES_HOST,
             port=POSTGRES_PORT
         )
-        return conn
+        return instrument_connection(conn)
     except Exception as e:
         print(f"Error connecting to PostgreSQL: {e}")
         return None
@@ -62,14 +69,18 @@ def generate_totp_uri(email, totp_secret):
     return f"otpauth://totp/{issuer_name}:{email}?secret={totp_secret}&issuer={issuer_name}"
 
 def generate_qr_code(uri):
-    qr = qrcode.make(uri)
-    buffer = BytesIO()
-    qr.save(buffer, format="PNG")
+    with track_work("qr_code"):
+        qr = qrcode.make(uri)
+        buffer = BytesIO()
+        qr.save(buffer, format="PNG")
     qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
     return qr_base64  # This can be sent as a base64-encoded string
 
 # Helper functions for user handling
 def is_duplicate(email: str):
+    known = email_filter.lookup(email) if email_filter else None
+    if known is False:
+        return False
     conn = get_db_connection()
     cursor = conn.cursor()
     query = "SELECT email FROM users WHERE email = %s"
@@ -77,9 +88,15 @@ def is_duplicate(email: str):
     result = cursor.fetchone()
     cursor.close()
     conn.close()
+    if known and result is None:
+        EMAIL_FILTER_FALSE_POSITIVES.inc()
     return result is not None
 
 def find_user_hashed_password_by_email(email: str):
+    # Definitely not registered: no need to ask the database
+    known = email_filter.lookup(email) if email_filter else None
+    if known is False:
+        return None
     try:
         # Establish a connection to the database
         conn = get_db_connection()
@@ -100,6 +117,8 @@ def find_user_hashed_password_by_email(email: str):
         if result:
             return result[0]  # return only the `password` field
         else:
+            if known:
+                EMAIL_FILTER_FALSE_POSITIVES.inc()
             return None  # or "User not found"
     
     except Exception as e:
@@ -146,6 +165,9 @@ def find_user_by_email(email: str):
 
 
 def insert_user(email: str, password_hash: str, totp_secret: str):
+    # Into the email filter first: a login racing the insert must not be told the user doesn't exist
+    if email_filter:
+        email_filter.add(email)
     # Insert user into the database without storing the TOTP secret
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -162,26 +184,41 @@ def insert_user(email: str, password_hash: str, totp_secret: str):
 def store_secret_in_barbican(userid: str, secret: str) -> str:
     # Create a new secret in Barbican
     try:
-        new_secret = barbican.secrets.create()
-        new_secret.name = u'Random plain text password for user {}'.format(userid)
-        new_secret.payload = secret
-        new_secret.store()
+        with track_outbound("barbican", "store_secret"):
+            new_secret = barbican.secrets.create()
+            new_secret.name = u'Random plain text password for user {}'.format(userid)
+            new_secret.payload = secret
+            new_secret.store()
     except Exception as e:
         print("Error during store secret:", e)
+    # The new secret replaces whatever was cached. Only once it is stored:
+    # a lookup that started before must not cache the old one under the new version
+    if secret_cache:
+        secret_cache.invalidate(userid)
         
 
 # Function to retrieve the TOTP secret from Barbican
 
 def query_secret_by_userid(userid: str) -> str:
+    version = None
+    if secret_cache:
+        cached, version = secret_cache.get(userid)
+        if cached is not None:
+            return cached
     try:
-        # Retrieve a list of secrets
-        secrets = barbican.secrets.list()
+        # Let Barbican filter by name; an unfiltered list() only returns the first page of 10
+        with track_outbound("barbican", "list_secrets"):
+            secrets = barbican.secrets.list(name=f'Random plain text password for user {userid}')
 
         # Filter secrets by user ID in the name or metadata
         for secret in secrets:
             if secret.name == f'Random plain text password for user {userid}':
                 # Retrieve and return the secret payload
-                return secret.payload
+                with track_outbound("barbican", "get_payload"):
+                    payload = secret.payload
+                if secret_cache:
+                    secret_cache.put(userid, payload, version)
+                return payload
 
         return "Secret not found for the given user ID."
 
@@ -190,16 +227,40 @@ def query_secret_by_userid(userid: str) -> str:
         return "Failed to retrieve the secret."
 
 
+def get_secret_cache_data_key():
+    # The first replica to need the key creates it; later ones find the oldest
+    with track_outbound("barbican", "list_secrets"):
+        secrets = barbican.secrets.list(name=TOTP_SECRET_CACHE_KEY_NAME, sort="created:asc")
+    for secret in secrets:
+        if secret.name == TOTP_SECRET_CACHE_KEY_NAME:
+            with track_outbound("barbican", "get_payload"):
+                return secret.payload
+    data_key = Fernet.generate_key().decode("ascii")
+    with track_outbound("barbican", "store_secret"):
+        new_secret = barbican.secrets.create()
+        new_secret.name = TOTP_SECRET_CACHE_KEY_NAME
+        new_secret.payload = data_key
+        new_secret.store()
+    return data_key
+
+
+# Encrypted in-memory cache of TOTP secrets, in front of query_secret_by_userid
+secret_cache = (TotpSecretCache(get_secret_cache_data_key, versions=version_store())
+                if TOTP_SECRET_CACHE_ENABLED else None)
+
+
 # TOTP Functions for 2FA
 def generate_totp_secret():
     return pyotp.random_base32()
 
 def verify_totp(email: str, totp_code: str):
-    # Retrieve the TOTP secret from Barbican
-    userId = find_id_by_email(email)
-    totp_secret = query_secret_by_userid(userId)
-    totp = pyotp.TOTP(totp_secret)
-    return totp.verify(totp_code)
+    def totp_secret():
+        # Retrieve the TOTP secret from Barbican
+        userId = find_id_by_email(email)
+        return query_secret_by_userid(userId)
+
+    # Reused and repeated bad codes are refused before either lookup
+    return totp_verifier.verify(email, totp_code, totp_secret)
 
 # Call the authorization service to request token generation
 def request_token_from_authorization(user_id: str, permissions: List[str]):
@@ -208,8 +269,9 @@ def request_token_from_authorization(user_id: str, permissions: List[str]):
         "permissions": permissions
     }
     try:
-        response = requests.post(f"{AUTHORIZATION_API_URL}/generate-token", json=data)
-        response.raise_for_status()  # Raise an error if status code is not 200
+        with track_outbound("authorization", "generate_token"):
+            response = requests.post(f"{AUTHORIZATION_API_URL}/generate-token", json=data, headers=inject_headers())
+            response.raise_for_status()  # Raise an error if status code is not 200
         return response.json().get('token')  # Extract token from the response
     except requests.RequestException as e:
         print(f"Failed to request token from authorization service: {e}")
@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+
+from opentelemetry.trace import SpanKind
+from prometheus_client import Counter, Histogram
+
+from common.metrics import count_query
+from common.tracing import traced
+
+# The authentication service's own Prometheus metrics; the HTTP, GraphQL
+# and outbound-call ones every service records are in common. Labels only
+# ever take values from fixed call sites so cardinality stays bounded.
+
+WORK_SECONDS = Histogram(
+    "auth_work_duration_seconds", "CPU-bound work inside the auth flows", ["step"])
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total", "Requests refused by the rate limiter", ["bucket", "tier"])
+RATE_LIMIT_UNREADABLE = Counter(
+    "rate_limit_unreadable_bodies_total", "Bodies the rate limiter couldn't read (charged as one attempt)")
+RATE_LIMIT_REDIS_ERRORS = Counter(
+    "rate_limit_redis_errors_total", "Rate limiter Redis calls that failed (request let through)")
+EMAIL_FILTER_LOOKUPS = Counter(
+    "email_filter_lookups_total", "Email filter answers (absent means the DB was skipped)", ["result"])
+EMAIL_FILTER_FALSE_POSITIVES = Counter(
+    "email_filter_false_positives_total", "Emails the filter passed on that the DB didn't have")
+TOTP_REJECTIONS = Counter(
+    "totp_rejections_total", "TOTP codes refused, by reason (cached means no lookup was needed)", ["reason"])
+TOTP_CACHE_REDIS_ERRORS = Counter(
+    "totp_cache_redis_errors_total", "TOTP cache Redis calls that failed (code checked without it)")
+TOTP_SECRET_CACHE_LOOKUPS = Counter(
+    "totp_secret_cache_lookups_total", "TOTP secret cache lookups (a hit saves two Barbican calls)", ["result"])
+
+
+@contextmanager
+def track_work(step):
+    """Time a local CPU-bound step and wrap it in an internal span."""
+    started = time.perf_counter()
+    try:
+        with traced(step):
+            yield
+    finally:
+        WORK_SECONDS.labels(step).observe(time.perf_counter() - started)
+
+
+class InstrumentedCursor:
+    """Times and traces every execute() on a DB-API cursor; the rest is passed through."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        try:
+            with traced("db.query", kind=SpanKind.CLIENT, **{"db.system": "postgresql", "db.statement": query}):
+                return self._cursor.execute(query, params)
+        finally:
+            count_query(time.perf_counter() - started)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrument_connection(conn):
+    return InstrumentedConnection(conn) if conn is not None else None
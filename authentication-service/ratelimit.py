@@ -0,0 +1,342 @@
+import ipaddress
+import json
+import math
+import os
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode,
+    OperationDefinitionNode, VariableNode, parse,
+)
+from starlette.responses import JSONResponse
+from metrics import RATE_LIMIT_REDIS_ERRORS, RATE_LIMIT_REJECTIONS, RATE_LIMIT_UNREADABLE
+
+# Token-bucket throttling for login/signup, applied to the raw request before
+# Strawberry runs, so a refused attempt costs no DB lookup, password hash or
+# Barbican call.
+#
+# Limits are "burst/seconds": up to `burst` attempts at once, refilled at
+# `burst` per `seconds`. An empty value switches that bucket off.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_GLOBAL = os.getenv('RATE_LIMIT_GLOBAL', '200/1')
+RATE_LIMIT_PER_IP = os.getenv('RATE_LIMIT_PER_IP', '60/60')
+RATE_LIMIT_PER_EMAIL = os.getenv('RATE_LIMIT_PER_EMAIL', '10/300')
+# Shared buckets for all replicas; without it each process limits on its own
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+# Comma-separated addresses/networks of the proxies in front of the service.
+# Requests from them are charged to the address they forwarded for (the
+# last X-Forwarded-For entry that isn't one of them); unset, to the peer.
+RATE_LIMIT_TRUSTED_PROXIES = os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '')
+
+# Root mutation fields that do expensive work for a caller-chosen email
+LIMITED_FIELDS = {"login", "signup"}
+# A slow Redis must not slow logins down; past this the request goes through
+REDIS_TIMEOUT = 0.1
+# Upper bound on local buckets (per IP/email keys come from the outside)
+MAX_LOCAL_BUCKETS = 100_000
+
+Bucket = namedtuple("Bucket", "name key burst rate cost")
+
+
+def parse_networks(spec):
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in spec.split(",") if part.strip()]
+
+
+def parse_limit(spec):
+    """"burst/seconds" -> (burst, tokens per second), or None when unset."""
+    if not spec:
+        return None
+    burst, seconds = spec.split("/")
+    return float(burst), float(burst) / float(seconds)
+
+
+def _root_fields(selection_set, fragments, seen):
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _root_fields(selection.selection_set, fragments, seen)
+        elif isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            if name in fragments and name not in seen:
+                seen.add(name)
+                yield from _root_fields(fragments[name].selection_set, fragments, seen)
+
+
+@lru_cache(maxsize=256)
+def limited_fields(query, operation_name):
+    """(field, email) pairs for the limited mutations a document would run.
+
+    ``email`` is ("variable", name) or ("value", literal). Aliases and
+    fragments are followed, so one document can't hide a hundred logins
+    behind a single request. Clients send the same few documents, so the
+    parse is cached. None if the document doesn't parse.
+    """
+    try:
+        document = parse(query)
+    except GraphQLError:
+        return None
+    fragments = {d.name.value: d for d in document.definitions if isinstance(d, FragmentDefinitionNode)}
+    found = []
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinitionNode) or definition.operation.value != "mutation":
+            continue
+        if operation_name and (definition.name is None or definition.name.value != operation_name):
+            continue
+        for field in _root_fields(definition.selection_set, fragments, set()):
+            if field.name.value not in LIMITED_FIELDS:
+                continue
+            email = ("value", None)
+            for argument in field.arguments:
+                if argument.name.value == "email":
+                    if isinstance(argument.value, VariableNode):
+                        email = ("variable", argument.value.name.value)
+                    else:
+                        email = ("value", getattr(argument.value, "value", None))
+            found.append((field.name.value, email))
+    return tuple(found)
+
+
+def attempted_emails(body):
+    """Emails of the login/signup attempts in a GraphQL JSON body (may repeat).
+
+    None if the body isn't a JSON object with a query that parses: what it
+    would do can't be told, so it is charged as one attempt of unknown email.
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("query"), str):
+        return None
+    variables = data.get("variables") if isinstance(data.get("variables"), dict) else {}
+    operation_name = data.get("operationName") if isinstance(data.get("operationName"), str) else None
+    fields = limited_fields(data["query"], operation_name)
+    if fields is None:
+        return None
+    emails = []
+    for _, (kind, value) in fields:
+        if kind == "variable":
+            value = variables.get(value)
+        emails.append(value.strip().lower() if isinstance(value, str) else "")
+    return emails
+
+
+class LocalBuckets:
+    """In-process token buckets; the least recently used are dropped first."""
+
+    def __init__(self, max_buckets=MAX_LOCAL_BUCKETS):
+        self._buckets = OrderedDict()
+        self._max_buckets = max_buckets
+
+    def _level(self, bucket, now):
+        state = self._buckets.get(bucket.key)
+        if state is None:
+            return bucket.burst
+        tokens, updated = state
+        return min(bucket.burst, tokens + (now - updated) * bucket.rate)
+
+    def take(self, buckets):
+        """Take every bucket's cost, or nothing. Returns the first bucket short, with its wait."""
+        now = time.monotonic()
+        levels = []
+        for bucket in buckets:
+            level = self._level(bucket, now)
+            if level < bucket.cost:
+                return bucket, (bucket.cost - level) / bucket.rate
+            levels.append(level)
+        for bucket, level in zip(buckets, levels):
+            self._buckets[bucket.key] = (level - bucket.cost, now)
+            self._buckets.move_to_end(bucket.key)
+        while len(self._buckets) > self._max_buckets:
+            self._buckets.popitem(last=False)
+        return None
+
+    def refund(self, buckets):
+        for bucket in buckets:
+            if bucket.key in self._buckets:
+                tokens, updated = self._buckets[bucket.key]
+                self._buckets[bucket.key] = (min(bucket.burst, tokens + bucket.cost), updated)
+
+
+# Same algorithm as LocalBuckets.take, atomically over all buckets of a request.
+# KEYS: bucket keys. ARGV: burst, rate, cost for each key in turn.
+# Returns {0} on success, or {index of the bucket short, seconds to wait}.
+TAKE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+for i, key in ipairs(KEYS) do
+  local burst, rate, cost = tonumber(ARGV[3*i-2]), tonumber(ARGV[3*i-1]), tonumber(ARGV[3*i])
+  local state = redis.call('HMGET', key, 'tokens', 'updated')
+  local level = burst
+  if state[1] then
+    level = math.min(burst, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate)
+  end
+  if level < cost then
+    return {i, tostring((cost - level) / rate)}
+  end
+  levels[i] = level
+end
+for i, key in ipairs(KEYS) do
+  local burst, rate, cost = tonumber(ARGV[3*i-2]), tonumber(ARGV[3*i-1]), tonumber(ARGV[3*i])
+  redis.call('HSET', key, 'tokens', tostring(levels[i] - cost), 'updated', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return {0}
+"""
+
+
+class RateLimiter:
+    """Local buckets first, then (if configured) the shared Redis buckets.
+
+    A process only ever sees part of the cluster's traffic, so its local
+    bucket is never emptier than the shared one: a local refusal is final
+    and costs no round trip. Requests the local tier lets through are
+    checked against Redis; if Redis is unavailable they go through.
+    """
+
+    def __init__(self, redis_client=None):
+        self.local = LocalBuckets()
+        self.redis = redis_client
+        self._take = redis_client.register_script(TAKE_SCRIPT) if redis_client is not None else None
+
+    async def acquire(self, buckets):
+        refused = self.local.take(buckets)
+        if refused:
+            RATE_LIMIT_REJECTIONS.labels(refused[0].name, "local").inc()
+            return refused
+        if self._take is None:
+            return None
+        args = []
+        for bucket in buckets:
+            args += [bucket.burst, bucket.rate, bucket.cost]
+        try:
+            result = await self._take(keys=[bucket.key for bucket in buckets], args=args)
+        except Exception as e:
+            RATE_LIMIT_REDIS_ERRORS.inc()
+            print(f"Rate limiter Redis call failed, allowing request: {e}")
+            return None
+        if int(result[0]) == 0:
+            return None
+        # The shared bucket is the authority; don't charge the local one
+        self.local.refund(buckets)
+        bucket = buckets[int(result[0]) - 1]
+        RATE_LIMIT_REJECTIONS.labels(bucket.name, "redis").inc()
+        return bucket, float(result[1])
+
+
+class RateLimitMiddleware:
+    """ASGI middleware throttling login/signup per email, per client IP and globally.
+
+    Only POSTs to ``path`` are inspected. The body is read here and
+    replayed to the app, so it is parsed as JSON once more by Strawberry;
+    everything else passes through untouched.
+    """
+
+    def __init__(self, app, path, limiter=None, global_limit=RATE_LIMIT_GLOBAL,
+                 ip_limit=RATE_LIMIT_PER_IP, email_limit=RATE_LIMIT_PER_EMAIL,
+                 trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES):
+        self.app = app
+        self.path = path
+        self.limiter = limiter or RateLimiter(_redis_client())
+        self.limits = {
+            "global": parse_limit(global_limit),
+            "ip": parse_limit(ip_limit),
+            "email": parse_limit(email_limit),
+        }
+        self.trusted_proxies = parse_networks(trusted_proxies)
+        self._warned_forwarded = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        emails = attempted_emails(body)
+        if emails is None:
+            RATE_LIMIT_UNREADABLE.inc()
+        if emails is None or emails:
+            refused = await self.limiter.acquire(self._buckets(scope, emails))
+            if refused:
+                bucket, wait = refused
+                response = JSONResponse({"error": "Too many requests"}, status_code=429,
+                                        headers={"Retry-After": str(max(1, math.ceil(wait)))})
+                await response(scope, receive, send)
+                return
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+    def client_ip(self, scope):
+        """The caller's address: the peer, or who a trusted proxy forwarded for."""
+        client = scope.get("client")
+        peer = client[0] if client else "unknown"
+        forwarded = [value.decode("latin-1") for name, value in scope.get("headers", ()) if name == b"x-forwarded-for"]
+        if not forwarded:
+            return peer
+        if not self._trusted(peer):
+            if not self._warned_forwarded:
+                self._warned_forwarded = True
+                print(f"Rate limiter: X-Forwarded-For from {peer}, which isn't in RATE_LIMIT_TRUSTED_PROXIES; "
+                      "charging the peer address")
+            return peer
+        # Walk back from the nearest hop; the first address no trusted proxy
+        # owns is the client, anything before it could be made up
+        hops = [hop.strip() for value in forwarded for hop in value.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not self._trusted(hop):
+                return hop
+        return hops[0] if hops else peer
+
+    def _trusted(self, address):
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def _buckets(self, scope, emails):
+        # A body that couldn't be read counts as one attempt, for no email
+        attempts = 1 if emails is None else len(emails)
+        keys = {
+            "global": (None, attempts),
+            "ip": (self.client_ip(scope), attempts),
+        }
+        buckets = []
+        for name, (value, cost) in keys.items():
+            if self.limits[name]:
+                key = "{ratelimit}:" + name if value is None else f"{{ratelimit}}:{name}:{value}"
+                buckets.append(Bucket(name, key, *self.limits[name], cost))
+        if self.limits["email"] and emails:
+            for email in set(emails):
+                buckets.append(Bucket("email", f"{{ratelimit}}:email:{email}", *self.limits["email"],
+                                      emails.count(email)))
+        return buckets
+
+
+def _redis_client():
+    if not RATE_LIMIT_REDIS_URL:
+        return None
+    import redis.asyncio
+    return redis.asyncio.from_url(RATE_LIMIT_REDIS_URL, socket_timeout=REDIS_TIMEOUT,
+                                  socket_connect_timeout=REDIS_TIMEOUT)
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from metrics import TOTP_SECRET_CACHE_LOOKUPS
+
+# Cache of TOTP secrets so most logins skip the two Barbican calls (and the
+# Keystone token behind them). Secrets are only ever held encrypted with a
+# Fernet data key that is itself stored in Barbican, so a dump of the cache
+# or a stray log line doesn't give them away. The key is in process memory
+# while the service runs.
+TOTP_SECRET_CACHE_ENABLED = os.getenv('TOTP_SECRET_CACHE_ENABLED', '0') == '1'
+TOTP_SECRET_CACHE_TTL = float(os.getenv('TOTP_SECRET_CACHE_TTL', '300'))
+TOTP_SECRET_CACHE_SIZE = int(os.getenv('TOTP_SECRET_CACHE_SIZE', '10000'))
+# Name of the Barbican secret holding the data key; created if missing
+TOTP_SECRET_CACHE_KEY_NAME = os.getenv('TOTP_SECRET_CACHE_KEY_NAME', 'totp-secret-cache data key')
+# Keep a version number per user in Redis, bumped whenever a secret is
+# stored, so every replica drops its copy of a replaced secret at once.
+# Without it only the replica that stored the secret forgets the old one;
+# the others keep it until the TTL.
+TOTP_SECRET_CACHE_REDIS_URL = os.getenv('TOTP_SECRET_CACHE_REDIS_URL')
+
+# After failing to get the data key, the cache stays out of the way this long
+KEY_RETRY_SECONDS = 60
+REDIS_TIMEOUT = 0.1
+
+
+class TotpSecretCache:
+    """Encrypted TOTP secrets by user id, with a TTL and LRU eviction.
+
+    ``load_key()`` returns the Fernet data key; it is called on first use.
+    While it can't be had, the cache does nothing and every lookup goes
+    to Barbican. ``versions`` is a Redis client holding the version of each
+    user's secret; ``get`` returns the version it saw, to be handed back to
+    ``put`` with the secret fetched after it. If Redis can't be read
+    nothing is cached.
+    """
+
+    def __init__(self, load_key, ttl=TOTP_SECRET_CACHE_TTL, max_entries=TOTP_SECRET_CACHE_SIZE, versions=None):
+        self._load_key = load_key
+        self.versions = versions
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._fernet = None
+        self._retry_key_at = 0.0
+        # user id -> (encrypted secret, expires at, version)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_lock = threading.Lock()
+
+    def _cipher(self):
+        if self._fernet is None and time.monotonic() >= self._retry_key_at:
+            with self._key_lock:
+                if self._fernet is None and time.monotonic() >= self._retry_key_at:
+                    try:
+                        self._fernet = Fernet(self._load_key())
+                    except Exception as e:
+                        self._retry_key_at = time.monotonic() + KEY_RETRY_SECONDS
+                        print(f"TOTP secret cache has no data key, using Barbican directly: {e}")
+        return self._fernet
+
+    def _version(self, user_id):
+        if self.versions is None:
+            return 0
+        try:
+            return int(self.versions.get(f"totp-secret-version:{user_id}") or 0)
+        except Exception as e:
+            print(f"Error reading TOTP secret version, using Barbican directly: {e}")
+            return None
+
+    def get(self, user_id):
+        """(secret or None, version)."""
+        fernet = self._cipher()
+        if fernet is None:
+            return None, None
+        version = self._version(user_id)
+        if version is None:
+            TOTP_SECRET_CACHE_LOOKUPS.labels("miss").inc()
+            return None, None
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] <= time.monotonic() or entry[2] != version):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            TOTP_SECRET_CACHE_LOOKUPS.labels("miss").inc()
+            return None, version
+        try:
+            secret = fernet.decrypt(entry[0]).decode("utf-8")
+        except InvalidToken:
+            with self._lock:
+                self._entries.pop(key, None)
+            TOTP_SECRET_CACHE_LOOKUPS.labels("miss").inc()
+            return None, version
+        TOTP_SECRET_CACHE_LOOKUPS.labels("hit").inc()
+        return secret, version
+
+    def put(self, user_id, secret, version):
+        """Cache ``secret``, fetched after ``get`` returned ``version``."""
+        fernet = self._cipher()
+        if fernet is None or version is None:
+            return
+        token = fernet.encrypt(secret.encode("utf-8"))
+        key = str(user_id)
+        with self._lock:
+            self._entries[key] = (token, time.monotonic() + self.ttl, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Forget a user's secret, in every replica when there is Redis. Call after a new one is stored."""
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+        if self.versions is not None:
+            try:
+                self.versions.incr(f"totp-secret-version:{user_id}")
+            except Exception as e:
+                print(f"Error bumping TOTP secret version, other replicas keep the old one up to the TTL: {e}")
+
+
+def version_store():
+    """Redis client for the secret versions, or None without TOTP_SECRET_CACHE_REDIS_URL."""
+    if not TOTP_SECRET_CACHE_REDIS_URL:
+        return None
+    import redis
+    return redis.from_url(TOTP_SECRET_CACHE_REDIS_URL, socket_timeout=REDIS_TIMEOUT,
+                          socket_connect_timeout=REDIS_TIMEOUT)
@@ -0,0 +1,170 @@
+"""What the email filter answers, in process memory and in Redis, and when it is on.
+
+    cd authentication-service && PYTHONPATH=.. python -m unittest
+"""
+import unittest
+from unittest import mock
+
+import emailfilter
+from emailfilter import BloomFilter, EmailFilter, RedisBloomFilter, filter_size
+
+BITS, HASHES = filter_size(200, 0.01)
+REGISTERED = [f"user{n}@example.com" for n in range(200)]
+STRANGERS = [f"stranger{n}@example.org" for n in range(2000)]
+
+
+class Bitfield:
+    def __init__(self, redis, key):
+        self.redis = redis
+        self.key = key
+        self.operations = []
+
+    def get(self, kind, offset):
+        self.operations.append((kind, offset, None))
+        return self
+
+    def set(self, kind, offset, value):
+        self.operations.append((kind, offset, value))
+        return self
+
+    def execute(self):
+        return self.redis.run(self.key, self.operations)
+
+
+class Redis:
+    """The commands RedisBloomFilter uses, with BITFIELD's bit order (offset 0 is the high bit)."""
+
+    def __init__(self):
+        self.values = {}
+        self.down = False
+
+    def check(self):
+        if self.down:
+            raise ConnectionError("redis is down")
+
+    def bitfield(self, key):
+        return Bitfield(self, key)
+
+    def run(self, key, operations):
+        self.check()
+        value = self.values.setdefault(key, bytearray())
+        results = []
+        for kind, offset, new in operations:
+            assert kind == "u1"
+            byte, mask = offset >> 3, 0x80 >> (offset & 7)
+            if byte >= len(value):
+                value.extend(bytes(byte + 1 - len(value)))
+            results.append(1 if value[byte] & mask else 0)
+            if new is not None:
+                value[byte] = value[byte] | mask if new else value[byte] & ~mask
+        return results
+
+    def set(self, key, value, nx=False, ex=None):
+        self.check()
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        self.check()
+        self.values.pop(key, None)
+
+
+def built(bloom):
+    bloom.add_many(REGISTERED)
+    bloom.finish_build()
+    return bloom
+
+
+class BloomFilterTest(unittest.TestCase):
+    def test_redis_filter_answers_like_the_local_one(self):
+        local = built(BloomFilter(BITS, HASHES))
+        shared = built(RedisBloomFilter(Redis(), BITS, HASHES))
+
+        for email in REGISTERED + STRANGERS:
+            self.assertEqual(shared.contains(email), local.contains(email), email)
+        self.assertTrue(all(shared.contains(email) for email in REGISTERED))
+        # Most strangers are ruled out, as sized
+        self.assertLess(sum(map(shared.contains, STRANGERS)), len(STRANGERS) * 0.05)
+
+    def test_filters_answer_nothing_until_built(self):
+        for bloom in (BloomFilter(BITS, HASHES), RedisBloomFilter(Redis(), BITS, HASHES)):
+            bloom.add_many(REGISTERED)
+            self.assertIsNone(bloom.contains(REGISTERED[0]))
+
+    def test_one_replica_builds_the_shared_filter(self):
+        redis = Redis()
+        a, b = RedisBloomFilter(redis, BITS, HASHES), RedisBloomFilter(redis, BITS, HASHES)
+
+        self.assertTrue(a.claim_build())
+        self.assertFalse(b.claim_build())
+        built(a)
+        a.release_build()
+        self.assertFalse(b.claim_build())
+
+    def test_signup_on_one_replica_is_seen_by_another(self):
+        redis = Redis()
+        a = EmailFilter(built(RedisBloomFilter(redis, BITS, HASHES)))
+        b = EmailFilter(RedisBloomFilter(redis, BITS, HASHES))
+
+        a.add("new@example.com")
+
+        self.assertTrue(b.lookup("new@example.com"))
+
+
+class EmailFilterTest(unittest.TestCase):
+    def test_lookups_go_to_the_database_while_redis_is_down(self):
+        redis = Redis()
+        email_filter = EmailFilter(built(RedisBloomFilter(redis, BITS, HASHES)))
+        redis.down = True
+
+        self.assertIsNone(email_filter.lookup(STRANGERS[0]))
+
+    def test_filter_that_missed_a_signup_is_dropped(self):
+        redis = Redis()
+        bloom = built(RedisBloomFilter(redis, BITS, HASHES))
+        email_filter = EmailFilter(bloom)
+        # Only the write fails; the delete that follows gets through
+        with mock.patch.object(bloom, "_set", side_effect=ConnectionError("redis is down")):
+            email_filter.add("new@example.com")
+
+        self.assertNotIn(bloom.key, redis.values)
+        self.assertIsNone(email_filter.lookup("new@example.com"))
+
+    def test_lost_filter_reads_as_unknown(self):
+        redis = Redis()
+        email_filter = EmailFilter(built(RedisBloomFilter(redis, BITS, HASHES)))
+        redis.values.clear()
+
+        self.assertIsNone(email_filter.lookup(REGISTERED[0]))
+
+
+class ConfigurationTest(unittest.TestCase):
+    def configured(self, **settings):
+        settings = {"EMAIL_FILTER_ENABLED": True, "EMAIL_FILTER_REDIS_URL": None,
+                    "EMAIL_FILTER_SINGLE_REPLICA": False, "EMAIL_FILTER_CAPACITY": 200, **settings}
+        with mock.patch.multiple(emailfilter, **settings), mock.patch("builtins.print"):
+            return emailfilter._email_filter()
+
+    def test_off_unless_enabled(self):
+        self.assertIsNone(self.configured(EMAIL_FILTER_ENABLED=False, EMAIL_FILTER_SINGLE_REPLICA=True))
+
+    def test_in_process_filter_needs_single_replica(self):
+        self.assertIsNone(self.configured())
+
+    def test_in_process_filter_on_a_single_replica(self):
+        email_filter = self.configured(EMAIL_FILTER_SINGLE_REPLICA=True)
+
+        self.assertIsInstance(email_filter.bloom, BloomFilter)
+        self.assertFalse(email_filter.shared)
+
+    def test_redis_filter_needs_no_single_replica(self):
+        email_filter = self.configured(EMAIL_FILTER_REDIS_URL="redis://localhost:6379/0")
+
+        self.assertIsInstance(email_filter.bloom, RedisBloomFilter)
+        self.assertTrue(email_filter.shared)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Requests the rate limiter must charge, and whom it charges them to.
+
+    cd authentication-service && PYTHONPATH=.. python -m unittest
+"""
+import asyncio
+import json
+import unittest
+
+from ratelimit import RateLimiter, RateLimitMiddleware, attempted_emails
+
+LOGIN = "mutation($email: String!) { login(email: $email, password: \"x\", otp: \"1\") { info } }"
+
+
+async def ok_app(scope, receive, send):
+    await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def post(middleware, body, client="203.0.113.9", forwarded=None):
+    """Status the middleware answers a POST to /authentication with."""
+    headers = [(b"content-type", b"application/json")]
+    if forwarded:
+        headers.append((b"x-forwarded-for", forwarded.encode()))
+    scope = {"type": "http", "method": "POST", "path": "/authentication", "headers": headers,
+             "client": (client, 40000)}
+    body = body if isinstance(body, bytes) else json.dumps(body).encode()
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent[0]["status"]
+
+
+def limiter(**kwargs):
+    options = {"global_limit": "", "ip_limit": "2/3600", "email_limit": ""}
+    options.update(kwargs)
+    return RateLimitMiddleware(ok_app, "/authentication", limiter=RateLimiter(), **options)
+
+
+class AttemptedEmailsTest(unittest.TestCase):
+    def test_unreadable_bodies(self):
+        for body in (b"not json", b"[]", b'[{"query": "mutation { login }"}]', b'"login"', b"3",
+                     b'{"query": 5}', b'{"query": "mutation {"}'):
+            with self.subTest(body=body):
+                self.assertIsNone(attempted_emails(body))
+
+    def test_no_limited_fields(self):
+        self.assertEqual(attempted_emails(json.dumps({"query": "{ __typename }"})), [])
+
+    def test_aliases_and_fragments_all_count(self):
+        query = """
+            mutation { a: login(email: "A@x.io", password: "p", otp: "1") { info } ...more }
+            fragment more on Mutation { b: login(email: "b@x.io", password: "p", otp: "1") { info } }
+        """
+        self.assertEqual(sorted(attempted_emails(json.dumps({"query": query}))), ["a@x.io", "b@x.io"])
+
+
+class RateLimitMiddlewareTest(unittest.TestCase):
+    def test_unreadable_bodies_are_charged_to_the_ip(self):
+        middleware = limiter()
+        self.assertEqual([post(middleware, body) for body in (b"[]", b"nope", b"{}")], [200, 200, 429])
+
+    def test_batched_logins_are_charged_to_the_global_bucket(self):
+        middleware = limiter(ip_limit="", global_limit="2/3600")
+        batch = [{"query": LOGIN, "variables": {"email": "victim@x.io"}}] * 50
+        self.assertEqual([post(middleware, batch) for _ in range(3)], [200, 200, 429])
+
+    def test_reads_are_free(self):
+        middleware = limiter()
+        self.assertEqual({post(middleware, {"query": "{ __typename }"}) for _ in range(5)}, {200})
+
+    def test_forwarded_for_is_ignored_from_untrusted_peers(self):
+        middleware = limiter()
+        statuses = [post(middleware, {"query": LOGIN, "variables": {"email": "a@x.io"}}, forwarded=f"198.51.100.{i}")
+                    for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_clients_behind_a_trusted_proxy_get_their_own_bucket(self):
+        middleware = limiter(trusted_proxies="10.0.0.0/8")
+        body = {"query": LOGIN, "variables": {"email": "a@x.io"}}
+        for i in range(3):
+            self.assertEqual(post(middleware, body, client="10.0.0.2", forwarded=f"198.51.100.{i}, 10.0.0.7"), 200)
+        # A spoofed first hop doesn't help: the proxy appended the real address
+        statuses = [post(middleware, body, client="10.0.0.2", forwarded=f"192.0.2.{i}, 198.51.100.1")
+                    for i in range(2)]
+        self.assertEqual(statuses, [200, 429])
+
+
+if __name__ == "__main__":
+    unittest.main()
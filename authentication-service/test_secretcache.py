@@ -0,0 +1,77 @@
+"""When a cached TOTP secret stops being served.
+
+    cd authentication-service && PYTHONPATH=.. python -m unittest
+"""
+import unittest
+
+from cryptography.fernet import Fernet
+
+from secretcache import TotpSecretCache
+
+KEY = Fernet.generate_key()
+
+
+class Versions:
+    """The two Redis commands the cache uses, on a dict shared by the "replicas"."""
+
+    def __init__(self):
+        self.values = {}
+        self.down = False
+
+    def get(self, key):
+        if self.down:
+            raise ConnectionError("redis is down")
+        return self.values.get(key)
+
+    def incr(self, key):
+        if self.down:
+            raise ConnectionError("redis is down")
+        self.values[key] = int(self.values.get(key, 0)) + 1
+
+
+def replica(versions=None):
+    return TotpSecretCache(lambda: KEY, versions=versions)
+
+
+class TotpSecretCacheTest(unittest.TestCase):
+    def test_hit(self):
+        cache = replica()
+        _, version = cache.get(7)
+        cache.put(7, "OLD", version)
+        self.assertEqual(cache.get(7)[0], "OLD")
+
+    def test_new_secret_is_seen_by_every_replica(self):
+        versions = Versions()
+        a, b = replica(versions), replica(versions)
+        for cache in (a, b):
+            cache.put(7, "OLD", cache.get(7)[1])
+
+        a.invalidate(7)
+
+        self.assertEqual((a.get(7)[0], b.get(7)[0]), (None, None))
+
+    def test_lookup_racing_a_new_secret_is_not_cached(self):
+        versions = Versions()
+        a, b = replica(versions), replica(versions)
+        _, version = a.get(7)
+        # b stores a new secret while a is still fetching the old one
+        b.invalidate(7)
+        a.put(7, "OLD", version)
+        self.assertIsNone(a.get(7)[0])
+
+    def test_nothing_is_cached_while_redis_is_down(self):
+        versions = Versions()
+        cache = replica(versions)
+        cache.put(7, "OLD", cache.get(7)[1])
+        versions.down = True
+
+        secret, version = cache.get(7)
+        cache.put(7, "OLD", version)
+
+        self.assertIsNone(secret)
+        versions.down = False
+        self.assertEqual(cache.get(7)[0], "OLD")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Which TOTP codes are accepted, and how often.
+
+    cd authentication-service && PYTHONPATH=.. python -m unittest
+
+The Redis cases run on fakeredis (bench/requirements.txt), which runs the
+claim script; they are skipped without it.
+"""
+import unittest
+from unittest import mock
+
+import pyotp
+
+import totpcache
+from totpcache import TOTP_INTERVAL, LocalTotpCache, RedisTotpCache, TotpVerifier
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+SECRET = pyotp.random_base32()
+EMAIL = "ada@example.com"
+# Ten seconds into a time step
+NOW = 1_700_000_010.0
+STEP = int(NOW // TOTP_INTERVAL)
+
+
+def code(step):
+    return pyotp.TOTP(SECRET).generate_otp(step)
+
+
+class Down:
+    """A Redis client that can't reach the server."""
+
+    def register_script(self, script):
+        return self.fail
+
+    def fail(self, *args, **kwargs):
+        raise ConnectionError("redis is down")
+
+    exists = set = fail
+
+
+class ReplayTests:
+    def cache(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        patch = mock.patch.object(totpcache.time, "time", lambda: NOW)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.verifier = TotpVerifier(self.cache(), window=1)
+        self.secret_lookups = 0
+
+    def verify(self, totp_code, email=EMAIL):
+        def get_secret():
+            self.secret_lookups += 1
+            return SECRET
+        return self.verifier.verify(email, totp_code, get_secret)
+
+    def test_code_is_accepted_once(self):
+        self.assertTrue(self.verify(code(STEP)))
+        self.assertFalse(self.verify(code(STEP)))
+
+    def test_code_in_the_drift_window_is_accepted_once(self):
+        self.assertTrue(self.verify(code(STEP - 1)))
+        self.assertFalse(self.verify(code(STEP - 1)))
+
+    def test_codes_from_before_the_last_accepted_are_refused(self):
+        self.assertTrue(self.verify(code(STEP + 1)))
+        self.assertFalse(self.verify(code(STEP)))
+
+    def test_codes_outside_the_window_are_refused(self):
+        self.assertFalse(self.verify(code(STEP - 2)))
+        self.assertFalse(self.verify(code(STEP + 2)))
+
+    def test_a_wrong_code_again_skips_the_secret_lookup(self):
+        wrong = code(STEP - 5)
+        self.assertFalse(self.verify(wrong))
+        self.assertFalse(self.verify(wrong))
+        self.assertEqual(self.secret_lookups, 1)
+
+    def test_users_are_kept_apart(self):
+        self.assertTrue(self.verify(code(STEP)))
+        self.assertTrue(self.verify(code(STEP), email="grace@example.com"))
+
+
+class LocalTotpCacheTest(ReplayTests, unittest.TestCase):
+    def cache(self):
+        return LocalTotpCache()
+
+    def test_claims_expire(self):
+        cache = LocalTotpCache()
+        self.assertTrue(cache.claim(EMAIL, code(STEP), STEP, ttl=30))
+        with mock.patch.object(totpcache.time, "time", lambda: NOW + 31):
+            self.assertFalse(cache.refused(EMAIL, code(STEP), STEP + 1))
+            self.assertTrue(cache.claim(EMAIL, code(STEP + 1), STEP + 1, ttl=30))
+
+    def test_local_entries_are_bounded(self):
+        cache = LocalTotpCache(max_entries=10)
+        for n in range(20):
+            cache.remember_bad(f"user{n}@example.com", "000000", STEP, ttl=30)
+        self.assertEqual(len(cache._entries), 10)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisTotpCacheTest(ReplayTests, unittest.TestCase):
+    def cache(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        return RedisTotpCache(self.redis)
+
+    def test_replicas_share_the_claims(self):
+        other = TotpVerifier(RedisTotpCache(self.redis), window=1)
+        self.assertTrue(self.verify(code(STEP)))
+        self.assertFalse(other.verify(EMAIL, code(STEP), lambda: SECRET))
+
+
+class RedisDownTest(unittest.TestCase):
+    def setUp(self):
+        patches = [mock.patch.object(totpcache.time, "time", lambda: NOW), mock.patch("builtins.print")]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.verifier = TotpVerifier(RedisTotpCache(Down()), window=1)
+
+    def test_codes_are_checked_without_the_cache(self):
+        errors = totpcache.TOTP_CACHE_REDIS_ERRORS._value.get()
+
+        self.assertTrue(self.verifier.verify(EMAIL, code(STEP), lambda: SECRET))
+        self.assertFalse(self.verifier.verify(EMAIL, code(STEP - 5), lambda: SECRET))
+
+        # refused and claim for the first, refused and remember_bad for the second
+        self.assertEqual(totpcache.TOTP_CACHE_REDIS_ERRORS._value.get() - errors, 4)
+
+    def test_replays_get_through_while_it_is_down(self):
+        self.assertTrue(self.verifier.verify(EMAIL, code(STEP), lambda: SECRET))
+        self.assertTrue(self.verifier.verify(EMAIL, code(STEP), lambda: SECRET))
+
+
+if __name__ == "__main__":
+    unittest.main()
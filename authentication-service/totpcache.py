@@ -0,0 +1,178 @@
+import hmac
+import os
+import threading
+import time
+
+import pyotp
+
+from metrics import TOTP_CACHE_REDIS_ERRORS, TOTP_REJECTIONS, track_work
+
+# TOTP verification that remembers codes. A code is accepted once: after
+# that, it and every code from an earlier time step are refused for that
+# user (RFC 6238, section 5.2). A wrong code is remembered until the time
+# step changes, so resubmitting it costs a cache lookup instead of a DB
+# query and two Barbican calls. Both checks are keyed by email and run
+# before the user or the secret is looked up.
+TOTP_REPLAY_PROTECTION = os.getenv('TOTP_REPLAY_PROTECTION', '1') == '1'
+# Clock drift tolerated, in time steps either side of the current one
+TOTP_VALID_WINDOW = int(os.getenv('TOTP_VALID_WINDOW', '1'))
+# Share the cache between replicas; otherwise a code can be replayed once per process
+TOTP_CACHE_REDIS_URL = os.getenv('TOTP_CACHE_REDIS_URL')
+
+# pyotp's defaults, which the secrets handed out at signup use
+TOTP_INTERVAL = 30
+TOTP_DIGITS = 6
+REDIS_TIMEOUT = 0.1
+# Upper bound on local entries; the oldest go first
+MAX_LOCAL_ENTRIES = 100_000
+
+
+class LocalTotpCache:
+    """Expiring keys in process memory."""
+
+    def __init__(self, max_entries=MAX_LOCAL_ENTRIES):
+        # key -> (value, expires at)
+        self._entries = {}
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry[0]
+
+    def _set(self, key, value, ttl, now):
+        self._entries.pop(key, None)
+        self._entries[key] = (value, now + ttl)
+        if len(self._entries) > self._max_entries:
+            for stale in [k for k, (_, expires) in self._entries.items() if expires <= now]:
+                del self._entries[stale]
+            while len(self._entries) > self._max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def refused(self, email, code, step):
+        now = time.time()
+        with self._lock:
+            return (self._get(("used", email, code), now) is not None
+                    or self._get(("bad", email, code, step), now) is not None)
+
+    def remember_bad(self, email, code, step, ttl):
+        now = time.time()
+        with self._lock:
+            self._set(("bad", email, code, step), True, ttl, now)
+
+    def claim(self, email, code, step, ttl):
+        now = time.time()
+        with self._lock:
+            last = self._get(("step", email), now)
+            if last is not None and last >= step:
+                return False
+            self._set(("step", email), step, ttl, now)
+            self._set(("used", email, code), True, ttl, now)
+            return True
+
+
+# KEYS: last step key, used code key. ARGV: step, ttl in milliseconds.
+CLAIM_SCRIPT = """
+local last = tonumber(redis.call('GET', KEYS[1]))
+if last and last >= tonumber(ARGV[1]) then
+  return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+redis.call('SET', KEYS[2], 1, 'PX', ARGV[2])
+return 1
+"""
+
+
+class RedisTotpCache:
+    """The same keys in Redis, with Redis doing the expiry.
+
+    Keys of one user share the ``{email}`` hash tag, so the claim script
+    works on Redis Cluster.
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._claim = redis_client.register_script(CLAIM_SCRIPT)
+
+    def refused(self, email, code, step):
+        return self.redis.exists(f"totp:{{{email}}}:used:{code}", f"totp:{{{email}}}:bad:{code}:{step}") > 0
+
+    def remember_bad(self, email, code, step, ttl):
+        self.redis.set(f"totp:{{{email}}}:bad:{code}:{step}", 1, px=max(1, int(ttl * 1000)))
+
+    def claim(self, email, code, step, ttl):
+        keys = [f"totp:{{{email}}}:step", f"totp:{{{email}}}:used:{code}"]
+        return bool(self._claim(keys=keys, args=[step, max(1, int(ttl * 1000))]))
+
+
+class TotpVerifier:
+    """Checks codes within the drift window, consulting ``cache`` when there is one.
+
+    If the cache fails, codes are checked without it, as if replay
+    protection were off, and the failure is counted.
+    """
+
+    def __init__(self, cache=None, window=TOTP_VALID_WINDOW):
+        self.cache = cache
+        self.window = window
+
+    def _cached(self, method, *args):
+        try:
+            return getattr(self.cache, method)(*args)
+        except Exception as e:
+            TOTP_CACHE_REDIS_ERRORS.inc()
+            print(f"TOTP cache call failed, verifying without it: {e}")
+            return None
+
+    def verify(self, email, code, get_secret):
+        """Whether ``code`` is good for ``email``; ``get_secret()`` is only called when needed."""
+        code = str(code)
+        if len(code) != TOTP_DIGITS or not (code.isascii() and code.isdigit()):
+            TOTP_REJECTIONS.labels("malformed").inc()
+            return False
+        now = time.time()
+        step = int(now // TOTP_INTERVAL)
+        if self.cache is not None and self._cached("refused", email, code, step):
+            TOTP_REJECTIONS.labels("cached").inc()
+            return False
+
+        totp = pyotp.TOTP(get_secret())
+        matched = None
+        with track_work("totp_verify"):
+            for candidate in range(step - self.window, step + self.window + 1):
+                if hmac.compare_digest(totp.generate_otp(candidate), code):
+                    matched = candidate
+                    break
+
+        if matched is None:
+            TOTP_REJECTIONS.labels("invalid").inc()
+            if self.cache is not None:
+                # The same code could match once the step moves on (a fast client clock)
+                self._cached("remember_bad", email, code, step, (step + 1) * TOTP_INTERVAL - now)
+            return False
+        if self.cache is not None:
+            # Good until the matched step leaves the window
+            ttl = (matched + self.window + 1) * TOTP_INTERVAL - now
+            if self._cached("claim", email, code, matched, ttl) is False:
+                TOTP_REJECTIONS.labels("replay").inc()
+                return False
+        return True
+
+
+def _totp_verifier():
+    if not TOTP_REPLAY_PROTECTION:
+        return TotpVerifier()
+    if TOTP_CACHE_REDIS_URL:
+        import redis
+        client = redis.from_url(TOTP_CACHE_REDIS_URL, socket_timeout=REDIS_TIMEOUT,
+                                socket_connect_timeout=REDIS_TIMEOUT)
+        return TotpVerifier(RedisTotpCache(client))
+    return TotpVerifier(LocalTotpCache())
+
+
+totp_verifier = _totp_verifier()
@@ -7,6 +7,9 @@ from dotenv import load_dotenv
 from starlette.applications import Starlette
 from starlette.responses import JSONResponse
 from starlette.routing import Route
+from opentelemetry.trace import SpanKind
+from common.permissions import PERMISSION_CLAIM, permission_mask
+from common.tracing import AsgiTracingMiddleware, configure_tracing, traced
 
 # Load environment variables from .env
 load_dotenv()
@@ -22,7 +25,8 @@ def generate_jwt_token(user_id: str, permissions: list, expiration_minutes=15):
     expiration_time = datetime.utcnow() + timedelta(minutes=expiration_minutes)
     payload = {
         "sub": user_id,
-        "permissions": permissions,
+        # Bitmask of the granted permissions, see common/permissions.py
+        PERMISSION_CLAIM: permission_mask(permissions),
         "exp": expiration_time
     }
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
@@ -31,8 +35,9 @@ def generate_jwt_token(user_id: str, permissions: list, expiration_minutes=15):
 def set_session(token: str):
     payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
     session_id = base64.b64encode(os.urandom(24)).decode('utf-8')
-    redis_client.hset(session_id, "access_token", token)
-    redis_client.expire(session_id, timedelta(minutes=15))
+    with traced("redis.set_session", kind=SpanKind.CLIENT, **{"db.system": "redis"}):
+        redis_client.hset(session_id, "access_token", token)
+        redis_client.expire(session_id, timedelta(minutes=15))
     return session_id
 
 # Route to generate the token
@@ -43,9 +48,15 @@ async def generate_token_route(request):
 
     if not user_id or not permissions:
         return JSONResponse({"error": "Invalid request"}, status_code=400)
+    # A string would be read as one name per character, anything else fails in permission_mask
+    if not isinstance(permissions, list) or not all(isinstance(name, str) for name in permissions):
+        return JSONResponse({"error": "permissions must be a list of names"}, status_code=400)
 
     # Generate the JWT token
-    token = generate_jwt_token(user_id, permissions)
+    try:
+        token = generate_jwt_token(user_id, permissions)
+    except KeyError as e:
+        return JSONResponse({"error": f"Unknown permission: {e.args[0]}"}, status_code=400)
 
     # Optionally, store session in Redis
     set_session(token)
@@ -53,8 +64,10 @@ async def generate_token_route(request):
     return JSONResponse({"token": token})
 
 # Starlette app setup
+configure_tracing("authorization-service")
 app = Starlette(debug=True)
 app.add_route("/generate-token", generate_token_route, methods=["POST"])
+app.add_middleware(AsgiTracingMiddleware, paths=["/generate-token"])
 
 # Main entry point
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+"""Catalog ingestion throughput: per-item mutations vs addProducts vs ingest.py.
+
+    python bench/bulk_ingest.py --products 20000 --per-item-products 500 --batch-sizes 100,1000,5000
+
+Every product comes with ``--comments`` comments and ``--ratings`` ratings,
+and rows/s counts all three. ``per_item`` is how products are loaded
+today: one addProduct, then one addComment / addRating per child, each its
+own request and commit. ``add_products`` sends ``addProducts`` with
+``--batch-size`` products per request, and ``cli`` runs product/ingest.py
+on a JSONL file against the service's database, once per
+``--batch-sizes``; both then load the same SKUs again to time the update
+path of the upsert. ``--env`` works as in run.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from load import graphql
+from scenarios import ADD_COMMENT, ADD_PRODUCT, ADD_RATING, admin_token
+from services import Stack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADD_PRODUCTS = """
+mutation AddProducts($input: [ProductInput!]!) {
+  addProducts(input: $input) { ids comments ratings }
+}
+"""
+
+
+def items(args, prefix, count):
+    for i in range(count):
+        yield {
+            "sku": f"{prefix}-{i}",
+            "name": f"Product {i}",
+            "description": f"Bench product {i}",
+            "price": 5.0 + i % 50,
+            "comments": [f"Comment {c} on {i}" for c in range(args.comments)],
+            "ratings": [float(1 + (i + r) % 5) for r in range(args.ratings)],
+        }
+
+
+def rows(args, count):
+    return count * (1 + args.comments + args.ratings)
+
+
+def report(name, args, count, elapsed, **extra):
+    return {"mode": name, "products": count, "rows": rows(args, count), "seconds": round(elapsed, 2),
+            "rows_per_s": round(rows(args, count) / elapsed), **extra}
+
+
+async def per_item(args, stack):
+    url = stack.url("product")
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        token = await admin_token(client, stack)
+        started = time.perf_counter()
+        for item in items(args, "single", args.per_item_products):
+            data = await graphql(client, url, ADD_PRODUCT, {key: item[key] for key in ("name", "description", "price")},
+                                 token=token)
+            product_id = data["addProduct"]["id"]
+            for text in item["comments"]:
+                await graphql(client, url, ADD_COMMENT, {"productId": product_id, "text": text})
+            for score in item["ratings"]:
+                await graphql(client, url, ADD_RATING, {"productId": product_id, "score": score})
+        elapsed = time.perf_counter() - started
+    return report("per_item", args, args.per_item_products, elapsed)
+
+
+async def add_products(args, stack, prefix, name):
+    url = stack.url("product")
+    batch = []
+    async with httpx.AsyncClient(timeout=300.0) as client:
+        token = await admin_token(client, stack)
+        started = time.perf_counter()
+        for item in items(args, prefix, args.products):
+            batch.append(item)
+            if len(batch) == args.batch_size:
+                await graphql(client, url, ADD_PRODUCTS, {"input": batch}, token=token)
+                batch = []
+        if batch:
+            await graphql(client, url, ADD_PRODUCTS, {"input": batch}, token=token)
+        elapsed = time.perf_counter() - started
+    return report(name, args, args.products, elapsed, batch_size=args.batch_size)
+
+
+def cli(args, stack, path, batch_size, name):
+    uri = "sqlite:///" + os.path.join(stack.workdir, "product.sqlite3")
+    uri = stack.extra_env.get("PRODUCT_DATABASE_URI", uri)
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "ingest.py", path, "--batch-size", str(batch_size), "--database-uri", uri],
+        cwd=os.path.join(ROOT, "product"), env=stack._service_env("product"),
+        check=True, capture_output=True, text=True).stdout
+    elapsed = time.perf_counter() - started
+    # The CLI's own figure leaves out interpreter start-up
+    return report(name, args, args.products, elapsed, batch_size=batch_size,
+                  cli_rows_per_s=json.loads(output)["rows_per_second"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--per-item-products", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=2)
+    parser.add_argument("--ratings", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=1000, help="products per addProducts request")
+    parser.add_argument("--batch-sizes", default=[100, 1000, 5000],
+                        type=lambda value: [int(s) for s in value.split(",") if s], help="for the CLI")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE")
+    args = parser.parse_args(argv)
+
+    env = dict(item.split("=", 1) for item in args.env)
+    results = []
+    with Stack(services=("authorization", "product"), env=env) as stack:
+        print("running per_item ...", file=sys.stderr)
+        results.append(asyncio.run(per_item(args, stack)))
+        for name in ("add_products", "add_products_update"):
+            print(f"running {name} ...", file=sys.stderr)
+            results.append(asyncio.run(add_products(args, stack, "graphql", name)))
+        for batch_size in args.batch_sizes:
+            with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as jsonl:
+                for item in items(args, f"cli-{batch_size}", args.products):
+                    jsonl.write(json.dumps(item) + "\n")
+            try:
+                for name in ("cli", "cli_update"):
+                    print(f"running {name} with batches of {batch_size} ...", file=sys.stderr)
+                    results.append(cli(args, stack, jsonl.name, batch_size, name))
+            finally:
+                os.unlink(jsonl.name)
+    print(json.dumps({"parameters": {**vars(args), "env": env}, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Cart page load: one product(id) request per item vs one batched POST.
+
+    python bench/cart_batch.py --items 50 --pages 100 --concurrency 4 --db-latency-ms 5
+
+For each product server (``wsgi`` is app.py, ``asgi`` is asgi.py) a fresh
+stack is seeded with a catalog, then ``--pages`` cart pages of ``--items``
+products are loaded by ``--concurrency`` shoppers. ``separate`` sends one
+request per item, at most ``--parallel`` at a time like a browser's
+per-host connection limit; ``batched`` sends the page as one JSON array.
+Latency is per page. Also pays for ``--payments`` orders separately and as
+one batch, counting the order lookups payment sends to product.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+
+import httpx
+
+from load import graphql, run_load
+from scenarios import ADD_ORDER, PROCESS_PAYMENT, PRODUCT, seed_catalog
+from services import Stack
+
+
+async def scrape(client, url, pattern):
+    text = (await client.get(url.replace("/graphql", "/metrics"))).text
+    return sum(float(value) for value in re.findall(pattern, text))
+
+
+async def post_batch(client, url, operations):
+    response = await client.post(url, json=operations)
+    response.raise_for_status()
+    results = response.json()
+    if any(result.get("errors") for result in results):
+        raise RuntimeError([result["errors"] for result in results if result.get("errors")])
+    return [result["data"] for result in results]
+
+
+async def cart_pages(args, stack, product_ids, mode):
+    url = stack.url("product")
+    carts = [random.Random(page).sample(product_ids, args.items) for page in range(args.pages)]
+
+    async def separate(client, i):
+        limit = asyncio.Semaphore(args.parallel)
+
+        async def item(product_id):
+            async with limit:
+                return await graphql(client, url, PRODUCT, {"id": product_id})
+
+        data = await asyncio.gather(*(item(product_id) for product_id in carts[i]))
+        return all(d["product"] for d in data)
+
+    async def batched(client, i):
+        data = await post_batch(client, url, [{"query": PRODUCT, "variables": {"id": product_id}}
+                                              for product_id in carts[i]])
+        return all(d["product"] for d in data)
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        pattern = r"db_query_duration_seconds_count (\S+)"
+        before = await scrape(client, url, pattern)
+        result = await run_load(f"cart_{mode}", separate if mode == "separate" else batched,
+                                args.pages, args.concurrency)
+        result["db_queries_per_page"] = round((await scrape(client, url, pattern) - before) / args.pages, 1)
+    result["http_requests_per_page"] = args.items if mode == "separate" else 1
+    return result
+
+
+async def payments(args, stack, product_ids, mode):
+    product_url, payment_url = stack.url("product"), stack.url("payment")
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        order_ids = []
+        for i in range(args.payments):
+            data = await graphql(client, product_url, ADD_ORDER, {"productId": product_ids[i], "quantity": 1})
+            order_ids.append(data["addOrder"]["id"])
+
+        pattern = r'outbound_request_duration_seconds_count\{[^}]*target="product"[^}]*\} (\S+)'
+        before = await scrape(client, payment_url, pattern)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if mode == "separate":
+            for order_id in order_ids:
+                await graphql(client, payment_url, PROCESS_PAYMENT, {"orderId": order_id})
+        else:
+            await post_batch(client, payment_url, [{"query": PROCESS_PAYMENT, "variables": {"orderId": order_id}}
+                                                   for order_id in order_ids])
+        elapsed = loop.time() - started
+        lookups = await scrape(client, payment_url, pattern) - before
+    return {"mode": mode, "payments": args.payments, "duration_ms": round(elapsed * 1000, 1),
+            "order_lookups": int(lookups)}
+
+
+async def run_server(args, server):
+    env = {"BENCH_PRODUCT_SERVER": server, "BENCH_DB_LATENCY_MS": str(args.db_latency_ms)}
+    services = ("authorization", "product") + (("payment",) if args.payments else ())
+    with Stack(services=services, env=env) as stack:
+        product_ids = await seed_catalog(stack, max(args.products, args.items, args.payments))
+        report = {"server": server, "cart": [], "payments": []}
+        for mode in ("separate", "batched"):
+            print(f"running {server} {mode} ...", file=sys.stderr)
+            report["cart"].append(await cart_pages(args, stack, product_ids, mode))
+            if args.payments:
+                report["payments"].append(await payments(args, stack, product_ids, mode))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", default=["wsgi", "asgi"],
+                        type=lambda value: [s for s in value.split(",") if s])
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--parallel", type=int, default=6, help="requests in flight per page when separate")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--payments", type=int, default=10)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    args = parser.parse_args(argv)
+
+    report = [asyncio.run(run_server(args, server)) for server in args.servers]
+    print(json.dumps({"parameters": vars(args), "servers": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
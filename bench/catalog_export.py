@@ -0,0 +1,163 @@
+"""Peak RSS of the product service streaming the catalog vs building allProducts.
+
+    python bench/catalog_export.py --rows 5000000 --compare-rows 100000
+
+Seeds the product table straight into the service's SQLite file, then for
+each server (``wsgi`` is app.py, ``asgi`` is asgi.py) downloads
+``/export/products`` in every ``--formats`` from a fresh process while
+sampling its RSS, plus an incremental export with ``since`` set to the
+last ``--since-share`` of rows. ``--compare-rows`` runs the same RSS
+measurement for ``allProducts`` and the export on a smaller table, since
+allProducts on millions of rows needs more memory than most machines have.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from load import graphql
+from scenarios import ALL_PRODUCTS, admin_token
+from services import Stack
+
+EPOCH = datetime(2026, 1, 1)
+
+
+def rss_kib(pid, field="VmRSS"):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def updated_at(i):
+    # SQLAlchemy's SQLite DateTime format, one second apart
+    return (EPOCH + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def seed_products(path, rows):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("DELETE FROM products")
+        batch = 100_000
+        for start in range(0, rows, batch):
+            conn.executemany(
+                "INSERT INTO products (id, name, description, price, updated_at) VALUES (?, ?, ?, ?, ?)",
+                ((i + 1, f"Product {i}", f"Bench product {i}, exported in bulk", 5.0 + i % 50, updated_at(i))
+                 for i in range(start, min(rows, start + batch))))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def measure(stack, request):
+    """Run ``request(client, token)`` while sampling the product process's RSS every 20 ms."""
+    pid = stack.procs["product"].pid
+    async with httpx.AsyncClient(timeout=None) as client:
+        token = await admin_token(client, stack)
+        baseline = rss_kib(pid)
+        peak = baseline
+        done = asyncio.Event()
+
+        async def sample():
+            nonlocal peak
+            while not done.is_set():
+                peak = max(peak, rss_kib(pid))
+                await asyncio.sleep(0.02)
+
+        sampler = asyncio.create_task(sample())
+        started = time.perf_counter()
+        try:
+            result = await request(client, token)
+        finally:
+            done.set()
+            await sampler
+        elapsed = time.perf_counter() - started
+    peak = max(peak, rss_kib(pid))
+    return {**result, "duration_s": round(elapsed, 2), "baseline_rss_mib": round(baseline / 1024, 1),
+            "peak_rss_mib": round(peak / 1024, 1), "growth_mib": round((peak - baseline) / 1024, 1)}
+
+
+def export(fmt, since=None):
+    async def request(client, token):
+        params = {"format": fmt}
+        if since:
+            params["since"] = since
+        rows = size = 0
+        async with client.stream("GET", stack_url[0].replace("/graphql", "/export/products"), params=params,
+                                 headers={"Authorization": f"Bearer {token}"}) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                rows += chunk.count(b"\n")
+                size += len(chunk)
+        if fmt == "csv":
+            rows -= 1
+        return {"request": f"export {fmt}" + (" since" if since else ""), "rows": rows,
+                "mib": round(size / 2 ** 20, 1)}
+    return request
+
+
+async def all_products(client, token):
+    data = await graphql(client, stack_url[0], ALL_PRODUCTS)
+    return {"request": "allProducts", "rows": len(data["allProducts"])}
+
+
+# The URL of the stack currently running, for the request functions
+stack_url = [None]
+
+
+def run_requests(workdir, server, requests):
+    results = []
+    for request in requests:
+        # A fresh process per request, so each peak is its own
+        with Stack(services=("authorization", "product"), workdir=workdir,
+                   env={"BENCH_PRODUCT_SERVER": server}) as stack:
+            stack_url[0] = stack.url("product")
+            results.append({"server": server, **asyncio.run(measure(stack, request))})
+            print(f"  {results[-1]}", file=sys.stderr)
+    return results
+
+
+def prepare(workdir, rows):
+    # Let the service create its tables, then fill them directly
+    with Stack(services=("authorization", "product"), workdir=workdir):
+        pass
+    seed_products(os.path.join(workdir, "product.sqlite3"), rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--compare-rows", type=int, default=100_000, help="0 skips the allProducts comparison")
+    parser.add_argument("--servers", default=["wsgi", "asgi"], type=lambda value: [s for s in value.split(",") if s])
+    parser.add_argument("--formats", default=["ndjson", "csv"], type=lambda value: [f for f in value.split(",") if f])
+    parser.add_argument("--since-share", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    report = {"parameters": vars(args), "comparison": [], "export": []}
+    if args.compare_rows:
+        workdir = tempfile.mkdtemp(prefix="zt-export-")
+        print(f"seeding {args.compare_rows} rows ...", file=sys.stderr)
+        prepare(workdir, args.compare_rows)
+        for server in args.servers:
+            report["comparison"] += run_requests(workdir, server, [all_products, export("ndjson")])
+
+    workdir = tempfile.mkdtemp(prefix="zt-export-")
+    print(f"seeding {args.rows} rows ...", file=sys.stderr)
+    prepare(workdir, args.rows)
+    since = (EPOCH + timedelta(seconds=int(args.rows * (1 - args.since_share)))).isoformat() + "Z"
+    for server in args.servers:
+        requests = [export(fmt) for fmt in args.formats] + [export(args.formats[0], since)]
+        report["export"] += run_requests(workdir, server, requests)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Email Bloom filter: memory and accuracy in-process, DB queries saved end to end.
+
+    python bench/email_filter.py --users 20000 --requests 2000 --concurrency 20 --modes off,local,redis
+
+First sizes the filter for a few capacities and error rates, fills it, and
+measures its memory, real false-positive rate and lookup cost. Then seeds
+the authentication service's users table with ``--users`` rows and sends
+wrong-password logins, ``--unknown-share`` of them for emails that aren't
+registered, with the filter off, in-process and in Redis (fakeredis on a
+local port), counting the DB queries each run needed.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import httpx
+
+from load import graphql, run_load
+from login_burst import RedisServer
+from scenarios import LOGIN
+from serve import AUTH_SQLITE_SCHEMA
+from services import Stack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZES = [(100_000, 0.01), (1_000_000, 0.01), (1_000_000, 0.001)]
+
+
+def load_emailfilter():
+    # Imported by path: the module lives in the service, next to its metrics.py
+    # (which needs the repository root for ``common``)
+    sys.path[:0] = [os.path.join(ROOT, "authentication-service"), ROOT]
+    spec = importlib.util.spec_from_file_location(
+        "emailfilter", os.path.join(ROOT, "authentication-service", "emailfilter.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def sizing(probes):
+    emailfilter = load_emailfilter()
+    results = []
+    for capacity, error_rate in SIZES:
+        bits, hashes = emailfilter.filter_size(capacity, error_rate)
+        bloom = emailfilter.BloomFilter(bits, hashes)
+        started = time.perf_counter()
+        bloom.add_many(f"user-{i}@bench.example.com" for i in range(capacity))
+        build_s = time.perf_counter() - started
+        bloom.finish_build()
+        started = time.perf_counter()
+        false_positives = sum(bool(bloom.contains(f"stranger-{i}@bench.example.com")) for i in range(probes))
+        lookup_s = time.perf_counter() - started
+        results.append({
+            "capacity": capacity,
+            "error_rate": error_rate,
+            "hashes": hashes,
+            "bytes": bloom.nbytes,
+            "mib_per_million_users": round(bloom.nbytes / capacity * 1_000_000 / 2 ** 20, 3),
+            "measured_false_positive_rate": round(false_positives / probes, 5),
+            "build_emails_per_s": round(capacity / build_s),
+            "lookup_us": round(lookup_s / probes * 1e6, 2),
+        })
+    return results
+
+
+def seed_users(path, users):
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(AUTH_SQLITE_SCHEMA)
+        conn.executemany("INSERT INTO users (email, password) VALUES (?, ?)",
+                         ((f"user-{i}@bench.example.com", "pbkdf2:sha256:1$x$x") for i in range(users)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def scrape(client, stack, pattern):
+    text = (await client.get(stack.url("authentication").replace("/authentication", "/metrics"))).text
+    return sum(float(value) for value in re.findall(pattern, text))
+
+
+async def wait_for_filter(client, stack, timeout=60.0):
+    """Lookups use the DB until the startup build is done; wait for the first real answer."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await graphql(client, stack.url("authentication"), LOGIN,
+                      {"email": "warmup@bench.example.com", "password": "x", "totpCode": "000000"})
+        if await scrape(client, stack, r'email_filter_lookups_total\{result="absent"\} (\S+)'):
+            return
+        await asyncio.sleep(0.2)
+    raise RuntimeError("email filter was not built in time")
+
+
+async def logins(args, stack, filtered):
+    url = stack.url("authentication")
+
+    def email(i):
+        if i % 100 < args.unknown_share * 100:
+            return f"stranger-{i}@bench.example.com"
+        return f"user-{i % args.users}@bench.example.com"
+
+    async def step(client, i):
+        data = await graphql(client, url, LOGIN, {"email": email(i), "password": "wrong", "totpCode": "000000"})
+        return data["login"]["info"] in ("User does not exist", "Invalid credentials")
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        if filtered:
+            await wait_for_filter(client, stack)
+        queries = r"db_query_duration_seconds_count (\S+)"
+        lookups = r'email_filter_lookups_total\{result="absent"\} (\S+)'
+        before = (await scrape(client, stack, queries), await scrape(client, stack, lookups))
+        result = await run_load("login_mixed", step, args.requests, args.concurrency)
+        after = (await scrape(client, stack, queries), await scrape(client, stack, lookups))
+    result["db_queries"] = int(after[0] - before[0])
+    result["db_queries_skipped"] = int(after[1] - before[1])
+    return result
+
+
+def end_to_end(args, mode):
+    env = {"EMAIL_FILTER_ENABLED": "0" if mode == "off" else "1",
+           "EMAIL_FILTER_CAPACITY": str(max(args.users, 1000))}
+    if mode == "redis":
+        with RedisServer() as redis_server:
+            env["EMAIL_FILTER_REDIS_URL"] = redis_server.url
+            return run_stack(args, env, mode != "off")
+    if mode == "local":
+        # The bench runs the service as one process
+        env["EMAIL_FILTER_SINGLE_REPLICA"] = "1"
+    return run_stack(args, env, mode != "off")
+
+
+def run_stack(args, env, filtered):
+    stack = Stack(services=("authentication",), env=env)
+    seed_users(stack.auth_db_path, args.users)
+    with stack:
+        return asyncio.run(logins(args, stack, filtered))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default=["off", "local", "redis"],
+                        type=lambda value: [m for m in value.split(",") if m])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--unknown-share", type=float, default=0.9,
+                        help="fraction of logins for emails that aren't registered")
+    parser.add_argument("--probes", type=int, default=100000, help="unknown emails for the false-positive rate")
+    args = parser.parse_args(argv)
+
+    print("sizing ...", file=sys.stderr)
+    report = {"parameters": vars(args), "sizing": sizing(args.probes), "logins": []}
+    for mode in args.modes:
+        print(f"running {mode} ...", file=sys.stderr)
+        report["logins"].append({"mode": mode, **end_to_end(args, mode)})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
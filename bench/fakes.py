@@ -0,0 +1,213 @@
+"""HTTP stand-ins for the external systems the services talk to.
+
+Keystone, Barbican and PayPal are replaced by tiny in-process HTTP servers
+that speak just enough of each API for the real client libraries
+(keystoneauth1, python-barbicanclient, paypalrestsdk) to work unchanged.
+Every fake accepts a ``latency_ms`` so remote round trips can be simulated.
+"""
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        self.server.fake.record_call()
+        url = urlparse(self.path)
+        self.server.fake.handle(self, method, url.path.rstrip("/"), parse_qs(url.query))
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class FakeServer:
+    """Base class: runs ``handle`` for every request on a background thread."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record_call(self):
+        with self._calls_lock:
+            self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self, handler, method, path, query):
+        handler._send(404, {"error": "not found"})
+
+
+class FakeKeystone(FakeServer):
+    """Issues a password-auth token for any credentials (``/v3/auth/tokens``)."""
+
+    def handle(self, handler, method, path, query):
+        if method == "POST" and path == "/v3/auth/tokens":
+            handler._body()
+            now = datetime.now(timezone.utc)
+            token = {
+                "token": {
+                    "methods": ["password"],
+                    "issued_at": now.isoformat(),
+                    "expires_at": (now + timedelta(hours=12)).isoformat(),
+                    "user": {"id": "bench-user", "name": "bench", "domain": {"id": "default", "name": "Default"}},
+                    "project": {"id": "bench-project", "name": "bench", "domain": {"id": "default", "name": "Default"}},
+                    "roles": [{"id": "admin", "name": "admin"}],
+                    "catalog": [],
+                }
+            }
+            handler._send(201, token, headers={"X-Subject-Token": uuid.uuid4().hex})
+        elif method == "GET" and path in ("", "/v3"):
+            handler._send(200, {"version": {"id": "v3.14", "status": "stable", "links": [{"rel": "self", "href": f"{self.url}/v3/"}]}})
+        else:
+            handler._send(404, {"error": "not found"})
+
+
+class FakeBarbican(FakeServer):
+    """Stores plain-text secrets in memory and serves the ``/v1/secrets`` API."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.secrets = {}
+        self.lock = threading.Lock()
+
+    def _version(self):
+        return {
+            "id": "v1",
+            "status": "CURRENT",
+            "min_version": "1.0",
+            "max_version": "1.1",
+            "links": [{"rel": "self", "href": f"{self.url}/v1/"}],
+        }
+
+    def _entity(self, secret_id):
+        secret = self.secrets[secret_id]
+        return {
+            "secret_ref": f"{self.url}/v1/secrets/{secret_id}",
+            "name": secret["name"],
+            "status": "ACTIVE",
+            "secret_type": "opaque",
+            "content_types": {"default": secret["content_type"]},
+            "created": secret["created"],
+            "updated": secret["created"],
+        }
+
+    def payload_by_name(self, name):
+        with self.lock:
+            for secret in self.secrets.values():
+                if secret["name"] == name:
+                    return secret["payload"]
+        return None
+
+    def handle(self, handler, method, path, query):
+        if method == "GET" and path == "":
+            handler._send(300, {"versions": {"values": [self._version()]}})
+        elif method == "GET" and path == "/v1":
+            handler._send(200, {"version": self._version()})
+        elif method == "POST" and path == "/v1/secrets":
+            data = json.loads(handler._body() or b"{}")
+            secret_id = str(uuid.uuid4())
+            with self.lock:
+                self.secrets[secret_id] = {
+                    "name": data.get("name"),
+                    "payload": data.get("payload", ""),
+                    "content_type": data.get("payload_content_type") or "text/plain",
+                    "created": datetime.now(timezone.utc).isoformat(),
+                }
+            handler._send(201, {"secret_ref": f"{self.url}/v1/secrets/{secret_id}"})
+        elif method == "GET" and path == "/v1/secrets":
+            limit = int(query.get("limit", ["10"])[0])
+            offset = int(query.get("offset", ["0"])[0])
+            name = query.get("name", [None])[0]
+            with self.lock:
+                ids = [i for i, s in self.secrets.items() if name is None or s["name"] == name]
+                page = [self._entity(i) for i in ids[offset:offset + limit]]
+            handler._send(200, {"secrets": page, "total": len(ids)})
+        elif path.startswith("/v1/secrets/"):
+            parts = path.split("/")
+            secret_id = parts[3]
+            with self.lock:
+                secret = self.secrets.get(secret_id)
+            if secret is None:
+                handler._send(404, {"title": "Not Found", "description": "Secret not found.", "code": 404})
+            elif method == "GET" and len(parts) == 5 and parts[4] == "payload":
+                handler._send(200, secret["payload"].encode("utf-8"), content_type=secret["content_type"])
+            elif method == "GET":
+                handler._send(200, self._entity(secret_id))
+            elif method == "DELETE":
+                with self.lock:
+                    self.secrets.pop(secret_id, None)
+                handler._send(204)
+            else:
+                handler._send(405, {"title": "Method Not Allowed", "description": "", "code": 405})
+        else:
+            handler._send(404, {"error": "not found"})
+
+
+class FakePayPal(FakeServer):
+    """Accepts OAuth token requests and payment creation (REST v1)."""
+
+    def handle(self, handler, method, path, query):
+        handler._body()
+        if method == "POST" and path == "/v1/oauth2/token":
+            handler._send(200, {"access_token": uuid.uuid4().hex, "token_type": "Bearer", "expires_in": 32400})
+        elif method == "POST" and path == "/v1/payments/payment":
+            payment_id = "PAY-" + uuid.uuid4().hex[:20].upper()
+            handler._send(201, {
+                "id": payment_id,
+                "intent": "sale",
+                "state": "created",
+                "links": [
+                    {"href": f"{self.url}/v1/payments/payment/{payment_id}", "rel": "self", "method": "GET"},
+                    {"href": f"{self.url}/checkoutnow?token={payment_id}", "rel": "approval_url", "method": "REDIRECT"},
+                ],
+            })
+        else:
+            handler._send(404, {"error": "not found"})
@@ -0,0 +1,81 @@
+"""Closed-loop async load generator and latency summaries."""
+import asyncio
+import ssl
+import time
+
+import httpx
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(name, latencies, errors, elapsed, concurrency):
+    ordered = sorted(latencies)
+    total = len(ordered) + errors
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p95": round(percentile(ordered, 95) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+    }
+
+
+async def run_load(name, step, total, concurrency, timeout=30.0):
+    """Run ``step(client, i)`` ``total`` times with ``concurrency`` workers.
+
+    ``step`` is a coroutine that performs one logical operation (possibly
+    several HTTP calls) and returns True on success. The latency recorded is
+    the wall time of the whole step.
+
+    Every worker has its own client: one pool shared by hundreds of
+    keep-alive connections costs the generator more CPU per request than
+    the services spend, and on a small machine that skews the results.
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+    # Building the default SSL context per client is slow; share one
+    ssl_context = ssl.create_default_context()
+
+    async def worker():
+        nonlocal errors
+        async with httpx.AsyncClient(timeout=timeout, verify=ssl_context) as client:
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    ok = await step(client, i)
+                except Exception:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return summarize(name, latencies, errors, elapsed, concurrency)
+
+
+async def graphql(client, url, query, variables=None, token=None):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    response = await client.post(url, json={"query": query, "variables": variables or {}}, headers=headers)
+    response.raise_for_status()
+    body = response.json()
+    if body.get("errors"):
+        raise RuntimeError(body["errors"])
+    return body["data"]
@@ -0,0 +1,149 @@
+"""Wrong-password login bursts with the rate limiter off, local, and on Redis.
+
+    python bench/login_burst.py --requests 500 --concurrency 50 --modes off,local,redis
+
+Two attacks per mode, each on a fresh authentication service: a burst of
+bad passwords against one existing account, and a spray of one attempt
+each against many emails, all from the same client IP. Responses are
+split into served (200) and refused (429), each with its own latency, and
+the service's /metrics tells how many password checks and DB queries the
+burst actually cost. ``redis`` runs the limiter against a fakeredis server
+on a local port.
+"""
+import argparse
+import asyncio
+import json
+import re
+import ssl
+import sys
+import threading
+import time
+
+import httpx
+
+from load import graphql, summarize
+from scenarios import LOGIN, PASSWORD, SIGNUP, email_for
+from services import Stack
+
+VICTIM = "victim@bench.example.com"
+# Counters scraped from the authentication service before and after each attack
+SCRAPED = {
+    "password_checks": r'auth_work_duration_seconds_count\{step="password_check"\} (\S+)',
+    "db_queries": r"db_query_duration_seconds_count (\S+)",
+}
+
+
+class RedisServer:
+    """fakeredis speaking the Redis protocol on a free port, in a thread."""
+
+    def __init__(self):
+        from fakeredis import TcpFakeServer
+        self.server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"redis://{host}:{port}/0"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+async def scrape(client, stack):
+    text = (await client.get(stack.url("authentication").replace("/authentication", "/metrics"))).text
+    counts = {}
+    for name, pattern in SCRAPED.items():
+        match = re.search(pattern, text)
+        counts[name] = int(float(match.group(1))) if match else 0
+    return counts
+
+
+async def burst(stack, name, emails, concurrency):
+    """POST a bad-password login for every email; latencies by status."""
+    url = stack.url("authentication")
+    latencies = {200: [], 429: []}
+    errors = 0
+    counter = iter(emails)
+    ssl_context = ssl.create_default_context()
+
+    async def worker():
+        nonlocal errors
+        async with httpx.AsyncClient(timeout=30.0, verify=ssl_context) as client:
+            for email in counter:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json={"query": LOGIN, "variables": {
+                        "email": email, "password": "wrong-password", "totpCode": "000000"}})
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                if response.status_code in latencies:
+                    latencies[response.status_code].append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        before = await scrape(client, stack)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        after = await scrape(client, stack)
+
+    return {
+        "attack": name,
+        "requests": len(emails),
+        "errors": errors,
+        "served": summarize(f"{name}_served", latencies[200], 0, elapsed, concurrency),
+        "refused": summarize(f"{name}_refused", latencies[429], 0, elapsed, concurrency),
+        **{key: after[key] - before[key] for key in SCRAPED},
+    }
+
+
+async def run_mode(args, env):
+    results = []
+    attacks = {
+        "one_email": [VICTIM] * args.requests,
+        "spray": [email_for("spray", i) for i in range(args.requests)],
+    }
+    for attack, emails in attacks.items():
+        # A fresh service per attack, so the second doesn't start with empty buckets
+        with Stack(services=("authentication",), env=env) as stack:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                await graphql(client, stack.url("authentication"), SIGNUP, {"email": VICTIM, "password": PASSWORD})
+            results.append(await burst(stack, attack, emails, args.concurrency))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default=["off", "local", "redis"],
+                        type=lambda value: [m for m in value.split(",") if m])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment, e.g. RATE_LIMIT_PER_IP=100/60 (repeatable)")
+    args = parser.parse_args(argv)
+
+    extra = dict(item.split("=", 1) for item in args.env)
+    report = []
+    for mode in args.modes:
+        print(f"running {mode} ...", file=sys.stderr)
+        env = {**extra, "RATE_LIMIT_ENABLED": "0" if mode == "off" else "1"}
+        if mode == "redis":
+            with RedisServer() as redis_server:
+                env["RATE_LIMIT_REDIS_URL"] = redis_server.url
+                results = asyncio.run(run_mode(args, env))
+        else:
+            results = asyncio.run(run_mode(args, env))
+        report.append({"mode": mode, "results": results})
+    print(json.dumps({"parameters": {**vars(args), "env": extra}, "modes": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Latency of GraphQL documents carrying several mutations.
+
+    python bench/multi_mutation.py --sizes 1,5,20 --requests 300 --concurrency 10
+
+Each operation sends one document with N aliased ``addComment`` mutations
+to the product service, so the per-request cost of session and transaction
+handling shows up directly as N grows. Use ``--env`` (as with run.py) to
+try the ASGI server or a simulated database latency.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from load import graphql, run_load
+from scenarios import seed_catalog
+from services import Stack
+
+
+def comments_document(size):
+    fields = " ".join(
+        f'c{i}: addComment(productId: $productId, text: "bench comment {i}") {{ id }}' for i in range(size))
+    return f"mutation Comments($productId: Int!) {{ {fields} }}"
+
+
+async def run(args, stack):
+    product_ids = await seed_catalog(stack, 10, comments_per_product=0)
+    url = stack.url("product")
+    results = []
+    for size in args.sizes:
+        document = comments_document(size)
+
+        async def step(client, i):
+            data = await graphql(client, url, document, {"productId": product_ids[i % len(product_ids)]})
+            return len(data) == size
+
+        print(f"running {size} mutations per document ...", file=sys.stderr)
+        result = await run_load(f"add_comment_x{size}", step, args.requests, args.concurrency)
+        result["mutations_per_request"] = size
+        result["mutations_per_s"] = round(result["throughput_rps"] * size, 2)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-mutation documents against the product service.")
+    parser.add_argument("--sizes", default=[1, 5, 20],
+                        type=lambda value: [int(s) for s in value.split(",") if s])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE")
+    args = parser.parse_args(argv)
+
+    env = dict(item.split("=", 1) for item in args.env)
+    with Stack(services=("authorization", "product"), env=env) as stack:
+        results = asyncio.run(run(args, stack))
+    print(json.dumps({"parameters": {**vars(args), "env": env}, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Archiving old orders: table size, scan time and order(id) lookups before and after.
+
+    python bench/order_archive.py --orders 2000000 --months 24 --keep-days 365
+
+Seeds ``--orders`` orders spread evenly over the last ``--months`` months
+straight into the product service's SQLite file, then measures the file
+size, a full-table and a last-30-days reporting scan, and order(id)
+latency for recent ids. Runs common/archive.py to move everything older
+than ``--keep-days`` out, VACUUMs, and measures again, plus lookups of
+archived ids (the first hit on a block reads it from its part, later ones
+come from memory).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from load import graphql
+from services import Stack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ORDER = """
+query Order($id: Int!) { order(id: $id) { id quantity totalPrice } }
+"""
+
+
+def seed_orders(path, orders, months):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    span = timedelta(days=30.4 * months).total_seconds()
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("INSERT OR IGNORE INTO products (id, name, description, price) VALUES (1, 'p', 'd', 5.0)")
+        batch = 100_000
+        for start in range(0, orders, batch):
+            conn.executemany(
+                "INSERT INTO orders (id, product_id, quantity, total_price, created_at) VALUES (?, 1, ?, ?, ?)",
+                ((i + 1, 1 + i % 3, 5.0 * (1 + i % 3),
+                  (now - timedelta(seconds=span * (1 - i / orders))).strftime("%Y-%m-%d %H:%M:%S.%f"))
+                 for i in range(start, min(orders, start + batch))))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def scans(path):
+    conn = sqlite3.connect(path)
+    try:
+        since = (datetime.now(timezone.utc) - timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
+        results = {}
+        for name, query, params in (
+                ("full_scan_ms", "SELECT count(*), sum(total_price) FROM orders", ()),
+                ("last_30_days_ms", "SELECT count(*), sum(total_price) FROM orders WHERE created_at >= ?", (since,))):
+            started = time.perf_counter()
+            conn.execute(query, params).fetchall()
+            results[name] = round((time.perf_counter() - started) * 1000, 1)
+        results["rows"] = conn.execute("SELECT count(*) FROM orders").fetchone()[0]
+        return results
+    finally:
+        conn.close()
+
+
+def vacuum(path):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+async def lookups(stack, ids):
+    url = stack.url("product")
+    latencies = []
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        for order_id in ids:
+            started = time.perf_counter()
+            data = await graphql(client, url, ORDER, {"id": order_id})
+            latencies.append(time.perf_counter() - started)
+            if data["order"] is None:
+                raise RuntimeError(f"order {order_id} not found")
+    latencies.sort()
+    return {"lookups": len(ids), "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=2_000_000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--keep-days", type=int, default=365)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="zt-archive-")
+    archive_dir = os.path.join(workdir, "archive")
+    db_path = os.path.join(workdir, "product.sqlite3")
+    env = {"ARCHIVE_DIR": archive_dir}
+    rng = random.Random(1)
+    # Ids follow time, so the newest quarter stays in the database
+    recent = [rng.randrange(args.orders * 3 // 4, args.orders) + 1 for _ in range(args.lookups)]
+
+    with Stack(services=("authorization", "product"), workdir=workdir, env=env):
+        pass
+    print(f"seeding {args.orders} orders ...", file=sys.stderr)
+    seed_orders(db_path, args.orders, args.months)
+    vacuum(db_path)
+    report = {"parameters": vars(args), "before": {"db_mib": round(os.path.getsize(db_path) / 2 ** 20, 1),
+                                                    **scans(db_path)}}
+    with Stack(services=("authorization", "product"), workdir=workdir, env=env) as stack:
+        report["before"]["recent_lookups"] = asyncio.run(lookups(stack, recent))
+
+    print("archiving ...", file=sys.stderr)
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "common.archive", "orders", "--older-than-days", str(args.keep_days),
+                    "--dir", archive_dir, "--database-uri", f"sqlite:///{db_path}"],
+                   cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    archive_s = time.perf_counter() - started
+    with open(os.path.join(archive_dir, "orders", "manifest.json")) as manifest:
+        parts = json.load(manifest)["parts"]
+    vacuum(db_path)
+    report["archive"] = {
+        "seconds": round(archive_s, 1),
+        "parts": len(parts),
+        "rows": sum(part["rows"] for part in parts),
+        "mib": round(sum(part["bytes"] for part in parts) / 2 ** 20, 1),
+    }
+    report["after"] = {"db_mib": round(os.path.getsize(db_path) / 2 ** 20, 1), **scans(db_path)}
+    with Stack(services=("authorization", "product"), workdir=workdir, env=env) as stack:
+        report["after"]["recent_lookups"] = asyncio.run(lookups(stack, recent))
+        # The first id of two parts reads their indexes and first blocks
+        first, second = parts[0], parts[1]
+        report["after"]["archived_lookups_cold"] = asyncio.run(lookups(stack, [first["min_id"], second["min_id"]]))
+        warm = [rng.randint(part["min_id"], part["max_id"]) for part in (first, second) for _ in range(args.lookups // 2)]
+        report["after"]["archived_lookups_warm"] = asyncio.run(lookups(stack, warm))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
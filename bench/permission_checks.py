@@ -0,0 +1,86 @@
+"""Token size and permission-check cost: string-list claim vs "perm" bitmask.
+
+    python bench/permission_checks.py --iterations 200000
+
+Runs in-process against common/permissions.py; no stack needed.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import timeit
+from datetime import datetime, timedelta
+
+import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = "bench-permission-checks-secret-key-32b"
+
+# Mirrors PERMISSIONS in authentication-service/app.py
+ROLES = {
+    "admin": ["manage_users", "manage_products", "view_orders", "process_orders"],
+    "seller": ["manage_products", "view_orders"],
+    "customer": ["view_products", "place_orders"],
+}
+# What product's addProduct/removeProduct require
+REQUIRED = ["admin"]
+
+
+def load_permissions():
+    spec = importlib.util.spec_from_file_location(
+        "permissions", os.path.join(ROOT, "common", "permissions.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def ops_per_s(fn, iterations):
+    return round(iterations / timeit.timeit(fn, number=iterations))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args(argv)
+    permissions = load_permissions()
+
+    exp = datetime.utcnow() + timedelta(minutes=15)
+    required_mask = permissions.permission_mask(REQUIRED)
+    results = []
+    for role, names in ROLES.items():
+        legacy_token = jwt.encode({"sub": "user-123", "permissions": names, "exp": exp}, SECRET_KEY, algorithm="HS256")
+        token = jwt.encode({"sub": "user-123", "perm": permissions.permission_mask(names), "exp": exp},
+                           SECRET_KEY, algorithm="HS256")
+        legacy_claims = jwt.decode(legacy_token, SECRET_KEY, algorithms=["HS256"])
+        claims = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+
+        def legacy_check(claims=legacy_claims):
+            return bool(set(claims.get("permissions", [])).intersection(REQUIRED))
+
+        def mask_check(claims=claims):
+            return bool(permissions.token_mask(claims) & required_mask)
+
+        def legacy_verify(token=legacy_token):
+            return legacy_check(jwt.decode(token, SECRET_KEY, algorithms=["HS256"]))
+
+        def mask_verify(token=token):
+            return mask_check(jwt.decode(token, SECRET_KEY, algorithms=["HS256"]))
+
+        assert legacy_check() == mask_check()
+        results.append({
+            "role": role,
+            "token_bytes": {"permissions_list": len(legacy_token), "perm_mask": len(token)},
+            "checks_per_s": {
+                "permissions_list": ops_per_s(legacy_check, args.iterations),
+                "perm_mask": ops_per_s(mask_check, args.iterations),
+            },
+            "decode_and_check_per_s": {
+                "permissions_list": ops_per_s(legacy_verify, args.iterations // 10),
+                "perm_mask": ops_per_s(mask_verify, args.iterations // 10),
+            },
+        })
+    print(json.dumps({"iterations": args.iterations, "required": REQUIRED, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
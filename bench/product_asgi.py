@@ -0,0 +1,55 @@
+"""Compare the product service under WSGI (app.py) and ASGI (asgi.py).
+
+    python bench/product_asgi.py --requests 5000 --concurrency 500 \
+        --db-latency-ms 5 --wsgi-threads 32
+
+Each mode gets a fresh stack (authorization + product), is seeded with the
+same catalog and then runs the ``browse`` scenario. ``--db-latency-ms``
+simulates a networked database; ``--wsgi-threads`` caps the WSGI server the
+way a gunicorn deployment would (0 keeps werkzeug's thread per connection).
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from scenarios import catalog_browse
+from services import Stack
+
+
+async def run_mode(mode, args):
+    env = {
+        "BENCH_PRODUCT_SERVER": mode,
+        "BENCH_DB_LATENCY_MS": str(args.db_latency_ms),
+        "BENCH_WSGI_THREADS": str(args.wsgi_threads),
+    }
+    with Stack(services=("authorization", "product"), env=env) as stack:
+        result = await catalog_browse(stack, args.requests, args.concurrency, products=args.products)
+    result["server"] = mode
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Product service: WSGI vs ASGI throughput.")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--wsgi-threads", type=int, default=32)
+    args = parser.parse_args(argv)
+
+    results = []
+    for mode in ("wsgi", "asgi"):
+        print(f"running {mode} ...", file=sys.stderr)
+        results.append(asyncio.run(run_mode(mode, args)))
+
+    wsgi, asgi = results
+    print(json.dumps({
+        "parameters": vars(args),
+        "results": results,
+        "asgi_speedup": round(asgi["throughput_rps"] / wsgi["throughput_rps"], 2) if wsgi["throughput_rps"] else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Read throughput of the product service with 0, 1, 2 ... read replicas.
+
+    python bench/read_replicas.py --replicas 0,1,2 --requests 1000 --concurrency 64 \\
+        --db-latency-ms 30 --db-slots 2
+
+Seeds ``--products`` products (with comments and ratings) straight into the
+service's SQLite file and copies it to one file per replica, then for each
+server and each replica count runs ``product(id)`` for random ids and reports
+throughput plus where the statements went (from /metrics). Every database
+file is given ``--db-slots`` statements in flight of ``--db-latency-ms`` each
+(``BENCH_DB_SLOTS``, see serve.py), so each file caps reads the way a real
+database server's CPU and disks would, and replicas add capacity.
+
+Two checks follow on the same files, which never receive the primary's
+writes (a replica infinitely far behind):
+
+- ``read_your_writes``: after ``addProduct``, ``allProducts`` from the same
+  client (which got the cookie) and from a fresh one, and ``product(id)``
+  from a fresh one, which finds it on the primary after the replica misses.
+- ``lag_fallback``: ``REPLICA_LAG_QUERY`` reads a lag value stored in each
+  replica file; replica-0 is set 60s behind and reads should skip it, then
+  back to 0 and they should return.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import httpx
+
+from load import graphql, run_load
+from scenarios import ADD_PRODUCT, ALL_PRODUCTS, PRODUCT, admin_token
+from services import Stack
+
+LAG_QUERY = "SELECT lag_seconds FROM replica_lag"
+
+
+def seed(path, products, comments, ratings):
+    conn = sqlite3.connect(path)
+    try:
+        conn.executemany("INSERT INTO products (id, name, description, price) VALUES (?, ?, ?, ?)",
+                         ((i, f"Product {i}", f"Bench product {i}", 5.0 + i % 50) for i in range(1, products + 1)))
+        conn.executemany("INSERT INTO comments (product_id, text) VALUES (?, ?)",
+                         ((i, f"Comment {c} on {i}") for i in range(1, products + 1) for c in range(comments)))
+        conn.executemany("INSERT INTO ratings (product_id, score) VALUES (?, ?)",
+                         ((i, float(1 + (i + r) % 5)) for i in range(1, products + 1) for r in range(ratings)))
+        conn.commit()
+        # Fold the WAL into the file so a copy of the file is the whole database
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+def set_lag(path, seconds):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS replica_lag (lag_seconds REAL)")
+        conn.execute("DELETE FROM replica_lag")
+        conn.execute("INSERT INTO replica_lag VALUES (?)", (seconds,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def prepare(workdir, args, replicas):
+    with Stack(services=("authorization", "product"), workdir=workdir):
+        pass
+    primary = os.path.join(workdir, "product.sqlite3")
+    seed(primary, args.products, args.comments, args.ratings)
+    paths = []
+    for index in range(replicas):
+        path = os.path.join(workdir, f"replica-{index}.sqlite3")
+        shutil.copyfile(primary, path)
+        set_lag(path, 0)
+        paths.append(path)
+    return paths
+
+
+def routed(metrics_text):
+    """db_routed_statements_total as {"target/reason": count}."""
+    counts = {}
+    for line in metrics_text.splitlines():
+        if line.startswith("db_routed_statements_total{"):
+            labels, value = line[len("db_routed_statements_total{"):].split("} ")
+            fields = dict(part.split("=") for part in labels.split(","))
+            counts[f"{fields['target'].strip(chr(34))}/{fields['reason'].strip(chr(34))}"] = int(float(value))
+    return counts
+
+
+async def fetch_routed(stack):
+    async with httpx.AsyncClient() as client:
+        response = await client.get(stack.url("product").replace("/graphql", "/metrics"))
+        return routed(response.text)
+
+
+def env_for(args, server, paths, **extra):
+    env = {
+        "BENCH_PRODUCT_SERVER": server,
+        "BENCH_DB_LATENCY_MS": str(args.db_latency_ms),
+        "BENCH_DB_SLOTS": str(args.db_slots),
+        "SQLALCHEMY_REPLICA_URIS": ",".join(f"sqlite:///{path}" for path in paths),
+        **extra,
+    }
+    if args.wsgi_threads:
+        env["BENCH_WSGI_THREADS"] = str(args.wsgi_threads)
+    return env
+
+
+def throughput(args, workdir, server, paths):
+    rng = random.Random(1)
+    ids = [rng.randint(1, args.products) for _ in range(args.requests)]
+    with Stack(services=("authorization", "product"), workdir=workdir, env=env_for(args, server, paths)) as stack:
+        url = stack.url("product")
+
+        async def step(client, i):
+            data = await graphql(client, url, PRODUCT, {"id": ids[i]})
+            return data["product"] is not None
+
+        result = asyncio.run(run_load(f"product_by_id/{len(paths)} replicas", step, args.requests, args.concurrency))
+        result["routed"] = asyncio.run(fetch_routed(stack))
+    return {"server": server, "replicas": len(paths), **result}
+
+
+async def read_your_writes(stack):
+    url = stack.url("product")
+    async with httpx.AsyncClient(timeout=30.0) as writer, httpx.AsyncClient(timeout=30.0) as other:
+        token = await admin_token(writer, stack)
+        data = await graphql(writer, url, ADD_PRODUCT, {"name": "fresh", "description": "just added", "price": 1.0},
+                             token=token)
+        new_id = data["addProduct"]["id"]
+        own = await graphql(writer, url, ALL_PRODUCTS)
+        fresh = await graphql(other, url, ALL_PRODUCTS)
+        by_id = await graphql(other, url, PRODUCT, {"id": new_id})
+    return {
+        "cookie_set": "read_primary_until" in writer.cookies,
+        "all_products_same_client_sees_it": any(p["id"] == new_id for p in own["allProducts"]),
+        "all_products_other_client_sees_it": any(p["id"] == new_id for p in fresh["allProducts"]),
+        "product_by_id_other_client_finds_it": by_id["product"] is not None,
+    }
+
+
+async def reads(stack, count, products):
+    url = stack.url("product")
+    before = await fetch_routed(stack)
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        for i in range(count):
+            await graphql(client, url, PRODUCT, {"id": 1 + i % products})
+    after = await fetch_routed(stack)
+    return {key: after[key] - before.get(key, 0) for key in after if after[key] - before.get(key, 0)}
+
+
+def lag_fallback(args, workdir, server, paths):
+    env = env_for(args, server, paths, REPLICA_LAG_QUERY=LAG_QUERY, REPLICA_LAG_CHECK_SECONDS="0.5",
+                  REPLICA_MAX_LAG_SECONDS="5", BENCH_DB_LATENCY_MS="0")
+    with Stack(services=("authorization", "product"), workdir=workdir, env=env) as stack:
+        result = {"in_sync": asyncio.run(reads(stack, 40, args.products))}
+        set_lag(paths[0], 60)
+        time.sleep(1)
+        result["replica_0_60s_behind"] = asyncio.run(reads(stack, 40, args.products))
+        set_lag(paths[0], 0)
+        time.sleep(1)
+        result["caught_up"] = asyncio.run(reads(stack, 40, args.products))
+    return {"server": server, **result}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replicas", default=[0, 1, 2], type=lambda value: [int(n) for n in value.split(",") if n])
+    parser.add_argument("--servers", default=["wsgi", "asgi"], type=lambda value: [s for s in value.split(",") if s])
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--comments", type=int, default=3)
+    parser.add_argument("--ratings", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--db-latency-ms", type=float, default=30)
+    parser.add_argument("--db-slots", type=int, default=2)
+    parser.add_argument("--wsgi-threads", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="zt-replicas-")
+    print(f"seeding {args.products} products ...", file=sys.stderr)
+    paths = prepare(workdir, args, max(max(args.replicas), 2))
+    report = {"parameters": vars(args), "throughput": [], "read_your_writes": [], "lag_fallback": []}
+    for server in args.servers:
+        for count in args.replicas:
+            print(f"{server} with {count} replicas ...", file=sys.stderr)
+            report["throughput"].append(throughput(args, workdir, server, paths[:count]))
+            print(f"  {report['throughput'][-1]['throughput_rps']} req/s", file=sys.stderr)
+        with Stack(services=("authorization", "product"), workdir=workdir,
+                   env=env_for(args, server, paths[:1], BENCH_DB_LATENCY_MS="0")) as stack:
+            report["read_your_writes"].append({"server": server, **asyncio.run(read_your_writes(stack))})
+        report["lag_fallback"].append(lag_fallback(args, workdir, server, paths[:2]))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Run the end-to-end benchmark scenarios and print a JSON report.
+
+    python bench/run.py --scenarios signup,login,browse,checkout \
+        --requests 500 --concurrency 50 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+from scenarios import SCENARIOS
+from services import Stack
+
+
+async def run(args, stack):
+    results = []
+    for name in args.scenarios:
+        print(f"running {name} ...", file=sys.stderr)
+        results.append(await SCENARIOS[name](stack, args.requests, args.concurrency))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark for the four services.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda value: [s for s in value.split(",") if s])
+    parser.add_argument("--requests", type=int, default=500, help="operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--barbican-latency-ms", type=float, default=0)
+    parser.add_argument("--paypal-latency-ms", type=float, default=0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for every service (repeatable)")
+    parser.add_argument("--trace-dir", help="have every service export spans to <dir>/<service>.jsonl")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    env = dict(item.split("=", 1) for item in args.env)
+    with Stack(barbican_latency_ms=args.barbican_latency_ms,
+               paypal_latency_ms=args.paypal_latency_ms, env=env, trace_dir=args.trace_dir) as stack:
+        results = asyncio.run(run(args, stack))
+        barbican_calls = stack.barbican.calls
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "parameters": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "barbican_latency_ms": args.barbican_latency_ms,
+            "paypal_latency_ms": args.paypal_latency_ms,
+            "env": env,
+        },
+        "barbican_calls": barbican_calls,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
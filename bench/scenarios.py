@@ -0,0 +1,181 @@
+"""Scripted end-to-end scenarios driven against a running ``Stack``."""
+import random
+import sqlite3
+
+import pyotp
+
+from load import graphql, run_load
+
+PASSWORD = "BenchPass123"
+
+SIGNUP = """
+mutation Signup($email: String!, $password: String!) {
+  signup(email: $email, password: $password) { info }
+}
+"""
+
+LOGIN = """
+mutation Login($email: String!, $password: String!, $totpCode: String!) {
+  login(email: $email, password: $password, totpCode: $totpCode) { info }
+}
+"""
+
+ADD_PRODUCT = """
+mutation AddProduct($name: String!, $description: String!, $price: Float!) {
+  addProduct(name: $name, description: $description, price: $price) { id }
+}
+"""
+
+ADD_COMMENT = """
+mutation AddComment($productId: Int!, $text: String!) {
+  addComment(productId: $productId, text: $text) { id }
+}
+"""
+
+ADD_RATING = """
+mutation AddRating($productId: Int!, $score: Float!) {
+  addRating(productId: $productId, score: $score) { id }
+}
+"""
+
+ALL_PRODUCTS = """
+query { allProducts { id name price comments { id text } ratings { id score } } }
+"""
+
+PRODUCT = """
+query Product($id: Int!) {
+  product(id: $id) { id name description price comments { id text } ratings { id score } }
+}
+"""
+
+ADD_ORDER = """
+mutation AddOrder($productId: Int!, $quantity: Int!) {
+  addOrder(productId: $productId, quantity: $quantity, totalPrice: 0) { id totalPrice }
+}
+"""
+
+PROCESS_PAYMENT = """
+mutation Pay($orderId: Int!) { processPayment(orderId: $orderId) }
+"""
+
+
+def email_for(prefix, i):
+    return f"{prefix}-{i}@bench.example.com"
+
+
+async def admin_token(client, stack):
+    response = await client.post(
+        f"{stack.url('authorization')}/generate-token",
+        json={"user_id": "bench-admin", "permissions": ["admin"]},
+    )
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+async def signup_burst(stack, total, concurrency, prefix="signup"):
+    url = stack.url("authentication")
+
+    async def step(client, i):
+        data = await graphql(client, url, SIGNUP, {"email": email_for(prefix, i), "password": PASSWORD})
+        return data["signup"]["info"] == "Signup Success"
+
+    return await run_load("signup_burst", step, total, concurrency)
+
+
+async def login_storm(stack, total, concurrency, users=50, prefix="login"):
+    url = stack.url("authentication")
+    await run_load("login_setup", _signup_step(url, prefix), users, min(users, 10))
+    totps = _totp_for_users(stack, prefix, users)
+
+    async def step(client, i):
+        email, totp = totps[i % len(totps)]
+        data = await graphql(client, url, LOGIN, {"email": email, "password": PASSWORD, "totpCode": totp.now()})
+        return data["login"]["info"] == "Login Success"
+
+    return await run_load("login_storm", step, total, concurrency)
+
+
+async def catalog_browse(stack, total, concurrency, products=200):
+    url = stack.url("product")
+    product_ids = await seed_catalog(stack, products)
+
+    async def step(client, i):
+        if i % 20 == 0:
+            data = await graphql(client, url, ALL_PRODUCTS)
+            return bool(data["allProducts"])
+        data = await graphql(client, url, PRODUCT, {"id": random.choice(product_ids)})
+        return data["product"] is not None
+
+    return await run_load("catalog_browse", step, total, concurrency)
+
+
+async def checkout(stack, total, concurrency, products=50):
+    product_url = stack.url("product")
+    payment_url = stack.url("payment")
+    product_ids = await seed_catalog(stack, products)
+
+    async def step(client, i):
+        order = await graphql(client, product_url, ADD_ORDER,
+                              {"productId": random.choice(product_ids), "quantity": 1 + i % 3})
+        data = await graphql(client, payment_url, PROCESS_PAYMENT, {"orderId": order["addOrder"]["id"]})
+        return "checkoutnow" in data["processPayment"]
+
+    return await run_load("checkout", step, total, concurrency)
+
+
+async def seed_catalog(stack, products, comments_per_product=3):
+    """Create ``products`` products (with comments and ratings) once per stack."""
+    seeded = getattr(stack, "seeded_products", [])
+    if len(seeded) >= products:
+        return seeded[:products]
+
+    import httpx
+    url = stack.url("product")
+    async with httpx.AsyncClient(timeout=30) as client:
+        token = await admin_token(client, stack)
+        for i in range(len(seeded), products):
+            data = await graphql(client, url, ADD_PRODUCT,
+                                 {"name": f"Product {i}", "description": f"Bench product {i}", "price": 5.0 + i % 50},
+                                 token=token)
+            product_id = data["addProduct"]["id"]
+            for c in range(comments_per_product):
+                await graphql(client, url, ADD_COMMENT, {"productId": product_id, "text": f"Comment {c}"})
+                await graphql(client, url, ADD_RATING, {"productId": product_id, "score": float(1 + c % 5)})
+            seeded.append(product_id)
+    stack.seeded_products = seeded
+    return seeded
+
+
+def _signup_step(url, prefix):
+    async def step(client, i):
+        data = await graphql(client, url, SIGNUP, {"email": email_for(prefix, i), "password": PASSWORD})
+        return data["signup"]["info"] in ("Signup Success", "User already exists")
+    return step
+
+
+def _totp_for_users(stack, prefix, users):
+    """Read TOTP secrets straight out of the fake Barbican for the seeded users."""
+    conn = sqlite3.connect(stack.auth_db_path)
+    try:
+        rows = conn.execute(
+            "SELECT id, email FROM users WHERE email LIKE ? ORDER BY id",
+            (f"{prefix}-%@bench.example.com",),
+        ).fetchall()
+    finally:
+        conn.close()
+    totps = []
+    for user_id, email in rows[:users]:
+        secret = stack.barbican.payload_by_name(f"Random plain text password for user {user_id}")
+        if secret:
+            totps.append((email, pyotp.TOTP(secret)))
+    if not totps:
+        raise RuntimeError("no users with TOTP secrets were created")
+    return totps
+
+
+SCENARIOS = {
+    "signup": signup_burst,
+    "login": login_storm,
+    "browse": catalog_browse,
+    "checkout": checkout,
+}
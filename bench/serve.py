@@ -0,0 +1,275 @@
+"""Run one service as a local process against the benchmark stand-ins.
+
+    python bench/serve.py <authentication|authorization|product|payment> --port N
+
+Each service is imported from its own directory exactly as its Dockerfile
+would run it, with the repository root on the path for ``common``.
+
+Only the backing stores are swapped: the authentication service gets an
+SQLite database (unless ``BENCH_AUTH_POSTGRES=1`` keeps its real Postgres
+connection) and the authorization service gets fakeredis. Everything else
+is configured through the environment prepared by ``services.py``.
+
+Knobs read from the environment (pass them with ``run.py --env``):
+
+- ``BENCH_PRODUCT_SERVER=asgi`` runs product's asgi.py under uvicorn instead
+  of app.py under a threaded WSGI server.
+- ``BENCH_WSGI_THREADS=N`` caps the WSGI server at N worker threads, like a
+  gunicorn deployment, instead of one thread per connection.
+- ``BENCH_DB_LATENCY_MS=N`` delays every SQLAlchemy statement by N ms to
+  stand in for the round trip to a networked database. Under asyncio the
+  delay yields to the event loop, as waiting on a real socket would.
+- ``BENCH_DB_SLOTS=N`` (with ``BENCH_DB_LATENCY_MS``) lets each database
+  file work on at most N statements at once, so one database serves at
+  most N / latency statements per second however many requests wait on
+  it. That is the capacity read replicas add.
+"""
+import argparse
+import asyncio
+import os
+import re
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_DIRS = {
+    "authentication": "authentication-service",
+    "authorization": "authorization-service",
+    "product": "product",
+    "payment": "payment",
+}
+
+AUTH_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  email VARCHAR(255) UNIQUE NOT NULL,
+  password VARCHAR(255) NOT NULL
+);
+"""
+
+
+class SQLiteCursor:
+    """psycopg2-flavoured cursor over sqlite3 (``%s`` placeholders)."""
+
+    _placeholder = re.compile(r"%s")
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._buffered = None
+        self.itersize = 2000
+
+    def execute(self, query, params=None):
+        self._cursor.execute(self._placeholder.sub("?", query), params or ())
+        # sqlite refuses to commit while RETURNING rows are unread; psycopg2 doesn't care
+        self._buffered = None
+        if not query.lstrip().upper().startswith("SELECT"):
+            self._buffered = iter(self._cursor.fetchall())
+
+    def fetchone(self):
+        if self._buffered is not None:
+            return next(self._buffered, None)
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self.itersize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30)
+
+    def cursor(self, name=None):
+        return SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def serve_authentication(port):
+    import helper
+
+    if not os.getenv("BENCH_AUTH_POSTGRES"):
+        path = os.environ["BENCH_AUTH_SQLITE"]
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(AUTH_SQLITE_SCHEMA)
+        conn.close()
+        # Swap the driver rather than get_db_connection so the service's own
+        # connection wrapping still applies
+        helper.psycopg2 = types.SimpleNamespace(connect=lambda **kwargs: SQLiteConnection(path))
+
+    import uvicorn
+    from app import app
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def serve_authorization(port):
+    import fakeredis
+    import uvicorn
+    import app as service
+
+    service.redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+    uvicorn.run(service.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def add_db_latency():
+    latency_ms = float(os.getenv("BENCH_DB_LATENCY_MS") or 0)
+    if not latency_ms:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.util import concurrency
+
+    await_ = getattr(concurrency, "await_", None) or concurrency.await_only
+    delay = latency_ms / 1000
+    slots = int(os.getenv("BENCH_DB_SLOTS") or 0)
+    # Per database file; a process is either all threads or all asyncio
+    semaphores = {}
+    semaphores_lock = threading.Lock()
+
+    def semaphore(conn, kind):
+        with semaphores_lock:
+            key = conn.engine.url.database
+            if key not in semaphores:
+                semaphores[key] = kind(slots)
+            return semaphores[key]
+
+    async def held(database):
+        async with database:
+            await asyncio.sleep(delay)
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _delay(conn, *args):
+        if concurrency.in_greenlet():
+            if slots:
+                await_(held(semaphore(conn, asyncio.Semaphore)))
+            else:
+                await_(asyncio.sleep(delay))
+        elif slots:
+            with semaphore(conn, threading.Semaphore):
+                time.sleep(delay)
+        else:
+            time.sleep(delay)
+
+
+def tune_sqlite(uri):
+    """WAL plus a long busy timeout for the SQLite stand-in of the real database.
+
+    SQLite has one writer at a time; with a transaction per GraphQL request a
+    writer can wait behind a whole multi-mutation document, which Postgres
+    row locks would never make it do, so wait rather than fail after 5s.
+    """
+    if not uri.startswith("sqlite:///"):
+        return
+    conn = sqlite3.connect(uri[len("sqlite:///"):])
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "connect")
+    def _busy_timeout(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA busy_timeout = 60000")
+        cursor.close()
+
+
+def serve_flask(port):
+    from werkzeug.serving import make_server
+
+    tune_sqlite(os.environ["SQLALCHEMY_DATABASE_URI"])
+    from app import app
+
+    add_db_latency()
+    # Exit normally on SIGTERM so atexit hooks (span export) get to run
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    threads = int(os.getenv("BENCH_WSGI_THREADS") or 0)
+    if threads:
+        _pooled_server_class()("127.0.0.1", port, app, threads).serve_forever()
+    else:
+        make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def serve_product(port):
+    if os.getenv("BENCH_PRODUCT_SERVER") != "asgi":
+        serve_flask(port)
+        return
+
+    import uvicorn
+
+    tune_sqlite(os.environ["SQLALCHEMY_DATABASE_URI"])
+    from asgi import app
+
+    add_db_latency()
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def _pooled_server_class():
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """Werkzeug server handing connections to a fixed pool of threads."""
+
+        request_queue_size = 4096
+
+        def __init__(self, host, port, app, threads):
+            super().__init__(host, port, app)
+            self._pool = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self._pool.submit(self._process, request, client_address)
+
+        def _process(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    return PooledWSGIServer
+
+
+SERVERS = {
+    "authentication": serve_authentication,
+    "authorization": serve_authorization,
+    "product": serve_product,
+    "payment": serve_flask,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("service", choices=sorted(SERVERS))
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+
+    service_dir = os.path.join(ROOT, SERVICE_DIRS[args.service])
+    os.chdir(service_dir)
+    sys.path[:0] = [service_dir, ROOT]
+    SERVERS[args.service](args.port)
+
+
+if __name__ == "__main__":
+    main()
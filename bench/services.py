@@ -0,0 +1,136 @@
+"""Bring up the stand-ins and all four services as local processes."""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakes import FakeBarbican, FakeKeystone, FakePayPal
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# HS256 key shared by authorization (signing) and product/payment (verifying)
+BENCH_SECRET_KEY = "bench-secret-key"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, proc, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"service exited early with code {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"service did not open port {port} within {timeout}s")
+
+
+class Stack:
+    """Fakes plus one process per service, torn down on exit.
+
+    ``env`` is merged into every service's environment, so a benchmark can
+    flip feature flags without touching the harness.
+    """
+
+    def __init__(self, services=("authentication", "authorization", "product", "payment"),
+                 barbican_latency_ms=0, paypal_latency_ms=0, env=None, workdir=None, trace_dir=None):
+        self.services = services
+        self.workdir = workdir or tempfile.mkdtemp(prefix="zt-bench-")
+        self.keystone = FakeKeystone()
+        self.barbican = FakeBarbican(latency_ms=barbican_latency_ms)
+        self.paypal = FakePayPal(latency_ms=paypal_latency_ms)
+        self.extra_env = dict(env or {})
+        self.trace_dir = trace_dir
+        self.ports = {name: free_port() for name in services}
+        self.procs = {}
+
+    def url(self, service):
+        paths = {
+            "authentication": "/authentication",
+            "authorization": "",
+            "product": "/graphql",
+            "payment": "/graphql",
+        }
+        return f"http://127.0.0.1:{self.ports[service]}{paths[service]}"
+
+    @property
+    def auth_db_path(self):
+        return os.path.join(self.workdir, "auth.sqlite3")
+
+    def _env(self):
+        env = dict(os.environ)
+        env.update({
+            "PYTHONUNBUFFERED": "1",
+            # For ``common``, as the Dockerfiles copy it next to each service
+            "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])),
+            "SECRET_KEY": BENCH_SECRET_KEY,
+            "OS_AUTH_URL": f"{self.keystone.url}/v3",
+            "OS_USERNAME": "bench",
+            "OS_PASSWORD": "bench",
+            "OS_PROJECT_NAME": "bench",
+            "OS_USER_DOMAIN_NAME": "Default",
+            "OS_PROJECT_DOMAIN_NAME": "Default",
+            "BARBICAN_URL": self.barbican.url,
+            "BENCH_AUTH_SQLITE": self.auth_db_path,
+            "PAYPAL_CLIENT_ID": "bench",
+            "PAYPAL_CLIENT_SECRET": "bench",
+            "PAYPAL_ENDPOINT": self.paypal.url,
+            # All load comes from one IP; login_burst.py switches it back on
+            "RATE_LIMIT_ENABLED": "0",
+            # The login scenario reuses each user's current code; totp_replay.py switches it back on
+            "TOTP_REPLAY_PROTECTION": "0",
+        })
+        if "authorization" in self.ports:
+            env["AUTHORIZATION_API_URL"] = self.url("authorization")
+        if "product" in self.ports:
+            env["PRODUCT_SERVICE_URL"] = self.url("product")
+        env.update(self.extra_env)
+        return env
+
+    def _service_env(self, name):
+        env = self._env()
+        if self.trace_dir:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            env["TRACE_EXPORT_FILE"] = os.path.join(self.trace_dir, f"{name}.jsonl")
+        if name in ("product", "payment"):
+            default_uri = "sqlite:///" + os.path.join(self.workdir, f"{name}.sqlite3")
+            env["SQLALCHEMY_DATABASE_URI"] = self.extra_env.get(f"{name.upper()}_DATABASE_URI", default_uri)
+        return env
+
+    def start(self):
+        for fake in (self.keystone, self.barbican, self.paypal):
+            fake.start()
+        log = open(os.path.join(self.workdir, "services.log"), "ab")
+        for name in self.services:
+            self.procs[name] = subprocess.Popen(
+                [sys.executable, os.path.join(HERE, "serve.py"), name, "--port", str(self.ports[name])],
+                env=self._service_env(name), stdout=log, stderr=subprocess.STDOUT)
+        for name in self.services:
+            wait_for_port(self.ports[name], self.procs[name])
+        return self
+
+    def stop(self):
+        for proc in self.procs.values():
+            proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for fake in (self.keystone, self.barbican, self.paypal):
+            fake.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
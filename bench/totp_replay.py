@@ -0,0 +1,95 @@
+"""Replayed and repeated bad TOTP codes with the used-code cache off, local and in Redis.
+
+    python bench/totp_replay.py --requests 300 --concurrency 10 --barbican-latency-ms 20
+
+For each mode a fresh authentication service gets one user, then two
+bursts of logins with the right password: every request carrying the
+same currently valid code (a replay), then every request carrying the
+same wrong code. Reports what the logins answered, latency, and the
+Barbican calls and DB queries each burst cost. ``redis`` keeps the cache
+in a fakeredis server on a local port.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from load import graphql, run_load
+from login_burst import RedisServer
+from scenarios import LOGIN, PASSWORD, SIGNUP, _totp_for_users, email_for
+from services import Stack
+
+
+async def db_queries(client, stack):
+    text = (await client.get(stack.url("authentication").replace("/authentication", "/metrics"))).text
+    match = re.search(r"db_query_duration_seconds_count (\S+)", text)
+    return int(float(match.group(1))) if match else 0
+
+
+def wrong_code(totp):
+    now = time.time()
+    # Anything outside the drift window the service might be configured with
+    nearby = {totp.at(now, offset) for offset in range(-5, 6)}
+    return next(code for code in ("000000", "111111", "222222", "333333") if code not in nearby)
+
+
+async def run(args, stack):
+    url = stack.url("authentication")
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        await graphql(client, url, SIGNUP, {"email": email_for("totp", 0), "password": PASSWORD})
+    [(email, totp)] = _totp_for_users(stack, "totp", 1)
+
+    results = []
+    for attack, code in (("replay", totp.now()), ("bad_code", wrong_code(totp))):
+        answers = Counter()
+
+        async def step(client, i):
+            data = await graphql(client, url, LOGIN, {"email": email, "password": PASSWORD, "totpCode": code})
+            answers[data["login"]["info"]] += 1
+            return True
+
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            barbican_before, queries_before = stack.barbican.calls, await db_queries(client, stack)
+            result = await run_load(attack, step, args.requests, args.concurrency)
+            result["barbican_calls"] = stack.barbican.calls - barbican_before
+            result["db_queries"] = await db_queries(client, stack) - queries_before
+        result["answers"] = dict(answers)
+        results.append(result)
+    return results
+
+
+def run_mode(args, env):
+    with Stack(services=("authentication",), barbican_latency_ms=args.barbican_latency_ms, env=env) as stack:
+        return asyncio.run(run(args, stack))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default=["off", "local", "redis"],
+                        type=lambda value: [m for m in value.split(",") if m])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--barbican-latency-ms", type=float, default=20)
+    args = parser.parse_args(argv)
+
+    report = []
+    for mode in args.modes:
+        print(f"running {mode} ...", file=sys.stderr)
+        env = {"TOTP_REPLAY_PROTECTION": "0" if mode == "off" else "1"}
+        if mode == "redis":
+            with RedisServer() as redis_server:
+                env["TOTP_CACHE_REDIS_URL"] = redis_server.url
+                results = run_mode(args, env)
+        else:
+            results = run_mode(args, env)
+        report.append({"mode": mode, "results": results})
+    print(json.dumps({"parameters": vars(args), "modes": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
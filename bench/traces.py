@@ -0,0 +1,109 @@
+"""Summarize spans exported by the services (``run.py --trace-dir``).
+
+    python bench/traces.py traces/*.jsonl --top 5
+
+Spans from every file are joined by trace id, so a checkout shows payment,
+product and PayPal in one tree. The report lists latency percentiles per
+span name and the slowest traces with their span trees.
+"""
+import argparse
+import json
+from collections import defaultdict
+from datetime import datetime
+
+from load import percentile
+
+
+def load_spans(paths):
+    spans = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                raw = json.loads(line)
+                start = datetime.fromisoformat(raw["start_time"])
+                end = datetime.fromisoformat(raw["end_time"])
+                spans.append({
+                    "trace_id": raw["context"]["trace_id"],
+                    "span_id": raw["context"]["span_id"],
+                    "parent_id": raw.get("parent_id"),
+                    "name": raw["name"],
+                    "service": raw["resource"]["attributes"].get("service.name", "?"),
+                    "start": start,
+                    "duration_ms": (end - start).total_seconds() * 1000,
+                })
+    return spans
+
+
+def span_tree(trace_spans):
+    ids = {span["span_id"] for span in trace_spans}
+    children = defaultdict(list)
+    roots = []
+    for span in sorted(trace_spans, key=lambda s: s["start"]):
+        if span["parent_id"] in ids:
+            children[span["parent_id"]].append(span)
+        else:
+            roots.append(span)
+
+    def node(span):
+        return {
+            "name": span["name"],
+            "service": span["service"],
+            "duration_ms": round(span["duration_ms"], 3),
+            "children": [node(child) for child in children[span["span_id"]]],
+        }
+
+    return [node(root) for root in roots]
+
+
+def summarize(spans, top):
+    by_name = defaultdict(list)
+    traces = defaultdict(list)
+    for span in spans:
+        by_name[(span["service"], span["name"])].append(span["duration_ms"])
+        traces[span["trace_id"]].append(span)
+
+    per_span = []
+    for (service, name), durations in sorted(by_name.items()):
+        durations.sort()
+        per_span.append({
+            "service": service,
+            "name": name,
+            "count": len(durations),
+            "p50_ms": round(percentile(durations, 50), 3),
+            "p95_ms": round(percentile(durations, 95), 3),
+            "p99_ms": round(percentile(durations, 99), 3),
+        })
+
+    def trace_duration(trace_spans):
+        start = min(s["start"] for s in trace_spans)
+        return max((s["start"] - start).total_seconds() * 1000 + s["duration_ms"] for s in trace_spans)
+
+    slowest = sorted(traces.items(), key=lambda item: trace_duration(item[1]), reverse=True)[:top]
+    return {
+        "spans": len(spans),
+        "traces": len(traces),
+        "per_span": per_span,
+        "slowest_traces": [
+            {
+                "trace_id": trace_id,
+                "duration_ms": round(trace_duration(trace_spans), 3),
+                "services": sorted({s["service"] for s in trace_spans}),
+                "tree": span_tree(trace_spans),
+            }
+            for trace_id, trace_spans in slowest
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize exported spans.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--top", type=int, default=5, help="number of slowest traces to print")
+    args = parser.parse_args(argv)
+    print(json.dumps(summarize(load_spans(args.files), args.top), indent=2))
+
+
+if __name__ == "__main__":
+    main()
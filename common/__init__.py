@@ -0,0 +1,10 @@
+"""Code the services share: tracing, metrics, GraphQL plumbing.
+
+Every service imports it as ``common`` next to its own modules. Images are
+built from the repository root so the Dockerfiles can copy it in:
+
+    docker build -f product/Dockerfile .
+
+To run a service straight from its directory, put the repository root on
+the path: ``PYTHONPATH=.. python app.py``.
+"""
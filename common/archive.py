@@ -0,0 +1,373 @@
+"""Move old rows of a time-partitioned table to gzipped CSV files on disk.
+
+    python -m common.archive orders --older-than-days 365 --dir /var/lib/archive
+
+Works a month at a time, oldest first, on every whole month before the
+cutoff. Each run writes what it finds of a month to a new part,
+``<dir>/<table>/<table>-YYYY-MM.<n>.csv.gz``. A month archived again, e.g.
+for rows that arrived late, gets another part; existing parts are never
+replaced. Each part gets an entry in ``<dir>/<table>/manifest.json`` (rows,
+id range, checksum) before anything is removed from the database, and only
+the rows written to it are removed. When the table is range-partitioned by
+month (see the services' sql/), the month's partition is locked against
+writes while it is written out, then detached and dropped. Otherwise, e.g.
+on SQLite, the rows are deleted by the ids read back from the part. A
+crash halfway leaves the rows in the database; the next run writes them to
+another part, and readers take either copy. ``--create-ahead N`` also
+creates the partitions of the next N months.
+
+A part is a series of gzip members of ``BLOCK_ROWS`` rows (still one
+.csv.gz to any gzip tool) with an index of where each block starts.
+``ArchiveReader`` finds archived rows by id, decompressing only the block
+that holds them; services use it as the fallback when a lookup misses the
+database.
+"""
+import argparse
+import bisect
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import MetaData, Table, create_engine, select, text
+
+# Rows fetched per round trip while writing a month out
+ARCHIVE_BATCH_ROWS = 10000
+# Rows per gzip member; a lookup decompresses one
+BLOCK_ROWS = 1000
+# Ids per DELETE when rows are removed one by one
+DELETE_BATCH_ROWS = 1000
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(moment):
+    return month_start(month_start(moment) + timedelta(days=32))
+
+
+def partition_name(table, start):
+    return f"{table}_{start:%Y_%m}"
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+
+def _gzip_rows(rows):
+    text = io.StringIO(newline='')
+    csv.writer(text).writerows(rows)
+    return gzip.compress(text.getvalue().encode('utf-8'), mtime=0)
+
+
+def _write_atomically(path, write):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as out:
+        write(out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temporary, path)
+
+
+class Archive:
+    """The parts and manifest of one table's archive."""
+
+    def __init__(self, directory, table):
+        self.table = table
+        self.path = os.path.join(directory, table)
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+
+    def manifest(self):
+        try:
+            with open(self.manifest_path) as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return {'table': self.table, 'parts': []}
+
+    def record(self, entry):
+        """Add a part to the manifest, atomically."""
+        manifest = self.manifest()
+        manifest['parts'] = sorted(manifest['parts'] + [entry], key=lambda part: (part['month'], part['part']))
+        _write_atomically(self.manifest_path, lambda out: out.write(json.dumps(manifest, indent=2).encode()))
+
+    def _next_part(self, month):
+        # Past every recorded part and every file on disk, so nothing is overwritten
+        part = max((entry['part'] for entry in self.manifest()['parts'] if entry['month'] == month), default=0) + 1
+        while os.path.exists(os.path.join(self.path, f"{self.table}-{month}.{part}.csv.gz")):
+            part += 1
+        return part
+
+    def write_part(self, start, columns, rows):
+        """Write ``rows``, ordered by id, as a new part of the month starting at ``start``.
+
+        Returns the part's manifest entry, or None (and no files) if there
+        were no rows.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        month = f"{start:%Y-%m}"
+        part = self._next_part(month)
+        name = f"{self.table}-{month}.{part}.csv.gz"
+        index_name = f"{self.table}-{month}.{part}.index.json"
+        id_index = columns.index('id')
+        checksum = hashlib.sha256()
+        # [first id, offset, length] of each block
+        blocks = []
+        count, min_id, max_id = 0, None, None
+
+        def write(out):
+            nonlocal count, min_id, max_id
+            offset = 0
+
+            def member(data, first_id=None):
+                nonlocal offset
+                out.write(data)
+                checksum.update(data)
+                if first_id is not None:
+                    blocks.append([first_id, offset, len(data)])
+                offset += len(data)
+
+            member(_gzip_rows([columns]))
+            block = []
+            for row in rows:
+                block.append([_csv_value(value) for value in row])
+                count += 1
+                min_id = row[id_index] if min_id is None else min(min_id, row[id_index])
+                max_id = row[id_index] if max_id is None else max(max_id, row[id_index])
+                if len(block) == BLOCK_ROWS:
+                    member(_gzip_rows(block), block[0][id_index])
+                    block = []
+            if block:
+                member(_gzip_rows(block), block[0][id_index])
+
+        path = os.path.join(self.path, name)
+        _write_atomically(path, write)
+        if not count:
+            os.remove(path)
+            return None
+        _write_atomically(os.path.join(self.path, index_name),
+                          lambda out: out.write(json.dumps({'blocks': blocks}).encode()))
+        return {
+            'month': month,
+            'part': part,
+            'file': name,
+            'index': index_name,
+            'columns': columns,
+            'rows': count,
+            'min_id': min_id,
+            'max_id': max_id,
+            'bytes': os.path.getsize(path),
+            'sha256': checksum.hexdigest(),
+            'archived_at': datetime.now(timezone.utc).isoformat(),
+        }
+
+    def ids(self, entry):
+        """The ids in a part, streamed from its file."""
+        id_index = entry['columns'].index('id')
+        with gzip.open(os.path.join(self.path, entry['file']), 'rt', encoding='utf-8', newline='') as source:
+            rows = csv.reader(source)
+            next(rows)
+            for row in rows:
+                yield int(row[id_index])
+
+
+def is_partitioned(connection, table):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"), {'table': table}
+    ).first() is not None
+
+
+def create_partitions(connection, table, months_ahead, now=None):
+    """Make sure the partitions of this month and the next ``months_ahead`` exist."""
+    start = month_start(now or datetime.now(timezone.utc))
+    for _ in range(months_ahead + 1):
+        end = next_month(start)
+        connection.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{partition_name(table, start)}" PARTITION OF "{table}" '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"))
+        start = end
+
+
+def oldest_month(connection, table):
+    oldest = connection.execute(select(table.c.created_at).order_by(table.c.created_at).limit(1)).scalar()
+    if oldest is None:
+        return None
+    if oldest.tzinfo is None:
+        oldest = oldest.replace(tzinfo=timezone.utc)
+    return month_start(oldest)
+
+
+def partition_exists(connection, partition):
+    return connection.execute(text("SELECT to_regclass(:name)"), {'name': partition}).scalar() is not None
+
+
+def delete_ids(connection, table, condition, ids):
+    """Delete the rows with ``ids`` (an iterable, consumed in batches) that match ``condition``."""
+    batch = []
+    for id in ids:
+        batch.append(id)
+        if len(batch) == DELETE_BATCH_ROWS:
+            connection.execute(table.delete().where(condition & table.c.id.in_(batch)))
+            batch = []
+    if batch:
+        connection.execute(table.delete().where(condition & table.c.id.in_(batch)))
+
+
+def archive_table(engine, directory, table_name, cutoff):
+    """Archive every whole month of ``table_name`` before ``cutoff``; returns the manifest entries."""
+    table = Table(table_name, MetaData(), autoload_with=engine)
+    archive = Archive(directory, table_name)
+    columns = [column.name for column in table.columns]
+    entries = []
+    with engine.connect() as connection:
+        start = oldest_month(connection, table)
+        partitioned = is_partitioned(connection, table_name)
+    while start is not None and next_month(start) <= cutoff:
+        end = next_month(start)
+        in_month = (table.c.created_at >= start) & (table.c.created_at < end)
+        month_rows = select(table).where(in_month).order_by(table.c.id).execution_options(
+            yield_per=ARCHIVE_BATCH_ROWS)
+        partition = partition_name(table_name, start)
+        with engine.connect() as connection:
+            drop_partition = partitioned and partition_exists(connection, partition)
+        if drop_partition:
+            with engine.begin() as connection:
+                # Writes to the month wait while it is written out, so the
+                # partition dropped holds exactly the rows archived. Writes
+                # to other months don't touch this lock.
+                connection.execute(text(f'LOCK TABLE "{partition}" IN SHARE MODE'))
+                entry = archive.write_part(start, columns, connection.execute(month_rows))
+                if entry:
+                    archive.record(entry)
+                connection.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{partition}"'))
+                connection.execute(text(f'DROP TABLE "{partition}"'))
+        else:
+            # Unpartitioned, or rows that went to the default partition.
+            # Written out with plain reads, then only the rows in the part
+            # are deleted: a row that arrives meanwhile stays for the next run
+            with engine.connect() as connection:
+                entry = archive.write_part(start, columns, connection.execute(month_rows))
+            if entry:
+                archive.record(entry)
+                with engine.begin() as connection:
+                    delete_ids(connection, table, in_month, archive.ids(entry))
+        if entry:
+            print(f"Archived {entry['rows']} rows of {table_name} from {entry['month']} to {entry['file']}")
+            entries.append(entry)
+        start = end
+    return entries
+
+
+class ArchiveReader:
+    """Looks up archived rows by id through the manifest and the part indexes.
+
+    Only the block an id falls in is read and decompressed. The indexes of
+    the ``cache_parts`` and the ``cache_blocks`` most recently used parts
+    and blocks stay in memory, so memory is bounded however big the archive
+    gets. The manifest is re-read when the archive job changes it.
+    """
+
+    def __init__(self, directory, table, cache_parts=16, cache_blocks=64):
+        self.archive = Archive(directory, table)
+        self.cache_parts = cache_parts
+        self.cache_blocks = cache_blocks
+        self._manifest_mtime = None
+        self._parts = []
+        self._indexes = OrderedDict()
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _current_parts(self):
+        try:
+            mtime = os.path.getmtime(self.archive.manifest_path)
+        except FileNotFoundError:
+            return []
+        if mtime != self._manifest_mtime:
+            self._parts = self.archive.manifest()['parts']
+            self._manifest_mtime = mtime
+        return self._parts
+
+    @staticmethod
+    def _cached(cache, key, size, load):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+            return value
+        value = cache[key] = load()
+        while len(cache) > size:
+            cache.popitem(last=False)
+        return value
+
+    def _index(self, part):
+        def load():
+            with open(os.path.join(self.archive.path, part['index'])) as source:
+                blocks = json.load(source)['blocks']
+            return [block[0] for block in blocks], blocks
+        return self._cached(self._indexes, part['file'], self.cache_parts, load)
+
+    def _block(self, part, block):
+        _, offset, length = block
+
+        def load():
+            with open(os.path.join(self.archive.path, part['file']), 'rb') as source:
+                source.seek(offset)
+                data = gzip.decompress(source.read(length)).decode('utf-8')
+            rows = csv.DictReader(io.StringIO(data, newline=''), fieldnames=part['columns'])
+            return {int(row['id']): row for row in rows}
+        return self._cached(self._blocks, (part['file'], offset), self.cache_blocks, load)
+
+    def find(self, ids):
+        """Archived rows (dicts of strings, '' for NULL) by id, for the ids that are archived."""
+        found = {}
+        with self._lock:
+            parts = self._current_parts()
+            for id in ids:
+                for part in parts:
+                    if part['min_id'] <= id <= part['max_id']:
+                        first_ids, blocks = self._index(part)
+                        block = blocks[bisect.bisect_right(first_ids, id) - 1]
+                        row = self._block(part, block).get(id)
+                        if row is not None:
+                            found[id] = row
+                            break
+        return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old months of a table to gzipped CSV.")
+    parser.add_argument('table')
+    parser.add_argument('--older-than-days', type=int, required=True)
+    parser.add_argument('--dir', default=os.getenv('ARCHIVE_DIR'), help="defaults to ARCHIVE_DIR")
+    parser.add_argument('--database-uri', default=os.getenv('SQLALCHEMY_DATABASE_URI'))
+    parser.add_argument('--create-ahead', type=int, default=0, help="partitions to create for the coming months")
+    args = parser.parse_args(argv)
+    if not args.dir:
+        parser.error("--dir or ARCHIVE_DIR is required")
+
+    engine = create_engine(args.database_uri)
+    if args.create_ahead:
+        with engine.begin() as connection:
+            if is_partitioned(connection, args.table):
+                create_partitions(connection, args.table, args.create_ahead)
+            else:
+                print(f"{args.table} is not partitioned; --create-ahead ignored")
+    cutoff = datetime.now(timezone.utc) - timedelta(days=args.older_than_days)
+    entries = archive_table(engine, args.dir, args.table, cutoff)
+    print(json.dumps({'table': args.table, 'parts': len(entries), 'rows': sum(e['rows'] for e in entries)}))
+
+
+if __name__ == '__main__':
+    main()
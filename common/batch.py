@@ -0,0 +1,89 @@
+"""Batched GraphQL requests, shared by the Flask and Starlette views.
+
+A POST body may be a JSON array of operations instead of a single one. The
+operations run concurrently with one context, so their DataLoader lookups
+are batched together, and an array of results comes back in the same
+order. The views own the transaction around them.
+"""
+import asyncio
+import json
+from contextlib import contextmanager
+
+from graphql import GraphQLError
+from strawberry.exceptions import MissingQueryError
+from strawberry.http import GraphQLRequestData
+from strawberry.http.exceptions import HTTPException
+from strawberry.schema.exceptions import InvalidOperationTypeError
+from strawberry.types import ExecutionResult
+from strawberry.types.graphql import OperationType
+
+
+class BatchError(Exception):
+    """The body is an array, but not one the service takes (answered with a 400)."""
+
+
+def parse_batch(operations, max_batch):
+    """One GraphQLRequestData per array entry; an entry that isn't an object fails on its own when run."""
+    if not operations or len(operations) > max_batch:
+        raise BatchError(f"A batch takes 1 to {max_batch} operations")
+    return [
+        GraphQLRequestData(query=op.get("query"), variables=op.get("variables"), operation_name=op.get("operationName"))
+        if isinstance(op, dict) else GraphQLRequestData(query=None, variables=None, operation_name=None)
+        for op in operations
+    ]
+
+
+@contextmanager
+def parsing_body():
+    """Turns the errors of ``parse_http_body`` into the 400s strawberry's own execute_operation answers."""
+    try:
+        yield
+    except json.JSONDecodeError as e:
+        raise HTTPException(400, "Unable to parse request body as JSON") from e
+    except KeyError as e:
+        raise HTTPException(400, "File(s) missing in form data") from e
+
+
+def allowed_operation_types(view, method):
+    allowed = OperationType.from_http(method)
+    if not view.allow_queries_via_get and method == "GET":
+        allowed = allowed - {OperationType.QUERY}
+    return allowed
+
+
+async def execute_operations(schema, operations, context, root_value, allowed_operation_types, batched=False):
+    """Results of ``operations``, run concurrently with one context."""
+
+    async def execute(operation):
+        try:
+            return await schema.execute(
+                operation.query,
+                root_value=root_value,
+                variable_values=operation.variables,
+                context_value=context,
+                operation_name=operation.operation_name,
+                allowed_operation_types=allowed_operation_types,
+            )
+        except (MissingQueryError, InvalidOperationTypeError) as e:
+            if not batched:
+                raise
+            # In a batch a bad entry fails on its own, like any other error
+            message = "No GraphQL query found in the request" if isinstance(e, MissingQueryError) else str(e)
+            return ExecutionResult(data=None, errors=[GraphQLError(message)])
+
+    return await asyncio.gather(*(execute(operation) for operation in operations))
+
+
+# What the operations of a rolled-back batch that had succeeded report instead
+ROLLED_BACK = "Not applied: another operation in the batch failed, so the batch was rolled back"
+
+
+def rolled_back(results):
+    """``results`` of a batch whose transaction was rolled back.
+
+    The operations that succeeded may have returned rows that are now
+    gone (addOrder's new id, or a query that read it), so each of them
+    reports an error instead of its data.
+    """
+    return [result if result.errors else ExecutionResult(data=None, errors=[GraphQLError(ROLLED_BACK)])
+            for result in results]
@@ -0,0 +1,140 @@
+"""Strawberry schema extensions the GraphQL services install."""
+import time
+from inspect import isawaitable
+
+from graphql import FieldNode
+from graphql.utilities import get_operation_ast
+from opentelemetry import trace
+from prometheus_client import Counter, Histogram
+from strawberry.extensions import SchemaExtension
+from strawberry.extensions.tracing.utils import should_skip_tracing
+
+from common.tracing import tracer
+
+GRAPHQL_OPERATION_SECONDS = Histogram(
+    "graphql_operation_duration_seconds", "GraphQL operation latency", ["operation_type", "root_fields"])
+GRAPHQL_RESOLVER_SECONDS = Histogram(
+    "graphql_resolver_duration_seconds", "Root resolver latency", ["parent_type", "field"])
+GRAPHQL_RESOLVER_ERRORS = Counter(
+    "graphql_resolver_errors_total", "Root resolvers that raised", ["parent_type", "field"])
+
+# Selectable on every root type without being one of its fields
+META_FIELDS = frozenset({"__typename", "__schema", "__type"})
+
+
+def root_fields(execution_context):
+    """The operation's root fields, sorted and comma-separated, or "invalid".
+
+    Only an operation that parsed and validated is labelled by its fields,
+    and only if each one is a field of the schema's root type, so a client
+    can't add label values by sending made-up queries.
+    """
+    document = execution_context.graphql_document
+    # Resolver errors carry a path; parse, validation and variable errors don't
+    if document is None or any(not error.path for error in execution_context.errors or ()):
+        return "invalid"
+    operation = get_operation_ast(document, execution_context.operation_name)
+    if operation is None:
+        return "invalid"
+    root_type = execution_context.schema._schema.get_root_type(operation.operation)
+    names = {s.name.value for s in operation.selection_set.selections if isinstance(s, FieldNode)}
+    if root_type is None or not names or not names <= root_type.fields.keys() | META_FIELDS:
+        return "invalid"
+    return ",".join(sorted(names))
+
+
+class MetricsExtension(SchemaExtension):
+    """Records per-operation latency and the latency of every root resolver.
+
+    Nested fields are plain attribute reads in these schemas, so only root
+    fields are timed; that keeps the per-field overhead to one comparison.
+    """
+
+    def on_operation(self):
+        # Strawberry reuses extension instances across operations; hold on to
+        # this operation's context before anything else can replace it
+        execution_context = self.execution_context
+        started = time.perf_counter()
+        yield
+        fields = root_fields(execution_context)
+        operation_type = "invalid" if fields == "invalid" else execution_context.operation_type.value
+        GRAPHQL_OPERATION_SECONDS.labels(operation_type, fields).observe(time.perf_counter() - started)
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        if info.path.prev is not None:
+            return _next(root, info, *args, **kwargs)
+
+        labels = (info.parent_type.name, info.field_name)
+        started = time.perf_counter()
+        try:
+            result = _next(root, info, *args, **kwargs)
+        except Exception:
+            GRAPHQL_RESOLVER_ERRORS.labels(*labels).inc()
+            GRAPHQL_RESOLVER_SECONDS.labels(*labels).observe(time.perf_counter() - started)
+            raise
+        if isawaitable(result):
+            return self._resolve_async(result, labels, started)
+        GRAPHQL_RESOLVER_SECONDS.labels(*labels).observe(time.perf_counter() - started)
+        return result
+
+    async def _resolve_async(self, result, labels, started):
+        try:
+            return await result
+        except Exception:
+            GRAPHQL_RESOLVER_ERRORS.labels(*labels).inc()
+            raise
+        finally:
+            GRAPHQL_RESOLVER_SECONDS.labels(*labels).observe(time.perf_counter() - started)
+
+
+class TracingExtension(SchemaExtension):
+    """Spans for each GraphQL operation, its parse/validate phases and resolvers.
+
+    Strawberry shares extension instances between concurrent operations, so
+    nothing is kept on ``self``: the operation span is simply made current
+    and everything below it picks it up from the OpenTelemetry context.
+    Resolver arguments are deliberately not recorded, and the client's
+    operation name is an attribute rather than part of the span name.
+    """
+
+    def on_operation(self):
+        execution_context = self.execution_context
+        span = tracer.start_span("GraphQL operation")
+        try:
+            with trace.use_span(span, end_on_exit=False):
+                yield
+        finally:
+            if execution_context.operation_name:
+                span.set_attribute("graphql.operation.name", execution_context.operation_name)
+            span.end()
+
+    def on_parse(self):
+        with tracer.start_as_current_span("GraphQL parsing"):
+            yield
+
+    def on_validate(self):
+        with tracer.start_as_current_span("GraphQL validation"):
+            yield
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        if should_skip_tracing(_next, info):
+            return _next(root, info, *args, **kwargs)
+
+        span = tracer.start_span(f"GraphQL resolving: {info.field_name}", attributes={
+            "graphql.parent_type": info.parent_type.name,
+            "graphql.field": info.field_name,
+        })
+        try:
+            with trace.use_span(span, end_on_exit=False, record_exception=True, set_status_on_exception=True):
+                result = _next(root, info, *args, **kwargs)
+        except Exception:
+            span.end()
+            raise
+        if isawaitable(result):
+            return self._resolve_async(span, result)
+        span.end()
+        return result
+
+    async def _resolve_async(self, span, result):
+        with trace.use_span(span, end_on_exit=True, record_exception=True, set_status_on_exception=True):
+            return await result
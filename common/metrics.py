@@ -0,0 +1,127 @@
+"""Prometheus metrics every service records.
+
+Everything is recorded in-process and scraped from /metrics; labels only
+ever take values from the schema or from fixed call sites so cardinality
+stays bounded. Service specific metrics live in the service
+(authentication's metrics.py, product's routing.py).
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from opentelemetry.trace import SpanKind
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from starlette.responses import Response
+
+from common.tracing import traced
+from common.web import ClosingIterator, method_label, path_label
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "path", "status"])
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Database query latency")
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "Database queries issued per HTTP request",
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 89, 144))
+OUTBOUND_SECONDS = Histogram(
+    "outbound_request_duration_seconds", "Calls to other services", ["target", "operation", "outcome"])
+
+_request_queries = ContextVar("request_queries", default=None)
+
+
+def count_query(elapsed):
+    """Record one database query that took ``elapsed`` seconds against the current request."""
+    DB_QUERY_SECONDS.observe(elapsed)
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+@contextmanager
+def track_outbound(target, operation):
+    """Time a call to another service and wrap it in a client span."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with traced(f"{target}.{operation}", kind=SpanKind.CLIENT, **{"peer.service": target}):
+            yield
+        outcome = "ok"
+    finally:
+        OUTBOUND_SECONDS.labels(target, operation, outcome).observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """WSGI middleware: request latency and DB queries per request.
+
+    The request is only finished once the server closes the response
+    iterable, so streamed bodies are included. ``paths`` lists the routes
+    worth their own label; anything else is reported as "other".
+    """
+
+    def __init__(self, app, paths=()):
+        self.app = app
+        self.paths = set(paths)
+
+    def __call__(self, environ, start_response):
+        status = ["500"]
+
+        def start_response_wrapper(status_line, headers, exc_info=None):
+            status[0] = status_line.split(" ", 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        counter = [0]
+        _request_queries.set(counter)
+        started = time.perf_counter()
+        method = method_label(environ.get("REQUEST_METHOD", ""))
+        path = path_label(environ.get("PATH_INFO", ""), self.paths)
+
+        def finish():
+            HTTP_REQUEST_SECONDS.labels(method, path, status[0]).observe(time.perf_counter() - started)
+            DB_QUERIES_PER_REQUEST.observe(counter[0])
+            _request_queries.set(None)
+
+        try:
+            body = self.app(environ, start_response_wrapper)
+        except Exception:
+            finish()
+            raise
+        return ClosingIterator(body, finish)
+
+
+class AsgiMetricsMiddleware:
+    """ASGI counterpart of ``MetricsMiddleware``."""
+
+    def __init__(self, app, paths=()):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        counter = [0]
+        token = _request_queries.set(counter)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(
+                method_label(scope["method"]), path_label(scope["path"], self.paths), str(status[0]),
+            ).observe(time.perf_counter() - started)
+            DB_QUERIES_PER_REQUEST.observe(counter[0])
+            _request_queries.reset(token)
+
+
+def metrics_view():
+    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
+
+async def metrics_endpoint(request):
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,74 @@
+from functools import wraps
+from inspect import iscoroutinefunction
+
+# Permission registry shared by the services that issue or check tokens
+# (authorization, product, payment). Tokens carry the granted permissions as
+# one integer claim, "perm", with a bit per name.
+#
+# Append only: reusing or reordering a bit would change what tokens that
+# are already out there grant.
+PERMISSION_BITS = {
+    "manage_users": 1 << 0,
+    "manage_products": 1 << 1,
+    "view_orders": 1 << 2,
+    "process_orders": 1 << 3,
+    "view_products": 1 << 4,
+    "place_orders": 1 << 5,
+    # Catalog changes (add/remove products); granted by name, no role carries it
+    "admin": 1 << 6,
+}
+
+PERMISSION_CLAIM = "perm"
+
+
+def permission_mask(names):
+    """OR of the bits for ``names``, a list of permission names; raises KeyError for an unknown name."""
+    mask = 0
+    for name in names:
+        mask |= PERMISSION_BITS[name]
+    return mask
+
+
+def permission_names(mask):
+    return [name for name, bit in PERMISSION_BITS.items() if mask & bit]
+
+
+def token_mask(claims):
+    """Permission bits of decoded token claims.
+
+    Tokens issued before the "perm" claim carry a "permissions" list
+    instead; they live 15 minutes, so this fallback can go soon after.
+    """
+    mask = claims.get(PERMISSION_CLAIM)
+    if mask is None:
+        return sum(PERMISSION_BITS.get(name, 0) for name in set(claims.get("permissions") or ()))
+    return mask
+
+
+def require_permissions(allowed_permissions):
+    """Resolver decorator: the caller's token must grant one of ``allowed_permissions``.
+
+    The views put the decoded token (or None) in ``info.context['token']``.
+    The names are resolved to a bitmask once, at import, so an unknown name
+    fails right there.
+    """
+    required = permission_mask(allowed_permissions)
+
+    def check(info):
+        token = info.context['token']
+        if not token or not token_mask(token) & required:
+            raise Exception("Unauthorized access")
+
+    def decorator(fn):
+        if iscoroutinefunction(fn):
+            @wraps(fn)
+            async def wrapper(*args, **kwargs):
+                check(kwargs['info'])
+                return await fn(*args, **kwargs)
+        else:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                check(kwargs['info'])
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
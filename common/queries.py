@@ -0,0 +1,61 @@
+"""Instrumentation of every SQLAlchemy statement, for the services that use it (product, payment).
+
+Importing the module times every statement on every engine and counts it
+against the current request; ``trace_queries`` adds a span per statement.
+"""
+import time
+
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from common.metrics import count_query
+from common.tracing import tracer
+
+# Longer statements (bulk inserts) are cut before they go into a span attribute
+MAX_STATEMENT_LENGTH = 1000
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    count_query(time.perf_counter() - conn.info["query_started"].pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
+
+def trace_queries():
+    """A db.query span for every statement on every engine; call once tracing is configured."""
+    event.listen(Engine, "before_cursor_execute", _start_query_span)
+    event.listen(Engine, "after_cursor_execute", _end_query_span)
+    event.listen(Engine, "handle_error", _fail_query_span)
+
+
+def _start_query_span(conn, cursor, statement, parameters, execution_context, executemany):
+    span = tracer.start_span("db.query", kind=SpanKind.CLIENT, attributes={
+        "db.system": conn.dialect.name,
+        "db.statement": statement[:MAX_STATEMENT_LENGTH],
+    })
+    conn.info.setdefault("query_spans", []).append(span)
+
+
+def _end_query_span(conn, cursor, statement, parameters, execution_context, executemany):
+    conn.info["query_spans"].pop().end()
+
+
+def _fail_query_span(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_spans"):
+        span = conn.info["query_spans"].pop()
+        span.record_exception(exception_context.original_exception)
+        span.set_status(Status(StatusCode.ERROR))
+        span.end()
@@ -0,0 +1,138 @@
+"""What the archive job keeps, removes and reads back, on SQLite.
+
+    cd common && PYTHONPATH=.. python -m unittest
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, func, insert, select
+
+from common import archive
+from common.archive import Archive, ArchiveReader, archive_table
+
+CUTOFF = datetime(2024, 6, 1, tzinfo=timezone.utc)
+MARCH = datetime(2024, 3, 10, tzinfo=timezone.utc)
+APRIL = datetime(2024, 4, 10, tzinfo=timezone.utc)
+RECENT = datetime(2024, 7, 1, tzinfo=timezone.utc)
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="archive-test-")
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.directory = os.path.join(self.workdir, "archive")
+        self.engine = create_engine("sqlite:///" + os.path.join(self.workdir, "db.sqlite3"))
+        self.orders = Table("orders", MetaData(), Column("id", Integer, primary_key=True),
+                            Column("note", String), Column("created_at", DateTime(timezone=True)))
+        self.orders.metadata.create_all(self.engine)
+        # Small blocks, so a month spans several
+        patch = mock.patch.object(archive, "BLOCK_ROWS", 3)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def add(self, *rows):
+        with self.engine.begin() as connection:
+            connection.execute(insert(self.orders), [
+                {"id": id, "note": f"order {id}", "created_at": created_at} for id, created_at in rows])
+
+    def ids_in_db(self):
+        with self.engine.connect() as connection:
+            return sorted(connection.execute(select(self.orders.c.id)).scalars())
+
+    def run_archive(self):
+        return archive_table(self.engine, self.directory, "orders", CUTOFF)
+
+    def test_months_before_the_cutoff_move_to_the_archive(self):
+        self.add(*[(id, MARCH) for id in range(1, 8)], (8, APRIL), (9, RECENT))
+
+        entries = self.run_archive()
+
+        self.assertEqual([(entry["month"], entry["part"], entry["rows"]) for entry in entries],
+                         [("2024-03", 1, 7), ("2024-04", 1, 1)])
+        self.assertEqual(self.ids_in_db(), [9])
+        found = ArchiveReader(self.directory, "orders").find([1, 5, 7, 8, 9])
+        self.assertEqual(sorted(found), [1, 5, 7, 8])
+        self.assertEqual(found[5]["note"], "order 5")
+
+    def test_archiving_a_month_again_adds_a_part(self):
+        self.add((1, MARCH), (2, MARCH))
+        self.run_archive()
+        first = Archive(self.directory, "orders").manifest()["parts"][0]
+        with open(os.path.join(self.directory, "orders", first["file"]), "rb") as part:
+            first_bytes = part.read()
+        # A late row for a month that is already archived
+        self.add((10, MARCH))
+
+        self.run_archive()
+
+        parts = Archive(self.directory, "orders").manifest()["parts"]
+        self.assertEqual([(part["month"], part["part"], part["rows"]) for part in parts],
+                         [("2024-03", 1, 2), ("2024-03", 2, 1)])
+        with open(os.path.join(self.directory, "orders", first["file"]), "rb") as part:
+            self.assertEqual(part.read(), first_bytes)
+        self.assertEqual(sorted(ArchiveReader(self.directory, "orders").find([1, 2, 10])), [1, 2, 10])
+
+    def test_an_unrecorded_file_is_not_overwritten(self):
+        # Left by a run that died before recording it
+        os.makedirs(os.path.join(self.directory, "orders"))
+        with open(os.path.join(self.directory, "orders", "orders-2024-03.1.csv.gz"), "wb") as stray:
+            stray.write(b"stray")
+        self.add((1, MARCH))
+
+        entries = self.run_archive()
+
+        self.assertEqual(entries[0]["file"], "orders-2024-03.2.csv.gz")
+
+    def test_rows_arriving_while_a_month_is_written_are_not_deleted(self):
+        self.add((1, MARCH), (2, MARCH))
+        write_part = Archive.write_part
+
+        def write_then_insert(archive_, start, columns, rows):
+            entry = write_part(archive_, start, columns, rows)
+            if start.month == MARCH.month:
+                self.add((3, MARCH))
+            return entry
+
+        with mock.patch.object(Archive, "write_part", write_then_insert):
+            entries = self.run_archive()
+
+        self.assertEqual(entries[0]["rows"], 2)
+        self.assertEqual(self.ids_in_db(), [3])
+        self.run_archive()
+        self.assertEqual(self.ids_in_db(), [])
+        self.assertEqual(sorted(ArchiveReader(self.directory, "orders").find([1, 2, 3])), [1, 2, 3])
+
+    def test_empty_months_leave_no_files(self):
+        self.add((1, MARCH), (2, RECENT))
+
+        self.run_archive()
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, "orders"))),
+                         ["manifest.json", "orders-2024-03.1.csv.gz", "orders-2024-03.1.index.json"])
+
+    def test_reader_keeps_a_bounded_number_of_blocks(self):
+        self.add(*[(id, MARCH) for id in range(1, 31)])
+        self.run_archive()
+        reader = ArchiveReader(self.directory, "orders", cache_parts=1, cache_blocks=2)
+
+        found = reader.find(range(1, 31))
+
+        self.assertEqual(sorted(found), list(range(1, 31)))
+        self.assertEqual(len(reader._blocks), 2)
+        self.assertEqual(len(reader._indexes), 1)
+
+    def test_parts_are_plain_gzipped_csv(self):
+        self.add(*[(id, MARCH) for id in range(1, 8)])
+        entry, = self.run_archive()
+
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.execute(select(func.count()).select_from(self.orders)).scalar(), 0)
+        self.assertEqual(list(Archive(self.directory, "orders").ids(entry)), list(range(1, 8)))
+
+
+if __name__ == "__main__":
+    unittest.main()
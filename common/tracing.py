@@ -0,0 +1,147 @@
+"""OpenTelemetry tracing shared by the services.
+
+``configure_tracing`` installs the provider once per process; the WSGI and
+ASGI middlewares open one server span per request, named by route, and
+``traced``/``inject_headers`` cover internal work and outbound calls.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from common.web import ClosingIterator, method_label, path_label
+
+# Tracing is off unless TRACE_EXPORT_FILE is set; W3C trace context is still
+# passed through from inbound to outbound requests either way.
+TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE')
+
+tracer = trace.get_tracer(__name__)
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Appends finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(json.dumps(json.loads(span.to_json())) + "\n" for span in spans)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+def configure_tracing(service_name):
+    if not TRACE_EXPORT_FILE:
+        return False
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(JsonLinesSpanExporter(TRACE_EXPORT_FILE)))
+    trace.set_tracer_provider(provider)
+    return True
+
+
+@contextmanager
+def traced(name, kind=SpanKind.INTERNAL, **attributes):
+    with tracer.start_as_current_span(name, kind=kind, attributes=attributes) as span:
+        yield span
+
+
+def inject_headers(headers=None):
+    """Return ``headers`` plus the current trace context (traceparent)."""
+    headers = dict(headers or {})
+    propagate.inject(headers)
+    return headers
+
+
+def _server_span(method, path, paths):
+    """A server span named after the route; the raw path only goes in an attribute."""
+    return tracer.start_span(f"{method_label(method)} {path_label(path, paths)}", kind=SpanKind.SERVER,
+                             attributes={"http.method": method, "http.target": path})
+
+
+class TracingMiddleware:
+    """WSGI middleware: continues the caller's trace and opens a server span.
+
+    The span stays current until the server closes the response iterable,
+    so queries issued while streaming a body are attributed to it.
+    ``paths`` lists the routes that name their own span; the rest are
+    "<method> other".
+    """
+
+    def __init__(self, app, paths=()):
+        self.app = app
+        self.paths = set(paths)
+
+    def __call__(self, environ, start_response):
+        carrier = {
+            key[5:].replace("_", "-").lower(): value
+            for key, value in environ.items() if key.startswith("HTTP_")
+        }
+        token = context.attach(propagate.extract(carrier))
+        span = _server_span(environ.get("REQUEST_METHOD", ""), environ.get("PATH_INFO", ""), self.paths)
+        span_token = context.attach(trace.set_span_in_context(span))
+
+        def start_response_wrapper(status_line, headers, exc_info=None):
+            status = int(status_line.split(" ", 1)[0])
+            span.set_attribute("http.status_code", status)
+            if status >= 500:
+                span.set_status(Status(StatusCode.ERROR))
+            return start_response(status_line, headers, exc_info)
+
+        def finish():
+            span.end()
+            context.detach(span_token)
+            context.detach(token)
+
+        try:
+            body = self.app(environ, start_response_wrapper)
+        except Exception as e:
+            span.record_exception(e)
+            span.set_status(Status(StatusCode.ERROR))
+            finish()
+            raise
+        return ClosingIterator(body, finish)
+
+
+class AsgiTracingMiddleware:
+    """ASGI counterpart of ``TracingMiddleware``."""
+
+    def __init__(self, app, paths=()):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        carrier = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        token = context.attach(propagate.extract(carrier))
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            span = _server_span(scope["method"], scope["path"], self.paths)
+            with trace.use_span(span, end_on_exit=True):
+                await self.app(scope, receive, send_wrapper)
+                span.set_attribute("http.status_code", status[0])
+                if status[0] >= 500:
+                    span.set_status(Status(StatusCode.ERROR))
+        finally:
+            context.detach(token)
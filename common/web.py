@@ -0,0 +1,35 @@
+"""Helpers for the HTTP middlewares in tracing.py and metrics.py."""
+
+HTTP_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+
+def method_label(method):
+    """``method``, or "other" for anything a client made up."""
+    return method if method in HTTP_METHODS else "other"
+
+
+def path_label(path, paths):
+    """``path`` if it is one of the service's routes, else "other".
+
+    Raw paths come from the client; using them as span names or label
+    values would let anyone create as many as they like.
+    """
+    return path if path in paths else "other"
+
+
+class ClosingIterator:
+    """WSGI response wrapper that runs ``on_close`` once the server is done with it."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._on_close()
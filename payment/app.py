@@ -1,11 +1,23 @@
+import asyncio
+from datetime import datetime, timezone
 from flask import Flask, jsonify, request, g
 from flask_sqlalchemy import SQLAlchemy
 import paypalrestsdk
 from strawberry.flask.views import GraphQLView
 import strawberry
 import jwt
+from sqlalchemy.orm import Session
+from strawberry.dataloader import DataLoader
+from strawberry.http import process_result
+from strawberry.types import Info
+from strawberry.types.graphql import OperationType
 import requests
 from config import Config
+from common.batch import BatchError, allowed_operation_types, execute_operations, parse_batch, parsing_body
+from common.extensions import MetricsExtension, TracingExtension
+from common.metrics import MetricsMiddleware, metrics_view, track_outbound
+from common.queries import trace_queries
+from common.tracing import TracingMiddleware, configure_tracing, inject_headers
 from typing import List, Optional
 
 app = Flask(__name__)
@@ -38,52 +50,52 @@ def before_request():
     except Exception as e:
         return "401 Unauthorized\n{}\n\n".format(e), 401
 
-       
-def require_permissions(allowed_permissions):
-    def decorator(fn):
-        @wraps(fn)
-        def wrapper(*args, **kwargs):
-            user = g.get('user') 
-            print("User in require_permissions:", user)  
-            if not user or not set(user.get('permissions', [])).intersection(allowed_permissions):
-                print("Unauthorized access")  
-                raise Exception("Unauthorized access")
-            return fn(*args, **kwargs)
-        return wrapper
-    return decorator
-
-paypalrestsdk.configure({
+
+paypal_options = {
     "mode": app.config["PAYPAL_MODE"],
     "client_id": app.config["PAYPAL_CLIENT_ID"],
     "client_secret": app.config["PAYPAL_CLIENT_SECRET"]
-})
+}
+if app.config["PAYPAL_ENDPOINT"]:
+    paypal_options["endpoint"] = app.config["PAYPAL_ENDPOINT"]
+paypalrestsdk.configure(paypal_options)
+
 
+def utcnow():
+    return datetime.now(timezone.utc)
 
 class Payment(db.Model):
     __tablename__ = 'payments'
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer)
+    order_id = db.Column(db.Integer, index=True)
     amount = db.Column(db.Float)
     status = db.Column(db.String(50))
-
-def fetch_order(order_id: int):
-    query = """
-    query GetOrder($id: Int!) {
-        order(id: $id) {
-            id
-            totalPrice
-        }
-    }
-    """
-    variables = {"id": order_id}
-    response = requests.post(
-        app.config["PRODUCT_SERVICE_URL"], 
-        json={"query": query, "variables": variables}
-    )
-    data = response.json()
+    # Partition key on Postgres (sql/partition_payments.sql); common/archive.py moves old months out
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow, index=True)
+
+def fetch_orders(order_ids: List[int]) -> List[Optional[dict]]:
+    # One aliased order(id) field per order, so a whole batch of payments
+    # costs one round trip (which product answers with one IN query)
+    ids = [f"$id{i}: Int!" for i in range(len(order_ids))]
+    fields = [f"o{i}: order(id: $id{i}) {{ id totalPrice }}" for i in range(len(order_ids))]
+    query = f"query GetOrders({', '.join(ids)}) {{ {' '.join(fields)} }}"
+    variables = {f"id{i}": order_id for i, order_id in enumerate(order_ids)}
+    with track_outbound("product", "order"):
+        response = requests.post(
+            app.config["PRODUCT_SERVICE_URL"], 
+            json={"query": query, "variables": variables},
+            headers=inject_headers()
+        )
+        data = response.json()
     if "errors" in data:
         raise Exception(data["errors"])
-    return data["data"]["order"]
+    return [data["data"][f"o{i}"] for i in range(len(order_ids))]
+
+def create_loaders():
+    async def load_orders(order_ids):
+        return fetch_orders(order_ids)
+
+    return {'order': DataLoader(load_fn=load_orders)}
 
 def process_paypal_payment(order_total: float) -> dict:
     payment = paypalrestsdk.Payment({
@@ -100,7 +112,9 @@ def process_paypal_payment(order_total: float) -> dict:
             "cancel_url": "courses.uit.edu.vn"}
     })
 
-    if payment.create():
+    with track_outbound("paypal", "create_payment"):
+        created = payment.create()
+    if created:
         print("Payment created")
         return {"paymentID": payment.id, "links": payment.links}
     else:
@@ -109,44 +123,98 @@ def process_paypal_payment(order_total: float) -> dict:
 
 @strawberry.type
 class Query:
-    with app.app_context():
-        hello: str = "Hello, this is a placeholder query."
+    hello: str = "Hello, this is a placeholder query."
 
 @strawberry.type
 class Mutation:
     @strawberry.mutation
-    def process_payment(self, order_id: int) -> str:
-        with app.app_context():
-            order = fetch_order(order_id)
-            if not order:
-                raise Exception("Order not found")
-            total_price = order["totalPrice"]
-            print("Total price is" + str(total_price))
-            payment_response = process_paypal_payment(total_price)
-
-            new_payment = Payment(order_id=order_id, amount=total_price, status="Pending")
-            db.session.add(new_payment)
-            db.session.commit()
-
-            for link in payment_response['links']:
-                if link['rel'] == 'approval_url':
-                    return link['href']
-
-            return "Error: PayPal approval URL not found"
+    async def process_payment(self, info: Info, order_id: int) -> str:
+        order = await info.context['loaders']['order'].load(order_id)
+        if not order:
+            raise Exception("Order not found")
+        total_price = order["totalPrice"]
+        print("Total price is" + str(total_price))
+        # A PayPal payment can't be rolled back, so the row recording it is
+        # committed on its own session, before and after the call, whatever
+        # happens to the rest of the request. A row left "Creating" means the
+        # process died mid-call and PayPal has to be asked.
+        with Session(db.engine, expire_on_commit=False) as session:
+            new_payment = Payment(order_id=order_id, amount=total_price, status="Creating")
+            session.add(new_payment)
+            session.commit()
+            try:
+                payment_response = process_paypal_payment(total_price)
+            except Exception:
+                new_payment.status = "Failed"
+                session.commit()
+                raise
+            new_payment.status = "Pending"
+            session.commit()
+
+        for link in payment_response['links']:
+            if link['rel'] == 'approval_url':
+                return link['href']
+
+        return "Error: PayPal approval URL not found"
         
 class CustomGraphQLView(GraphQLView):
+    """Runs a request's operations with one context and one set of DataLoaders.
+
+    A POST body may be a JSON array of operations instead of a single one;
+    they run concurrently, so their order lookups are batched
+    together, and an array of results comes back in the same order. There
+    is no request-wide transaction: each payment commits its own row
+    (``process_payment``), so one failing operation never undoes another.
+    """
+
     def get_context(self, request, response=None) -> dict:
         context = super().get_context(request, response)
         context['token'] = g.get('user') 
+        context['loaders'] = create_loaders()
         return context
 
-
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+    def dispatch_request(self):
+        operations = request.get_json(silent=True) if request.method == 'POST' else None
+        if not isinstance(operations, list):
+            return super().dispatch_request()
+        try:
+            batch = parse_batch(operations, Config.GRAPHQL_MAX_BATCH)
+        except BatchError as e:
+            return jsonify({"error": str(e)}), 400
+
+        context = self.get_context(request, response=self.get_sub_response(request))
+        results = self.execute_all(batch, context, self.get_root_value(request), OperationType.from_http("POST"), batched=True)
+        return jsonify([process_result(result) for result in results])
+
+    def execute_operation(self, request, context, root_value):
+        request_adapter = self.request_adapter_class(request)
+        with parsing_body():
+            request_data = self.parse_http_body(request_adapter)
+        allowed = allowed_operation_types(self, request_adapter.method)
+        return self.execute_all([request_data], context, root_value, allowed)[0]
+
+    def execute_all(self, operations, context, root_value, allowed_operation_types=None, batched=False):
+        # A short-lived loop per request, for the DataLoaders
+        return asyncio.run(execute_operations(
+            self.schema, operations, context, root_value, allowed_operation_types, batched))
+
+
+tracing_enabled = configure_tracing("payment-service")
+if tracing_enabled:
+    trace_queries()
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    extensions=[MetricsExtension] + ([TracingExtension] if tracing_enabled else [])
+)
 
 app.add_url_rule(
     '/graphql',
     view_func=CustomGraphQLView.as_view('graphql_view', schema=schema)
 )
+app.add_url_rule('/metrics', 'metrics', metrics_view)
+app.wsgi_app = MetricsMiddleware(app.wsgi_app, paths=['/graphql', '/metrics'])
+app.wsgi_app = TracingMiddleware(app.wsgi_app, paths=['/graphql', '/metrics'])
 
 
 with app.app_context():
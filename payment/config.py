@@ -1,9 +1,14 @@
+import os
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = ''
+    SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI', '')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    PAYPAL_CLIENT_ID = ''
-    PAYPAL_CLIENT_SECRET = ''
-    PAYPAL_MODE = 'sandbox'
-    PRODUCT_SERVICE_URL = 'http://localhost:8000/graphql'
-    SECRET_KEY = ''
-    
\ No newline at end of file
+    PAYPAL_CLIENT_ID = os.getenv('PAYPAL_CLIENT_ID', '')
+    PAYPAL_CLIENT_SECRET = os.getenv('PAYPAL_CLIENT_SECRET', '')
+    PAYPAL_MODE = os.getenv('PAYPAL_MODE', 'sandbox')
+    # Overrides the PayPal REST host (e.g. a local stand-in); empty uses the mode default
+    PAYPAL_ENDPOINT = os.getenv('PAYPAL_ENDPOINT', '')
+    PRODUCT_SERVICE_URL = os.getenv('PRODUCT_SERVICE_URL', 'http://localhost:8000/graphql')
+    SECRET_KEY = os.getenv('SECRET_KEY', '')
+    # Most operations one POST to /graphql may carry as a JSON array
+    GRAPHQL_MAX_BATCH = int(os.getenv('GRAPHQL_MAX_BATCH', '100'))
@@ -0,0 +1,53 @@
+-- Turns payments into a table range-partitioned by month on created_at.
+-- Run once, in a maintenance window, since it copies the whole table:
+--
+--     psql "$DATABASE_URL" -f sql/partition_payments.sql
+--
+-- Partitions are named payments_YYYY_MM (UTC months), which common/archive.py
+-- relies on. The next three months are created here; schedule
+-- `python -m common.archive payments --create-ahead 3 --older-than-days N` to keep
+-- creating them and to archive the old ones. Rows without a partition
+-- land in payments_default. Payments that existed before created_at was added
+-- get the time of the migration.
+BEGIN;
+SET LOCAL TIME ZONE 'UTC';
+
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE payments RENAME TO payments_unpartitioned;
+-- Index and constraint names are per schema; free them for the new table
+ALTER TABLE payments_unpartitioned RENAME CONSTRAINT payments_pkey TO payments_unpartitioned_pkey;
+ALTER INDEX IF EXISTS ix_payments_order_id RENAME TO ix_payments_unpartitioned_order_id;
+ALTER INDEX IF EXISTS ix_payments_created_at RENAME TO ix_payments_unpartitioned_created_at;
+
+-- The partition key has to be part of the primary key; ids still come from one sequence
+CREATE TABLE payments (
+    id integer NOT NULL DEFAULT nextval('payments_id_seq'),
+    order_id integer,
+    amount double precision,
+    status varchar(50),
+    created_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE INDEX ix_payments_order_id ON payments (order_id);
+CREATE TABLE payments_default PARTITION OF payments DEFAULT;
+
+DO $$
+DECLARE
+    month timestamptz;
+BEGIN
+    FOR month IN SELECT generate_series(
+        date_trunc('month', coalesce((SELECT min(created_at) FROM payments_unpartitioned), now())),
+        date_trunc('month', now()) + interval '3 months',
+        interval '1 month')
+    LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF payments FOR VALUES FROM (%L) TO (%L)',
+                       'payments_' || to_char(month, 'YYYY_MM'), month, month + interval '1 month');
+    END LOOP;
+END $$;
+
+INSERT INTO payments (id, order_id, amount, status, created_at)
+SELECT id, order_id, amount, status, coalesce(created_at, now()) FROM payments_unpartitioned;
+
+ALTER SEQUENCE payments_id_seq OWNED BY payments.id;
+DROP TABLE payments_unpartitioned;
+COMMIT;
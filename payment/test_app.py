@@ -0,0 +1,88 @@
+"""processPayment keeps a row for every payment PayPal was asked to create.
+
+    cd payment && PYTHONPATH=.. python -m unittest
+
+The product service and PayPal are replaced by stand-ins; the database is a
+throwaway SQLite file.
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+_workdir = tempfile.mkdtemp(prefix="payment-test-")
+os.environ["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(_workdir, "payment.sqlite3")
+
+import app as service  # noqa: E402
+
+ORDERS = {1: {"id": 1, "totalPrice": 10.0}, 2: {"id": 2, "totalPrice": 25.5}}
+
+
+def fetch_orders(order_ids):
+    return [ORDERS.get(order_id) for order_id in order_ids]
+
+
+class ProcessPaymentTest(unittest.TestCase):
+    def setUp(self):
+        with service.app.app_context():
+            service.Payment.query.delete()
+            service.db.session.commit()
+        self.client = service.app.test_client()
+        self.paypal_calls = []
+        patches = [
+            mock.patch.object(service, "fetch_orders", fetch_orders),
+            mock.patch.object(service, "process_paypal_payment", self.paypal),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def paypal(self, total):
+        self.paypal_calls.append(total)
+        if total == ORDERS[2]["totalPrice"] and getattr(self, "paypal_fails", False):
+            raise Exception("Error creating payment")
+        return {"paymentID": f"PAY-{len(self.paypal_calls)}",
+                "links": [{"rel": "approval_url", "href": f"https://paypal.test/{len(self.paypal_calls)}"}]}
+
+    def payments(self):
+        with service.app.app_context():
+            return sorted((p.order_id, p.amount, p.status) for p in service.Payment.query.all())
+
+    def post(self, body):
+        response = self.client.post("/graphql", json=body)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_payment_is_kept_when_a_later_mutation_fails(self):
+        result = self.post({"query": "mutation { a: processPayment(orderId: 1) b: processPayment(orderId: 999) }"})
+
+        self.assertEqual(result["errors"][0]["message"], "Order not found")
+        self.assertEqual(self.paypal_calls, [10.0])
+        self.assertEqual(self.payments(), [(1, 10.0, "Pending")])
+
+    def test_batch_keeps_the_payments_that_went_through(self):
+        result = self.client.post("/graphql", json=[
+            {"query": "mutation { processPayment(orderId: 1) }"},
+            {"query": "mutation { processPayment(orderId: 999) }"},
+        ]).get_json()
+
+        self.assertEqual(result[0]["data"], {"processPayment": "https://paypal.test/1"})
+        self.assertEqual(result[1]["errors"][0]["message"], "Order not found")
+        self.assertEqual(self.payments(), [(1, 10.0, "Pending")])
+
+    def test_every_paypal_call_has_a_row(self):
+        self.post({"query": "mutation { a: processPayment(orderId: 1) b: processPayment(orderId: 2) }"})
+
+        self.assertEqual(len(self.paypal_calls), 2)
+        self.assertEqual(self.payments(), [(1, 10.0, "Pending"), (2, 25.5, "Pending")])
+
+    def test_failed_paypal_call_is_recorded(self):
+        self.paypal_fails = True
+        result = self.post({"query": "mutation { a: processPayment(orderId: 1) b: processPayment(orderId: 2) }"})
+
+        self.assertEqual(result["errors"][0]["message"], "Error creating payment")
+        self.assertEqual(self.payments(), [(1, 10.0, "Pending"), (2, 25.5, "Failed")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,41 @@
-from flask import Flask, current_app, request, g, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import asyncio
+from datetime import datetime, timezone
+from flask import Flask, Response, current_app, request, g, jsonify
 from strawberry.flask.views import GraphQLView
 import strawberry
 import jwt
+from sqlalchemy import create_engine, select
+from strawberry.http import process_result
+from strawberry.types import Info
+from strawberry.types.graphql import OperationType
 from config import Config
+from models import db, Product, Comment, Rating, Order
+from ingest import ingest, parse_products
+from loaders import WITH_CHILDREN, create_loaders
+from routing import STICKY_COOKIE, MutationsOnPrimary, ReplicaRouter, RoutingSession, is_sticky, sticky_until
+from export import FORMATS, TABLES, ChunkWriter, ExportError, export_query, parse_since
+from schema import ProductType, CommentType, RatingType, OrderType, ProductInput, AddProductsResult, product_type, comment_type, rating_type, order_type
+from common.batch import BatchError, allowed_operation_types, execute_operations, parse_batch, parsing_body, rolled_back
+from common.extensions import MetricsExtension, TracingExtension
+from common.metrics import MetricsMiddleware, metrics_view
+from common.permissions import permission_mask, require_permissions, token_mask
+from common.queries import trace_queries
+from common.tracing import TracingMiddleware, configure_tracing
 from typing import List, Optional
 from flask_migrate import Migrate
-from functools import wraps
 from flask_cors import CORS
 
 app = Flask(__name__)
 app.config.from_object(Config)
-db = SQLAlchemy(app)
+db.init_app(app)
 migrate = Migrate(app, db)
 CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*"}})
+RoutingSession.router = ReplicaRouter.from_config(lambda uri: create_engine(uri, pool_pre_ping=True))
+
+def write_session(context):
+    """The request's session, for mutations; notes that the request may have written."""
+    context['writes'] = True
+    return context['session']
 
 @app.before_request
 def before_request():
@@ -40,195 +62,203 @@ def before_request():
     except Exception as e:
         return "401 Unauthorized\n{}\n\n".format(e), 401
 
-       
-def require_permissions(allowed_permissions):
-    def decorator(fn):
-        @wraps(fn)
-        def wrapper(*args, **kwargs):
-            user = g.get('user') 
-            print("User in require_permissions:", user)  
-            if not user or not set(user.get('permissions', [])).intersection(allowed_permissions):
-                print("Unauthorized access")  
-                raise Exception("Unauthorized access")
-            return fn(*args, **kwargs)
-        return wrapper
-    return decorator
-
-
-
-class Product(db.Model):
-    __tablename__ = 'products'
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100))
-    description = db.Column(db.String(200))
-    price = db.Column(db.Float)
-    comments = db.relationship('Comment', backref='product', lazy=True, cascade="all, delete-orphan")
-    ratings = db.relationship('Rating', backref='product', lazy=True, cascade="all, delete-orphan")
-
-class Comment(db.Model):
-    __tablename__ = 'comments'
-    id = db.Column(db.Integer, primary_key=True)
-    text = db.Column(db.String(300))
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
-
-class Rating(db.Model):
-    __tablename__ = 'ratings'
-    id = db.Column(db.Integer, primary_key=True)
-    score = db.Column(db.Float)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
-
-class Order(db.Model):
-    __tablename__ = 'orders'
-    id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete="SET NULL"), nullable=True)
-    quantity = db.Column(db.Integer)
-    total_price = db.Column(db.Float)
-
-@strawberry.type
-class CommentType:
-    id: int
-    text: str
-    product_id: int
-
-@strawberry.type
-class RatingType:
-    id: int
-    score: float
-    product_id: int
+@app.before_request
+def read_your_writes():
+    # This client wrote a moment ago; the replicas may not have it yet
+    if RoutingSession.router is not None and is_sticky(request.cookies.get(STICKY_COOKIE)):
+        db.session.info['read_primary'] = True
 
-@strawberry.type
-class OrderType:
-    id: int
-    quantity: int
-    total_price: float
-    product_id: int
+@app.after_request
+def remember_writes(response):
+    if RoutingSession.router is not None and db.session.info.get('wrote'):
+        response.set_cookie(STICKY_COOKIE, sticky_until(), max_age=Config.READ_YOUR_WRITES_SECONDS,
+                            httponly=True, samesite='Lax')
+    return response
 
-@strawberry.type
-class ProductType:
-    id: int
-    name: str
-    description: str
-    price: float
-    comments: List[CommentType]
-    ratings: List[RatingType]
 
 @strawberry.type
 class Query:
     @strawberry.field
-    def all_products(self) -> List[ProductType]:
-        with app.app_context():
-            products = Product.query.all()
-            return [
-                ProductType(
-                    id=product.id,
-                    name=product.name,
-                    description=product.description,
-                    price=product.price,
-                    comments=[CommentType(id=comment.id, text=comment.text, product_id=comment.product_id) for comment in product.comments],
-                    ratings=[RatingType(id=rating.id, score=rating.score, product_id=rating.product_id) for rating in product.ratings]
-                ) for product in products
-            ]
+    def all_products(self, info: Info) -> List[ProductType]:
+        products = info.context['session'].scalars(select(Product).options(*WITH_CHILDREN)).all()
+        return [product_type(product) for product in products]
 
     @strawberry.field
-    def order(self, id: int) -> Optional[OrderType]:
-        with app.app_context():
-            order = Order.query.get(id)
-            if order:
-                return OrderType(
-                    id=order.id,
-                    quantity=order.quantity,
-                    total_price=order.total_price,
-                    product_id=order.product_id
-                )
-            return None
+    async def order(self, info: Info, id: int) -> Optional[OrderType]:
+        return await info.context['loaders']['order'].load(id)
     
     @strawberry.field
-    def product(self, id: int) -> Optional[ProductType]:
-        with app.app_context():
-            product = Product.query.get(id)
-            if product:
-                return ProductType(
-                    id=product.id,
-                    name=product.name,
-                    description=product.description,
-                    price=product.price,
-                    comments=[CommentType(id=comment.id, text=comment.text, product_id=comment.product_id) for comment in product.comments],
-                    ratings=[RatingType(id=rating.id, score=rating.score, product_id=rating.product_id) for rating in product.ratings]
-                )
-            return None
+    async def product(self, info: Info, id: int) -> Optional[ProductType]:
+        return await info.context['loaders']['product'].load(id)
 
 @strawberry.type
 class Mutation:
+    # Mutations only flush (to get ids); CustomGraphQLView commits the whole
+    # document once, so several mutations in one request are atomic
+
+    @strawberry.mutation
+    @require_permissions(['admin'])
+    def add_product(self, info: Info, name: str, description: str, price: float) -> ProductType:
+        session = write_session(info.context)
+        new_product = Product(name=name, description=description, price=price)
+        session.add(new_product)
+        session.flush()
+        return ProductType(
+            id=new_product.id,
+            name=new_product.name,
+            description=new_product.description,
+            price=new_product.price,
+            comments=[],
+            ratings=[]
+        )
+
     @strawberry.mutation
     @require_permissions(['admin'])
-    def add_product(self, name: str, description: str, price: float) -> ProductType:
-        with app.app_context():
-            new_product = Product(name=name, description=description, price=price)
-            db.session.add(new_product)
-            db.session.commit()
-            return ProductType(
-                id=new_product.id,
-                name=new_product.name,
-                description=new_product.description,
-                price=new_product.price,
-                comments=[],
-                ratings=[]
-            )
+    def add_products(self, info: Info, input: List[ProductInput]) -> AddProductsResult:
+        ids, comments, ratings = ingest(write_session(info.context).connection(), parse_products(input))
+        return AddProductsResult(ids=ids, comments=comments, ratings=ratings)
 
     @strawberry.mutation
     @require_permissions(['admin'])
-    def remove_product(self, id: int) -> bool:
-        with app.app_context():
-            product = Product.query.get(id)
-            if product:
-                db.session.delete(product)
-                db.session.commit()
-                return True
-            return False
+    def remove_product(self, info: Info, id: int) -> bool:
+        session = write_session(info.context)
+        # Children are loaded so the delete-orphan cascade can see them
+        product = session.get(Product, id, options=WITH_CHILDREN)
+        if product:
+            session.delete(product)
+            session.flush()
+            return True
+        return False
 
     @strawberry.mutation
-    def add_comment(self, product_id: int, text: str) -> CommentType:
-        with app.app_context():
-            new_comment = Comment(product_id=product_id, text=text)
-            db.session.add(new_comment)
-            db.session.commit()
-            return CommentType(id=new_comment.id, text=new_comment.text, product_id=new_comment.product_id)
+    def add_comment(self, info: Info, product_id: int, text: str) -> CommentType:
+        session = write_session(info.context)
+        new_comment = Comment(product_id=product_id, text=text)
+        session.add(new_comment)
+        session.flush()
+        return comment_type(new_comment)
 
     @strawberry.mutation
-    def add_rating(self, product_id: int, score: float) -> RatingType:
-        with app.app_context():
-            new_rating = Rating(product_id=product_id, score=score)
-            db.session.add(new_rating)
-            db.session.commit()
-            return RatingType(id=new_rating.id, score=new_rating.score, product_id=new_rating.product_id)
+    def add_rating(self, info: Info, product_id: int, score: float) -> RatingType:
+        session = write_session(info.context)
+        new_rating = Rating(product_id=product_id, score=score)
+        session.add(new_rating)
+        session.flush()
+        return rating_type(new_rating)
 
     @strawberry.mutation
-    def add_order(self, product_id: int, quantity: int, total_price: float) -> OrderType:
-        with app.app_context():
-            product = Product.query.get(product_id)
-            if not product:
-                raise Exception("Product not found")
-            
-            total_price = product.price * quantity
-            
-            new_order = Order(product_id=product_id, quantity=quantity, total_price=total_price)
-            db.session.add(new_order)
-            db.session.commit()
-            
-            return OrderType(
-                id=new_order.id,
-                quantity=new_order.quantity,
-                total_price=new_order.total_price,
-                product_id=new_order.product_id
-            )
+    def add_order(self, info: Info, product_id: int, quantity: int, total_price: float) -> OrderType:
+        session = write_session(info.context)
+        product = session.get(Product, product_id)
+        if not product:
+            raise Exception("Product not found")
+        
+        total_price = product.price * quantity
+        
+        new_order = Order(product_id=product_id, quantity=quantity, total_price=total_price)
+        session.add(new_order)
+        session.flush()
+        
+        return order_type(new_order)
 
 class CustomGraphQLView(GraphQLView):
+    """Runs a request's operations with one context, one transaction and one set of DataLoaders.
+
+    A POST body may be a JSON array of operations instead of a single one;
+    they run concurrently, so their product/order lookups are batched
+    together, and an array of results comes back in the same order. If
+    one fails after another wrote, the batch is rolled back and every
+    operation in it reports an error.
+    """
+
     def get_context(self, request, response=None) -> dict:
         context = super().get_context(request, response)
         context['token'] = g.get('user') 
+        # The request's own session (Flask-SQLAlchemy scopes it to the app
+        # context Flask pushed for this request); removed at teardown
+        context['session'] = db.session
+        context['writes'] = False
+        context['loaders'] = create_loaders(db.session)
         return context
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+    def dispatch_request(self):
+        operations = request.get_json(silent=True) if request.method == 'POST' else None
+        if not isinstance(operations, list):
+            return super().dispatch_request()
+        try:
+            batch = parse_batch(operations, Config.GRAPHQL_MAX_BATCH)
+        except BatchError as e:
+            return jsonify({"error": str(e)}), 400
+
+        context = self.get_context(request, response=self.get_sub_response(request))
+        results = self.execute_all(batch, context, self.get_root_value(request), OperationType.from_http("POST"), batched=True)
+        return jsonify([process_result(result) for result in results])
+
+    def execute_operation(self, request, context, root_value):
+        request_adapter = self.request_adapter_class(request)
+        with parsing_body():
+            request_data = self.parse_http_body(request_adapter)
+        allowed = allowed_operation_types(self, request_adapter.method)
+        return self.execute_all([request_data], context, root_value, allowed)[0]
+
+    def execute_all(self, operations, context, root_value, allowed_operation_types=None, batched=False):
+        # One transaction per HTTP request, batch or not: commit once if
+        # every operation succeeded, otherwise roll back everything they did
+        session = context['session']
+        try:
+            # A short-lived loop per request, for the DataLoaders
+            results = asyncio.run(execute_operations(
+                self.schema, operations, context, root_value, allowed_operation_types, batched))
+        except Exception:
+            session.rollback()
+            raise
+        if any(result.errors for result in results):
+            session.rollback()
+            if batched and context['writes']:
+                return rolled_back(results)
+        else:
+            session.commit()
+        return results
+
+# A full dump of the catalog is for sync jobs, not anonymous callers
+EXPORT_PERMISSIONS = permission_mask(['view_products', 'manage_products'])
+
+def export_view(table):
+    """GET /export/<table>?format=ndjson|csv&since=<ISO 8601>, streamed as it is read."""
+    user = g.get('user')
+    if not user or not token_mask(user) & EXPORT_PERMISSIONS:
+        return jsonify({"error": "Unauthorized access"}), 403
+    fmt = request.args.get('format', 'ndjson')
+    try:
+        statement, names = export_query(table, fmt, parse_since(request.args.get('since')))
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 400
+    # Pass this back as `since` next time; rows changed during the export are sent again then
+    started_at = datetime.now(timezone.utc)
+    # Its own connection, held only while the body is being sent
+    engine = db.engine
+
+    def generate():
+        writer = ChunkWriter(fmt, names)
+        with engine.connect() as conn:
+            for row in conn.execute(statement):
+                chunk = writer.write(row)
+                if chunk:
+                    yield chunk
+        chunk = writer.flush()
+        if chunk:
+            yield chunk
+
+    return Response(generate(), mimetype=FORMATS[fmt], headers={'X-Export-Started-At': started_at.isoformat()})
+
+tracing_enabled = configure_tracing("product-service")
+if tracing_enabled:
+    trace_queries()
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    extensions=[MetricsExtension, MutationsOnPrimary] + ([TracingExtension] if tracing_enabled else [])
+)
 
 # app context fucking shiet
 with app.app_context():
@@ -241,6 +271,11 @@ app.add_url_rule(
     '/graphql',
     view_func=CustomGraphQLView.as_view('graphql_view', schema=schema)
 )
+app.add_url_rule('/metrics', 'metrics', metrics_view)
+app.add_url_rule('/export/<table>', 'export', export_view)
+routes = ['/graphql', '/metrics'] + [f'/export/{table}' for table in TABLES]
+app.wsgi_app = MetricsMiddleware(app.wsgi_app, paths=routes)
+app.wsgi_app = TracingMiddleware(app.wsgi_app, paths=routes)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,403 @@
+"""ASGI entry point for the product service.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+Serves the same GraphQL schema as app.py, but resolvers are coroutines on an
+async SQLAlchemy engine, so a single process keeps many requests in flight
+while they wait on the database instead of being capped at the WSGI thread
+count. Each request gets one AsyncSession through the Strawberry context;
+resolvers only flush, and the session is committed (or rolled back if the
+operation reported errors) once after execution. Query resolvers go through
+``request_session`` instead, which also hands the connection back early.
+Like app.py, it accepts a JSON array of operations in one POST, and
+reads from SQLALCHEMY_REPLICA_URIS when set (see routing.py).
+"""
+import asyncio
+import json
+import jwt
+from datetime import datetime, timezone
+import strawberry
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from strawberry import UNSET
+from strawberry.asgi import GraphQL
+from strawberry.dataloader import DataLoader
+from strawberry.http import process_result
+from strawberry.types import Info
+from strawberry.types.graphql import OperationType
+
+from common.batch import BatchError, allowed_operation_types, execute_operations, parse_batch, parsing_body, rolled_back
+from common.extensions import MetricsExtension, TracingExtension
+from common.metrics import AsgiMetricsMiddleware, metrics_endpoint
+from common.permissions import permission_mask, require_permissions, token_mask
+from common.queries import trace_queries
+from common.tracing import AsgiTracingMiddleware, configure_tracing
+from config import Config
+from export import FORMATS, TABLES, ChunkWriter, ExportError, export_query, parse_since
+from ingest import ingest, parse_products
+from loaders import WITH_CHILDREN, in_order, orders_by_id, products_by_id, with_archived_orders
+from models import db, Product, Comment, Rating, Order
+from routing import STICKY_COOKIE, AsyncRoutingSession, MutationsOnPrimary, ReplicaRouter, is_sticky, read_primary_on_miss, sticky_until
+from schema import ProductType, CommentType, RatingType, OrderType, ProductInput, AddProductsResult, product_type, comment_type, rating_type, order_type
+
+# Async driver used when ASYNC_DATABASE_URI isn't set and the sync URI is reused
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_uri(uri):
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def async_database_uri():
+    return Config.ASYNC_DATABASE_URI or async_uri(Config.SQLALCHEMY_DATABASE_URI)
+
+
+def async_engine(uri):
+    return create_async_engine(
+        uri,
+        pool_pre_ping=True,
+        pool_size=Config.ASYNC_POOL_SIZE,
+        max_overflow=Config.ASYNC_MAX_OVERFLOW,
+    )
+
+
+engine = async_engine(async_database_uri())
+replica_engines = []
+
+
+def replica_engine(uri):
+    replica = async_engine(async_uri(uri))
+    replica_engines.append(replica)
+    # The session routes on its sync side, which binds to sync_engine
+    return replica.sync_engine
+
+
+AsyncRoutingSession.router = ReplicaRouter.from_config(replica_engine)
+# Objects stay usable after commit; the GraphQL types are built before it anyway
+Session = async_sessionmaker(engine, expire_on_commit=False, sync_session_class=AsyncRoutingSession)
+
+
+@asynccontextmanager
+async def request_session(context):
+    """The request's session, for reads.
+
+    Root query fields (and the operations of a batch) resolve
+    concurrently, so they take turns. Reads don't need the transaction
+    afterwards, so it is ended right away: the connection goes back to the
+    pool instead of being held while the rest of the response is built,
+    which under load starves the pool. Once a mutation in the same batch
+    has written, the transaction is left for the request to finish.
+    """
+    async with context['session_lock']:
+        session = context['session']
+        try:
+            yield session
+        finally:
+            if not context['writes']:
+                await session.commit()
+
+
+@asynccontextmanager
+async def write_session(context):
+    """The request's session, for mutations; committed by SessionGraphQL."""
+    async with context['session_lock']:
+        context['writes'] = True
+        yield context['session']
+
+
+def create_loaders(context):
+    """Request-scoped DataLoaders over the AsyncSession (see loaders.py)."""
+
+    async def load(ids, query, convert):
+        async with request_session(context) as session:
+            rows = in_order(ids, await session.scalars(query(ids)), convert)
+            # A replica may not have caught up yet; see loaders.py
+            if None in rows and read_primary_on_miss(session):
+                rows = in_order(ids, await session.scalars(query(ids)), convert)
+            return rows
+
+    async def load_products(ids):
+        return await load(ids, products_by_id, product_type)
+
+    async def load_orders(ids):
+        orders = await load(ids, orders_by_id, order_type)
+        if None in orders:
+            # Archive files are read from disk; keep that off the event loop
+            orders = await asyncio.to_thread(with_archived_orders, ids, orders)
+        return orders
+
+    return {
+        'product': DataLoader(load_fn=load_products),
+        'order': DataLoader(load_fn=load_orders),
+    }
+
+
+@strawberry.type
+class Query:
+    @strawberry.field
+    async def all_products(self, info: Info) -> List[ProductType]:
+        async with request_session(info.context) as session:
+            products = await session.scalars(select(Product).options(*WITH_CHILDREN))
+            return [product_type(product) for product in products]
+
+    @strawberry.field
+    async def order(self, info: Info, id: int) -> Optional[OrderType]:
+        return await info.context['loaders']['order'].load(id)
+
+    @strawberry.field
+    async def product(self, info: Info, id: int) -> Optional[ProductType]:
+        return await info.context['loaders']['product'].load(id)
+
+@strawberry.type
+class Mutation:
+    @strawberry.mutation
+    @require_permissions(['admin'])
+    async def add_product(self, info: Info, name: str, description: str, price: float) -> ProductType:
+        async with write_session(info.context) as session:
+            new_product = Product(name=name, description=description, price=price)
+            session.add(new_product)
+            await session.flush()
+            return ProductType(
+                id=new_product.id,
+                name=new_product.name,
+                description=new_product.description,
+                price=new_product.price,
+                comments=[],
+                ratings=[]
+            )
+
+    @strawberry.mutation
+    @require_permissions(['admin'])
+    async def add_products(self, info: Info, input: List[ProductInput]) -> AddProductsResult:
+        items = parse_products(input)
+        async with write_session(info.context) as session:
+            ids, comments, ratings = await session.run_sync(lambda sync: ingest(sync.connection(), items))
+        return AddProductsResult(ids=ids, comments=comments, ratings=ratings)
+
+    @strawberry.mutation
+    @require_permissions(['admin'])
+    async def remove_product(self, info: Info, id: int) -> bool:
+        async with write_session(info.context) as session:
+            # Children are loaded so the delete-orphan cascade can see them
+            product = await session.get(Product, id, options=WITH_CHILDREN)
+            if product:
+                await session.delete(product)
+                await session.flush()
+                return True
+            return False
+
+    @strawberry.mutation
+    async def add_comment(self, info: Info, product_id: int, text: str) -> CommentType:
+        async with write_session(info.context) as session:
+            new_comment = Comment(product_id=product_id, text=text)
+            session.add(new_comment)
+            await session.flush()
+            return comment_type(new_comment)
+
+    @strawberry.mutation
+    async def add_rating(self, info: Info, product_id: int, score: float) -> RatingType:
+        async with write_session(info.context) as session:
+            new_rating = Rating(product_id=product_id, score=score)
+            session.add(new_rating)
+            await session.flush()
+            return rating_type(new_rating)
+
+    @strawberry.mutation
+    async def add_order(self, info: Info, product_id: int, quantity: int, total_price: float) -> OrderType:
+        async with write_session(info.context) as session:
+            product = await session.get(Product, product_id)
+            if not product:
+                raise Exception("Product not found")
+
+            total_price = product.price * quantity
+
+            new_order = Order(product_id=product_id, quantity=quantity, total_price=total_price)
+            session.add(new_order)
+            await session.flush()
+            return order_type(new_order)
+
+
+class SessionGraphQL(GraphQL):
+    """One AsyncSession per request, committed once after the operation ran.
+
+    A POST body may be a JSON array of operations; they share the context,
+    the session and the DataLoaders, and are committed or rolled back
+    together. In a rolled-back batch that wrote, every operation reports
+    an error.
+    """
+
+    async def get_context(self, request, response):
+        session = Session()
+        # This client wrote a moment ago; the replicas may not have it yet
+        if AsyncRoutingSession.router is not None and is_sticky(request.cookies.get(STICKY_COOKIE)):
+            session.info['read_primary'] = True
+        context = {
+            'request': request,
+            'response': response,
+            'session': session,
+            'session_lock': asyncio.Lock(),
+            'writes': False,
+            'token': request.scope.get('user'),
+        }
+        context['loaders'] = create_loaders(context)
+        return context
+
+    async def run(self, request, context=UNSET, root_value=UNSET):
+        if isinstance(request, Request) and request.method == "POST":
+            try:
+                # Starlette keeps the body, so the single-operation path can read it again
+                operations = json.loads(await request.body())
+            except ValueError:
+                operations = None
+            if isinstance(operations, list):
+                return await self.run_batch(request, operations)
+        return await super().run(request, context, root_value)
+
+    async def run_batch(self, request, operations):
+        try:
+            batch = parse_batch(operations, Config.GRAPHQL_MAX_BATCH)
+        except BatchError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        response = await self.get_sub_response(request)
+        context = await self.get_context(request, response)
+        results = await self.execute_all(batch, context, await self.get_root_value(request),
+                                         OperationType.from_http("POST"), batched=True)
+        return self.create_response([process_result(result) for result in results], response)
+
+    async def execute_operation(self, request, context, root_value):
+        request_adapter = self.request_adapter_class(request)
+        with parsing_body():
+            request_data = await self.parse_http_body(request_adapter)
+        allowed = allowed_operation_types(self, request_adapter.method)
+        return (await self.execute_all([request_data], context, root_value, allowed))[0]
+
+    async def execute_all(self, operations, context, root_value, allowed_operation_types=None, batched=False):
+        session = context['session']
+        try:
+            results = await execute_operations(
+                self.schema, operations, context, root_value, allowed_operation_types, batched)
+            if any(result.errors for result in results):
+                await session.rollback()
+                if batched and context['writes']:
+                    results = rolled_back(results)
+            else:
+                await session.commit()
+            if AsyncRoutingSession.router is not None and session.info.get('wrote'):
+                context['response'].set_cookie(STICKY_COOKIE, sticky_until(), max_age=Config.READ_YOUR_WRITES_SECONDS,
+                                               httponly=True, samesite='lax')
+            return results
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+
+class AuthMiddleware:
+    """Decodes the bearer token into ``scope["user"]``, like app.py's before_request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        scope["user"] = None
+        headers = dict(scope["headers"])
+        token = headers.get(b"authorization")
+        response = None
+        if token:
+            try:
+                scope["user"] = jwt.decode(token.decode("latin-1").split(" ")[1], Config.SECRET_KEY, algorithms=["HS256"])
+            except jwt.ExpiredSignatureError:
+                response = JSONResponse({"error": "Token expired"}, status_code=401)
+            except jwt.InvalidTokenError:
+                response = JSONResponse({"error": "Invalid token"}, status_code=401)
+            except Exception as e:
+                response = PlainTextResponse("401 Unauthorized\n{}\n\n".format(e), status_code=401)
+        if response is not None:
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+# A full dump of the catalog is for sync jobs, not anonymous callers
+EXPORT_PERMISSIONS = permission_mask(['view_products', 'manage_products'])
+
+
+async def export_endpoint(request):
+    """Same as app.py's export_view; ``stream()`` reads through a server-side cursor."""
+    user = request.scope.get('user')
+    if not user or not token_mask(user) & EXPORT_PERMISSIONS:
+        return JSONResponse({"error": "Unauthorized access"}, status_code=403)
+    fmt = request.query_params.get('format', 'ndjson')
+    try:
+        statement, names = export_query(request.path_params['table'], fmt,
+                                        parse_since(request.query_params.get('since')))
+    except ExportError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    started_at = datetime.now(timezone.utc)
+
+    async def generate():
+        writer = ChunkWriter(fmt, names)
+        async with engine.connect() as conn:
+            result = await conn.stream(statement)
+            # A batch of yield_per rows per await, rather than a round trip to the driver per row
+            async for rows in result.partitions():
+                for row in rows:
+                    chunk = writer.write(row)
+                    if chunk:
+                        yield chunk
+        chunk = writer.flush()
+        if chunk:
+            yield chunk
+
+    return StreamingResponse(generate(), media_type=FORMATS[fmt],
+                             headers={'X-Export-Started-At': started_at.isoformat()})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(db.metadata.create_all)
+    except Exception as e:
+        print(f"Error creating tables: {e}")
+    yield
+    await engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
+
+
+tracing_enabled = configure_tracing("product-service")
+if tracing_enabled:
+    trace_queries()
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    extensions=[MetricsExtension, MutationsOnPrimary] + ([TracingExtension] if tracing_enabled else [])
+)
+
+app = Starlette(lifespan=lifespan)
+app.add_route("/graphql", SessionGraphQL(schema))
+app.add_route("/metrics", metrics_endpoint)
+app.add_route("/export/{table}", export_endpoint)
+app.add_middleware(AuthMiddleware)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+routes = ["/graphql", "/metrics"] + [f"/export/{table}" for table in TABLES]
+app.add_middleware(AsgiMetricsMiddleware, paths=routes)
+app.add_middleware(AsgiTracingMiddleware, paths=routes)
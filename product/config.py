@@ -1,4 +1,26 @@
+import os
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = ''
+    SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI', '')
+    # asgi.py only; derived from SQLALCHEMY_DATABASE_URI (asyncpg/aiosqlite) when empty
+    ASYNC_DATABASE_URI = os.getenv('ASYNC_DATABASE_URI', '')
+    ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', '10'))
+    ASYNC_MAX_OVERFLOW = int(os.getenv('ASYNC_MAX_OVERFLOW', '10'))
+    # Comma-separated read replica URIs (see routing.py); asgi.py swaps in the async driver
+    SQLALCHEMY_REPLICA_URIS = [uri.strip() for uri in os.getenv('SQLALCHEMY_REPLICA_URIS', '').split(',') if uri.strip()]
+    # A replica further behind than this is skipped; lag is checked at most this often
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+    REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '1'))
+    # Overrides the per-dialect lag query; must return the lag in seconds
+    REPLICA_LAG_QUERY = os.getenv('REPLICA_LAG_QUERY', '')
+    # How long a client reads from the primary after one of its requests wrote
+    READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '10'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SECRET_KEY = ''
\ No newline at end of file
+    SECRET_KEY = os.getenv('SECRET_KEY', '')
+    # Most operations one POST to /graphql may carry as a JSON array
+    GRAPHQL_MAX_BATCH = int(os.getenv('GRAPHQL_MAX_BATCH', '100'))
+    # addProducts and ingest.py: products per INSERT, and most products one addProducts takes
+    INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '1000'))
+    INGEST_MAX_ITEMS = int(os.getenv('INGEST_MAX_ITEMS', '10000'))
+    # Where common/archive.py keeps old orders; order(id) falls back to it when set
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '')
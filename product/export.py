@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from models import Product, Comment, Rating
+
+# Streaming catalog export, shared by app.py and asgi.py. Rows are read
+# through a server-side cursor (yield_per) as plain column tuples, never as
+# ORM objects, and written out in chunks as they arrive, so memory stays
+# flat however big the table is. One table per request; `since` selects
+# the rows created or changed at or after that time for incremental sync.
+
+# Rows fetched per round trip on the server-side cursor
+EXPORT_BATCH_ROWS = 5000
+# Bytes buffered before a chunk is handed to the server
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# table -> (columns in output order, column `since` compares against)
+TABLES = {
+    'products': (
+        (Product.id, Product.name, Product.description, Product.price, Product.updated_at),
+        Product.updated_at,
+    ),
+    'comments': ((Comment.id, Comment.product_id, Comment.text, Comment.created_at), Comment.created_at),
+    'ratings': ((Rating.id, Rating.product_id, Rating.score, Rating.created_at), Rating.created_at),
+}
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class ExportError(ValueError):
+    """A bad table, format or ``since``; the message is safe to return as a 400."""
+
+
+def parse_since(value):
+    """ISO 8601 timestamp as an aware UTC datetime; naive ones are taken as UTC."""
+    if not value:
+        return None
+    try:
+        since = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ExportError(f"since is not an ISO 8601 timestamp: {value}")
+    if since.tzinfo is None:
+        return since.replace(tzinfo=timezone.utc)
+    return since.astimezone(timezone.utc)
+
+
+def export_query(table, fmt, since=None):
+    """The statement for one export and the names of its columns."""
+    if table not in TABLES:
+        raise ExportError(f"Unknown table {table}; expected one of {', '.join(TABLES)}")
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt}; expected one of {', '.join(FORMATS)}")
+    columns, changed_at = TABLES[table]
+    statement = select(*columns).order_by(columns[0])
+    if since is not None:
+        statement = statement.where(changed_at >= since)
+    return statement.execution_options(yield_per=EXPORT_BATCH_ROWS), [column.key for column in columns]
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+
+class ChunkWriter:
+    """Encodes rows as NDJSON or CSV lines and hands them out in chunks."""
+
+    def __init__(self, fmt, names):
+        self.fmt = fmt
+        self.names = names
+        self.buffer = io.StringIO()
+        if fmt == 'csv':
+            self.csv = csv.writer(self.buffer)
+            self.csv.writerow(names)
+
+    def write(self, row):
+        """Add a row; returns a chunk once enough is buffered, else None."""
+        values = [_value(value) for value in row]
+        if self.fmt == 'csv':
+            self.csv.writerow(values)
+        else:
+            self.buffer.write(json.dumps(dict(zip(self.names, values)), separators=(',', ':')))
+            self.buffer.write('\n')
+        if self.buffer.tell() >= EXPORT_CHUNK_BYTES:
+            return self.flush()
+        return None
+
+    def flush(self):
+        chunk = self.buffer.getvalue().encode('utf-8')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return chunk
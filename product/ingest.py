@@ -0,0 +1,180 @@
+"""Bulk catalog ingestion, used by the addProducts mutation and as a CLI.
+
+    python ingest.py catalog.jsonl --batch-size 1000
+
+Each line of the file is one product:
+
+    {"sku": "A-1", "name": "Mug", "description": "Blue", "price": 9.5,
+     "comments": ["Nice"], "ratings": [4.0]}
+
+Products are upserted by ``sku``: a known SKU gets its name, description and
+price replaced, keeping its id. Comments and ratings are always appended,
+so loading the same file twice adds them twice. Every batch is one
+multi-row INSERT ... ON CONFLICT for the products, with RETURNING for their
+ids, plus one executemany each for comments and ratings; the CLI commits
+after every batch and reports rows/s.
+"""
+import argparse
+import json
+import sys
+import time
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from config import Config
+from models import Product, Comment, Rating, utcnow
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+UPSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def parse_item(item):
+    """Validate one product as decoded from JSON; raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("expected an object")
+    sku, name, description, price = (item.get(key) for key in ('sku', 'name', 'description', 'price'))
+    if not isinstance(sku, str) or not 0 < len(sku) <= Product.sku.type.length:
+        raise ValueError(f"sku must be a string of 1 to {Product.sku.type.length} characters")
+    if not isinstance(name, str) or len(name) > Product.name.type.length:
+        raise ValueError(f"name must be a string of at most {Product.name.type.length} characters")
+    if not isinstance(description, str) or len(description) > Product.description.type.length:
+        raise ValueError(f"description must be a string of at most {Product.description.type.length} characters")
+    if isinstance(price, bool) or not isinstance(price, (int, float)):
+        raise ValueError("price must be a number")
+    # Missing or null means none; anything else has to be a list
+    comments = [] if item.get('comments') is None else item['comments']
+    ratings = [] if item.get('ratings') is None else item['ratings']
+    if not isinstance(comments, list) or \
+            not all(isinstance(text, str) and len(text) <= Comment.text.type.length for text in comments):
+        raise ValueError(f"comments must be a list of strings of at most {Comment.text.type.length} characters")
+    if not isinstance(ratings, list) or \
+            not all(isinstance(score, (int, float)) and not isinstance(score, bool) for score in ratings):
+        raise ValueError("ratings must be a list of numbers")
+    return {'sku': sku, 'name': name, 'description': description, 'price': float(price),
+            'comments': comments, 'ratings': [float(score) for score in ratings]}
+
+
+def parse_products(products):
+    """addProducts input as items, or an error naming the bad entry."""
+    if len(products) > Config.INGEST_MAX_ITEMS:
+        raise Exception(f"addProducts takes at most {Config.INGEST_MAX_ITEMS} products")
+    items = []
+    for index, product in enumerate(products):
+        try:
+            items.append(parse_item(vars(product)))
+        except ValueError as e:
+            raise Exception(f"input[{index}]: {e}") from None
+    return items
+
+
+def upsert_batch(connection, items):
+    """Write one batch of parsed items; returns the product ids in input order."""
+    insert = UPSERTS.get(connection.dialect.name)
+    if insert is None:
+        raise RuntimeError(f"Bulk upsert is not supported on {connection.dialect.name}")
+
+    # A SKU may appear twice in one batch; ON CONFLICT can't touch a row
+    # twice in one statement, so the last occurrence wins
+    now = utcnow()
+    products = {item['sku']: {'sku': item['sku'], 'name': item['name'], 'description': item['description'],
+                              'price': item['price'], 'updated_at': now} for item in items}
+    statement = insert(Product).values(list(products.values()))
+    statement = statement.on_conflict_do_update(
+        index_elements=[Product.sku],
+        set_={
+            'name': statement.excluded.name,
+            'description': statement.excluded.description,
+            'price': statement.excluded.price,
+            # onupdate doesn't apply to ON CONFLICT
+            'updated_at': statement.excluded.updated_at,
+        },
+    ).returning(Product.sku, Product.id)
+    ids = dict(connection.execute(statement).all())
+
+    comments = [{'product_id': ids[item['sku']], 'text': text, 'created_at': now}
+                for item in items for text in item['comments']]
+    ratings = [{'product_id': ids[item['sku']], 'score': score, 'created_at': now}
+               for item in items for score in item['ratings']]
+    if comments:
+        connection.execute(Comment.__table__.insert(), comments)
+    if ratings:
+        connection.execute(Rating.__table__.insert(), ratings)
+    return [ids[item['sku']] for item in items], len(comments), len(ratings)
+
+
+def ingest(connection, items, batch_size=Config.INGEST_BATCH_SIZE):
+    """Upsert parsed items batch by batch on one connection, in its transaction."""
+    ids, comments, ratings = [], 0, 0
+    for batch in batches(items, batch_size):
+        batch_ids, batch_comments, batch_ratings = upsert_batch(connection, batch)
+        ids += batch_ids
+        comments += batch_comments
+        ratings += batch_ratings
+    return ids, comments, ratings
+
+
+def batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_jsonl(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield parse_item(json.loads(line))
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upsert products (with comments and ratings) from a JSONL file.")
+    parser.add_argument('path', help="JSONL file, or - for stdin")
+    parser.add_argument('--batch-size', type=int, default=Config.INGEST_BATCH_SIZE)
+    parser.add_argument('--database-uri', help="defaults to SQLALCHEMY_DATABASE_URI")
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import create_engine
+    from models import db
+
+    engine = create_engine(args.database_uri or Config.SQLALCHEMY_DATABASE_URI)
+    db.metadata.create_all(engine)
+    source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8')
+    totals = [0, 0, 0]
+    started = time.perf_counter()
+    try:
+        for batch in batches(read_jsonl(source), args.batch_size):
+            with engine.begin() as connection:
+                ids, comments, ratings = upsert_batch(connection, batch)
+            totals[0] += len(ids)
+            totals[1] += comments
+            totals[2] += ratings
+    except ValueError as e:
+        print(f"Stopped at {e}; {totals[0]} products were loaded before it", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    elapsed = time.perf_counter() - started
+    rows = sum(totals)
+    print(json.dumps({
+        'products': totals[0],
+        'comments': totals[1],
+        'ratings': totals[2],
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed) if elapsed else None,
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from strawberry.dataloader import DataLoader
+
+from common.archive import ArchiveReader
+from config import Config
+from models import Product, Order
+from routing import read_primary_on_miss
+from schema import product_type, order_type
+
+# Request-scoped DataLoaders: every product(id) / order(id) a request asks
+# for, across aliases and across the operations of a batch, is collected
+# and fetched with one IN query. Each request gets fresh loaders, so the
+# cache never outlives the request's transaction.
+
+# Relationships product_type reads; selectin loading adds one query per
+# relationship for the whole batch instead of one per product
+WITH_CHILDREN = (selectinload(Product.comments), selectinload(Product.ratings))
+
+
+def products_by_id(ids):
+    return select(Product).where(Product.id.in_(ids)).options(*WITH_CHILDREN)
+
+
+def orders_by_id(ids):
+    return select(Order).where(Order.id.in_(ids))
+
+
+def in_order(ids, rows, convert):
+    """Loader results line up with the keys; missing ids come back as None."""
+    found = {row.id: convert(row) for row in rows}
+    return [found.get(id) for id in ids]
+
+
+# Orders common/archive.py has moved out of the database, looked up by id when
+# the database doesn't have them
+order_archive = ArchiveReader(Config.ARCHIVE_DIR, 'orders') if Config.ARCHIVE_DIR else None
+
+
+def archived_order(row):
+    return Order(
+        id=int(row['id']),
+        product_id=int(row['product_id']) if row['product_id'] else None,
+        quantity=int(row['quantity']),
+        total_price=float(row['total_price']),
+    )
+
+
+def with_archived_orders(ids, orders):
+    """Fill in the orders the database didn't have from the archive."""
+    missing = [id for id, order in zip(ids, orders) if order is None]
+    if not missing or order_archive is None:
+        return orders
+    found = order_archive.find(missing)
+    return [order_type(archived_order(found[id])) if order is None and id in found else order
+            for id, order in zip(ids, orders)]
+
+
+def create_loaders(session):
+    """Loaders over a synchronous Session (app.py)."""
+
+    def load(ids, query, convert):
+        rows = in_order(ids, session.scalars(query(ids)), convert)
+        # A replica may not have caught up with rows written moments ago,
+        # e.g. the order payment looks up right after addOrder
+        if None in rows and read_primary_on_miss(session):
+            rows = in_order(ids, session.scalars(query(ids)), convert)
+        return rows
+
+    async def load_products(ids):
+        return load(ids, products_by_id, product_type)
+
+    async def load_orders(ids):
+        return with_archived_orders(ids, load(ids, orders_by_id, order_type))
+
+    return {
+        'product': DataLoader(load_fn=load_products),
+        'order': DataLoader(load_fn=load_orders),
+    }
@@ -1,31 +1,49 @@
-# from flask_sqlalchemy import SQLAlchemy
-
-# db = SQLAlchemy()
-
-# class Product(db.Model):
-#     __tablename__ = 'products'
-#     id = db.Column(db.Integer, primary_key=True)
-#     name = db.Column(db.String(100))
-#     description = db.Column(db.String(200))
-#     price = db.Column(db.Float)
-#     comments = db.relationship('Comment', backref='product', lazy=True)
-#     ratings = db.relationship('Rating', backref='product', lazy=True)
-
-# class Comment(db.Model):
-#     __tablename__ = 'comments'
-#     id = db.Column(db.Integer, primary_key=True)
-#     text = db.Column(db.String(300))
-#     product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
-
-# class Rating(db.Model):
-#     __tablename__ = 'ratings'
-#     id = db.Column(db.Integer, primary_key=True)
-#     score = db.Column(db.Float)
-#     product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
-
-# class Order(db.Model):
-#     __tablename__ = 'orders'
-#     id = db.Column(db.Integer, primary_key=True)
-#     product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
-#     quantity = db.Column(db.Integer)
-#     total_price = db.Column(db.Float)
+from datetime import datetime, timezone
+
+from flask_sqlalchemy import SQLAlchemy
+
+from routing import RoutingSession
+
+# Shared by the Flask app (app.py, via db.init_app) and the ASGI app
+# (asgi.py, which only uses the mapped classes and db.metadata). db.session
+# sends reads to the replicas once app.py gives RoutingSession a router.
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class Product(db.Model):
+    __tablename__ = 'products'
+    id = db.Column(db.Integer, primary_key=True)
+    # External identifier bulk ingestion upserts by (ingest.py)
+    sku = db.Column(db.String(64), unique=True, nullable=True)
+    name = db.Column(db.String(100))
+    description = db.Column(db.String(200))
+    price = db.Column(db.Float)
+    # Lets the export pick up what changed since the last sync
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow, index=True)
+    comments = db.relationship('Comment', backref='product', lazy=True, cascade="all, delete-orphan")
+    ratings = db.relationship('Rating', backref='product', lazy=True, cascade="all, delete-orphan")
+
+class Comment(db.Model):
+    __tablename__ = 'comments'
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.String(300))
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow, index=True)
+
+class Rating(db.Model):
+    __tablename__ = 'ratings'
+    id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow, index=True)
+
+class Order(db.Model):
+    __tablename__ = 'orders'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete="SET NULL"), nullable=True, index=True)
+    quantity = db.Column(db.Integer)
+    total_price = db.Column(db.Float)
+    # Partition key on Postgres (sql/partition_orders.sql); common/archive.py moves old months out
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow, index=True)
@@ -0,0 +1,216 @@
+"""Read replicas: queries go to a replica, everything else to the primary.
+
+``RoutingSession`` (app.py, through models.db) and ``AsyncRoutingSession``
+(the sync half of asgi.py's AsyncSession) pick the connection per
+statement in ``get_bind``:
+
+- writes (flushes, INSERT/UPDATE/DELETE, raw connections such as the one
+  addProducts ingests on, SELECT ... FOR UPDATE) go to the primary, and the
+  rest of the session reads from the primary too;
+- a session that was told to read from the primary does: mutations (see
+  ``MutationsOnPrimary``), and requests that carry the read-your-writes
+  cookie set after a write;
+- other SELECTs go to one replica, picked round-robin the first time the
+  session reads, so a request sees one consistent snapshot.
+
+Each replica's lag is checked at most every REPLICA_LAG_CHECK_SECONDS (on
+the request that finds the last check stale); one that is further behind
+than REPLICA_MAX_LAG_SECONDS, or that fails the check or a query, is
+skipped until a later check passes. With no usable replica, reads go to
+the primary.
+"""
+import hashlib
+import hmac
+import itertools
+import threading
+import time
+
+from flask_sqlalchemy.session import Session as FlaskSession
+from prometheus_client import Counter, Gauge
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.selectable import SelectBase
+from strawberry.extensions import SchemaExtension
+from strawberry.types.graphql import OperationType
+
+from config import Config
+
+DB_ROUTED_STATEMENTS = Counter(
+    "db_routed_statements_total", "Statements by the database they were sent to", ["target", "reason"])
+REPLICA_LAG_SECONDS = Gauge("db_replica_lag_seconds", "Replica lag as of its last check", ["replica"])
+
+# Set on responses to requests that wrote; until it runs out, that
+# client's requests read from the primary
+STICKY_COOKIE = 'read_primary_until'
+
+# Seconds a replica is behind, per dialect; a standby that has replayed
+# everything it received is 0 however long ago the last write was. NULL
+# (e.g. the URI points at a primary) counts as 0.
+LAG_QUERIES = {
+    'postgresql': (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    ),
+}
+
+
+class Replica:
+    """One replica's engine and whether it is fit to read from."""
+
+    def __init__(self, name, bind, max_lag, check_every, lag_query=None):
+        self.name = name
+        self.bind = bind
+        self.max_lag = max_lag
+        self.check_every = check_every
+        self.lag_query = lag_query or LAG_QUERIES.get(bind.dialect.name) or "SELECT 0"
+        self._usable = True
+        self._checked_at = None
+        self._lock = threading.Lock()
+        event.listen(bind, 'handle_error', self._on_error)
+
+    def usable(self):
+        now = time.monotonic()
+        # Whoever finds the result stale checks; the others go on with the
+        # last one rather than wait
+        if (self._checked_at is None or now - self._checked_at >= self.check_every) \
+                and self._lock.acquire(blocking=False):
+            try:
+                self._usable = self._check()
+                self._checked_at = time.monotonic()
+            finally:
+                self._lock.release()
+        return self._usable
+
+    def _check(self):
+        try:
+            with self.bind.connect() as conn:
+                lag = float(conn.execute(text(self.lag_query)).scalar() or 0)
+        except Exception as e:
+            print(f"Replica {self.name} failed its lag check: {e}")
+            return False
+        REPLICA_LAG_SECONDS.labels(self.name).set(lag)
+        if lag > self.max_lag:
+            print(f"Replica {self.name} is {lag:.1f}s behind; reading from the others")
+            return False
+        return True
+
+    def _on_error(self, exception_context):
+        if exception_context.is_disconnect or exception_context.connection is None:
+            # Down until the next check says otherwise
+            self._usable = False
+            self._checked_at = time.monotonic()
+
+
+class ReplicaRouter:
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self._turn = itertools.count()
+
+    @classmethod
+    def from_config(cls, create_engine, uris=None):
+        """A router over ``create_engine(uri)`` for each replica URI, or None without any."""
+        uris = Config.SQLALCHEMY_REPLICA_URIS if uris is None else uris
+        if not uris:
+            return None
+        return cls([
+            Replica(f"replica-{index}", create_engine(uri), Config.REPLICA_MAX_LAG_SECONDS,
+                    Config.REPLICA_LAG_CHECK_SECONDS, Config.REPLICA_LAG_QUERY)
+            for index, uri in enumerate(uris)
+        ])
+
+    def pick(self):
+        """The next usable replica, or None to read from the primary."""
+        start = next(self._turn)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.usable():
+                return replica
+        return None
+
+
+def _is_read(clause):
+    return isinstance(clause, SelectBase) and getattr(clause, '_for_update_arg', None) is None
+
+
+class RoutingMixin:
+    # Set by the entry point when replicas are configured
+    router = None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.router is not None:
+            replica = self._route(clause)
+            if replica is not None:
+                return replica.bind
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def _route(self, clause):
+        if self._flushing or not _is_read(clause):
+            self.info['wrote'] = self.info['read_primary'] = True
+            DB_ROUTED_STATEMENTS.labels('primary', 'write').inc()
+            return None
+        if self.info.get('read_primary'):
+            DB_ROUTED_STATEMENTS.labels('primary', 'sticky').inc()
+            return None
+        if 'replica' not in self.info:
+            self.info['replica'] = self.router.pick()
+        replica = self.info['replica']
+        if replica is None:
+            DB_ROUTED_STATEMENTS.labels('primary', 'no_replica').inc()
+        else:
+            DB_ROUTED_STATEMENTS.labels(replica.name, 'read').inc()
+        return replica
+
+
+class RoutingSession(RoutingMixin, FlaskSession):
+    """Flask-SQLAlchemy's session, routing reads to replicas."""
+
+
+class AsyncRoutingSession(RoutingMixin, Session):
+    """``sync_session_class`` of asgi.py's AsyncSession; replica binds are the async engines' ``sync_engine``."""
+
+
+def read_primary_on_miss(session):
+    """After a lookup came back short: True if it read from a replica, which may not have the rows yet.
+
+    The session reads from the primary from then on, so the caller can
+    simply run the lookup again.
+    """
+    if session.info.get('replica') is None or session.info.get('read_primary'):
+        return False
+    session.info['read_primary'] = True
+    return True
+
+
+def _sticky_signature(until):
+    key = Config.SECRET_KEY.encode('utf-8')
+    return hmac.new(key, f"{STICKY_COOKIE}:{until}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def is_sticky(cookie):
+    """Whether the read-your-writes cookie is one sticky_until made and its expiry (a Unix time) is still ahead.
+
+    The expiry is signed, so a client can't pick its own and keep every
+    read on the primary for as long as it likes.
+    """
+    try:
+        until, _, signature = cookie.rpartition(':')
+        if not hmac.compare_digest(signature, _sticky_signature(until)):
+            return False
+        return float(until) > time.time()
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+
+def sticky_until():
+    until = f"{time.time() + Config.READ_YOUR_WRITES_SECONDS:.3f}"
+    return f"{until}:{_sticky_signature(until)}"
+
+
+class MutationsOnPrimary(SchemaExtension):
+    """Mutations read from the primary too, e.g. addOrder's product lookup."""
+
+    def on_execute(self):
+        execution_context = self.execution_context
+        if execution_context.operation_type is OperationType.MUTATION:
+            execution_context.context['session'].info['read_primary'] = True
+        yield
@@ -0,0 +1,20 @@
+-- Adds the columns the catalog export filters `since` on to a database
+-- created before them (db.create_all() only creates missing tables):
+--
+--     psql "$DATABASE_URL" -f sql/export_columns.sql
+--
+-- Existing rows get the time of the migration, so the first sync after it
+-- picks them all up. Adding a column with a now() default doesn't rewrite
+-- the table on Postgres 11 and later. The indexes are built CONCURRENTLY,
+-- so writes carry on meanwhile; that can't run in a transaction, hence
+-- the separate statements. Safe to run again, except that an index build
+-- that failed leaves an invalid index behind: drop it first.
+BEGIN;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS updated_at timestamptz DEFAULT now();
+ALTER TABLE comments ADD COLUMN IF NOT EXISTS created_at timestamptz DEFAULT now();
+ALTER TABLE ratings ADD COLUMN IF NOT EXISTS created_at timestamptz DEFAULT now();
+COMMIT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_updated_at ON products (updated_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_comments_created_at ON comments (created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ratings_created_at ON ratings (created_at);
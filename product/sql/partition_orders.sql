@@ -0,0 +1,53 @@
+-- Turns orders into a table range-partitioned by month on created_at.
+-- Run once, in a maintenance window, since it copies the whole table:
+--
+--     psql "$DATABASE_URL" -f sql/partition_orders.sql
+--
+-- Partitions are named orders_YYYY_MM (UTC months), which common/archive.py
+-- relies on. The next three months are created here; schedule
+-- `python -m common.archive orders --create-ahead 3 --older-than-days N` to keep
+-- creating them and to archive the old ones. Rows without a partition
+-- land in orders_default. Orders that existed before created_at was added
+-- get the time of the migration.
+BEGIN;
+SET LOCAL TIME ZONE 'UTC';
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE orders RENAME TO orders_unpartitioned;
+-- Index and constraint names are per schema; free them for the new table
+ALTER TABLE orders_unpartitioned RENAME CONSTRAINT orders_pkey TO orders_unpartitioned_pkey;
+ALTER INDEX IF EXISTS ix_orders_product_id RENAME TO ix_orders_unpartitioned_product_id;
+ALTER INDEX IF EXISTS ix_orders_created_at RENAME TO ix_orders_unpartitioned_created_at;
+
+-- The partition key has to be part of the primary key; ids still come from one sequence
+CREATE TABLE orders (
+    id integer NOT NULL DEFAULT nextval('orders_id_seq'),
+    product_id integer REFERENCES products (id) ON DELETE SET NULL,
+    quantity integer,
+    total_price double precision,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE INDEX ix_orders_product_id ON orders (product_id);
+CREATE TABLE orders_default PARTITION OF orders DEFAULT;
+
+DO $$
+DECLARE
+    month timestamptz;
+BEGIN
+    FOR month IN SELECT generate_series(
+        date_trunc('month', coalesce((SELECT min(created_at) FROM orders_unpartitioned), now())),
+        date_trunc('month', now()) + interval '3 months',
+        interval '1 month')
+    LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF orders FOR VALUES FROM (%L) TO (%L)',
+                       'orders_' || to_char(month, 'YYYY_MM'), month, month + interval '1 month');
+    END LOOP;
+END $$;
+
+INSERT INTO orders (id, product_id, quantity, total_price, created_at)
+SELECT id, product_id, quantity, total_price, coalesce(created_at, now()) FROM orders_unpartitioned;
+
+ALTER SEQUENCE orders_id_seq OWNED BY orders.id;
+DROP TABLE orders_unpartitioned;
+COMMIT;
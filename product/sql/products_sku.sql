@@ -0,0 +1,21 @@
+-- Adds products.sku, which bulk ingestion upserts by, to a database created
+-- before it (db.create_all() only creates missing tables):
+--
+--     psql "$DATABASE_URL" -f sql/products_sku.sql
+--
+-- Existing products get no SKU; NULLs don't clash under a unique
+-- constraint. The unique index is built CONCURRENTLY, so writes carry on
+-- meanwhile, and then becomes the products_sku_key constraint that
+-- db.create_all() would have made, which ON CONFLICT (sku) relies on.
+-- Safe to run again, except that an index build that failed leaves an
+-- invalid index behind: drop it first.
+ALTER TABLE products ADD COLUMN IF NOT EXISTS sku varchar(64);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS products_sku_key ON products (sku);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'products'::regclass AND conname = 'products_sku_key') THEN
+        ALTER TABLE products ADD CONSTRAINT products_sku_key UNIQUE USING INDEX products_sku_key;
+    END IF;
+END $$;
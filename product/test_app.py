@@ -0,0 +1,76 @@
+"""The Flask server's transaction around a request's operations.
+
+    cd product && PYTHONPATH=.. python -m unittest
+
+The database is a throwaway SQLite file, set up before app.py reads its
+configuration.
+"""
+import os
+import tempfile
+import unittest
+
+# Per process, so test_asgi.py (imported in the same run) points at the same files
+_workdir = os.path.join(tempfile.gettempdir(), f"product-test-{os.getpid()}")
+os.makedirs(_workdir, exist_ok=True)
+os.environ["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(_workdir, "product.sqlite3")
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+os.environ["SECRET_KEY"] = "product-test-signing-secret-32-bytes"
+
+import app as service  # noqa: E402
+from common.batch import ROLLED_BACK  # noqa: E402
+from models import Comment, Order, Product, Rating, db  # noqa: E402
+
+ADD_ORDER = "mutation($id: Int!) { addOrder(productId: $id, quantity: 2, totalPrice: 0) { id } }"
+
+
+class BatchTransactionTest(unittest.TestCase):
+    def setUp(self):
+        with service.app.app_context():
+            for model in (Order, Comment, Rating, Product):
+                db.session.query(model).delete()
+            db.session.add(Product(id=1, name="Lamp", description="", price=20.0))
+            db.session.commit()
+        self.client = service.app.test_client()
+
+    def post(self, body):
+        response = self.client.post("/graphql", json=body)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def orders(self):
+        with service.app.app_context():
+            return db.session.query(Order).count()
+
+    def test_batch_that_succeeds_is_committed(self):
+        result = self.post([{"query": ADD_ORDER, "variables": {"id": 1}},
+                            {"query": ADD_ORDER, "variables": {"id": 1}}])
+
+        self.assertEqual([sorted(item) for item in result], [["data"], ["data"]])
+        self.assertEqual(self.orders(), 2)
+
+    def test_rolled_back_batch_reports_an_error_for_every_operation(self):
+        result = self.post([{"query": ADD_ORDER, "variables": {"id": 1}},
+                            {"query": ADD_ORDER, "variables": {"id": 999}},
+                            {"query": "{ product(id: 1) { name } }"}])
+
+        self.assertEqual([item["data"] for item in result], [None, None, None])
+        self.assertEqual([item["errors"][0]["message"] for item in result],
+                         [ROLLED_BACK, "Product not found", ROLLED_BACK])
+        self.assertEqual(self.orders(), 0)
+
+    def test_failed_query_fails_alone_in_a_batch_that_wrote_nothing(self):
+        result = self.post([{"query": "{ product(id: 1) { name } }"}, {"query": "{ nope }"}])
+
+        self.assertEqual(result[0]["data"], {"product": {"name": "Lamp"}})
+        self.assertIn("nope", result[1]["errors"][0]["message"])
+
+    def test_single_document_is_all_or_nothing(self):
+        result = self.post({"query": "mutation { a: addOrder(productId: 1, quantity: 1, totalPrice: 0) { id } "
+                                     "b: addOrder(productId: 999, quantity: 1, totalPrice: 0) { id } }"})
+
+        self.assertEqual(result["errors"][0]["message"], "Product not found")
+        self.assertEqual(self.orders(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
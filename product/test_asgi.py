@@ -0,0 +1,187 @@
+"""The ASGI server's request sessions, on SQLite through aiosqlite.
+
+    cd product && PYTHONPATH=.. python -m unittest
+
+The database is a throwaway SQLite file and the order archive a temporary
+directory, both set up before asgi.py reads its configuration.
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+# Per process, so test_app.py (imported in the same run) points at the same files
+_workdir = os.path.join(tempfile.gettempdir(), f"product-test-{os.getpid()}")
+os.makedirs(_workdir, exist_ok=True)
+os.environ["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(_workdir, "product.sqlite3")
+os.environ["ARCHIVE_DIR"] = os.path.join(_workdir, "archive")
+os.environ["SECRET_KEY"] = SECRET = "product-test-signing-secret-32-bytes"
+
+import jwt  # noqa: E402
+from sqlalchemy import create_engine, delete, func, insert, select  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+import asgi  # noqa: E402
+import loaders  # noqa: E402
+from common.archive import archive_table  # noqa: E402
+from common.batch import ROLLED_BACK  # noqa: E402
+from common.permissions import permission_mask  # noqa: E402
+from config import Config  # noqa: E402
+from models import Comment, Order, Product, Rating  # noqa: E402
+
+ADMIN = {"Authorization": "Bearer " + jwt.encode({"perm": permission_mask(["admin"])}, SECRET, algorithm="HS256")}
+LONG_AGO = datetime(2020, 1, 15, tzinfo=timezone.utc)
+
+
+class Session:
+    """Records how asgi.py's helpers use the request's session."""
+
+    def __init__(self):
+        self.commits = 0
+
+    async def commit(self):
+        self.commits += 1
+
+
+def context():
+    return {"session": Session(), "session_lock": asyncio.Lock(), "writes": False}
+
+
+class RequestSessionTest(unittest.TestCase):
+    def test_resolvers_take_turns_on_the_session(self):
+        ctx = context()
+        inside = []
+        overlapped = []
+
+        async def read(name):
+            async with asgi.request_session(ctx):
+                if inside:
+                    overlapped.append(name)
+                inside.append(name)
+                await asyncio.sleep(0)
+                inside.remove(name)
+
+        async def main():
+            await asyncio.gather(*(read(name) for name in "abcd"))
+
+        asyncio.run(main())
+
+        self.assertEqual(overlapped, [])
+        self.assertEqual(ctx["session"].commits, 4)
+
+    def test_reads_after_a_write_leave_the_transaction_open(self):
+        ctx = context()
+
+        async def main():
+            async with asgi.request_session(ctx):
+                pass
+            async with asgi.write_session(ctx):
+                pass
+            async with asgi.request_session(ctx):
+                pass
+
+        asyncio.run(main())
+
+        self.assertTrue(ctx["writes"])
+        self.assertEqual(ctx["session"].commits, 1)
+
+
+class GraphQLTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # One client for the class: the pooled aiosqlite connections belong to its event loop
+        cls.client = TestClient(asgi.app)
+        cls.client.__enter__()
+        cls.sync_engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.__exit__(None, None, None)
+        cls.sync_engine.dispose()
+
+    def setUp(self):
+        with self.sync_engine.begin() as conn:
+            for model in (Order, Comment, Rating, Product):
+                conn.execute(delete(model))
+            conn.execute(insert(Product), [{"id": 1, "name": "Lamp", "description": "", "price": 20.0}])
+
+    def post(self, body, **kwargs):
+        response = self.client.post("/graphql", json=body, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_mutation_is_committed(self):
+        result = self.post({"query": 'mutation { addProduct(name: "Desk", description: "", price: 80) { id } }'},
+                           headers=ADMIN)
+
+        new_id = result["data"]["addProduct"]["id"]
+        product = self.post({"query": f"{{ product(id: {new_id}) {{ name price }} }}"})
+        self.assertEqual(product["data"], {"product": {"name": "Desk", "price": 80.0}})
+
+    def test_failed_document_is_rolled_back(self):
+        result = self.post({"query": 'mutation { a: addComment(productId: 1, text: "Nice") { id } '
+                                     'b: addOrder(productId: 999, quantity: 1, totalPrice: 1) { id } }'})
+
+        self.assertEqual(result["errors"][0]["message"], "Product not found")
+        product = self.post({"query": "{ product(id: 1) { comments { text } } }"})
+        self.assertEqual(product["data"], {"product": {"comments": []}})
+
+    def test_batched_reads_share_the_session(self):
+        result = self.post([
+            {"query": "{ allProducts { id } }"},
+            {"query": "{ product(id: 1) { name } }"},
+            {"query": "{ a: product(id: 1) { price } b: product(id: 2) { price } }"},
+        ])
+
+        self.assertEqual([item["data"] for item in result], [
+            {"allProducts": [{"id": 1}]},
+            {"product": {"name": "Lamp"}},
+            {"a": {"price": 20.0}, "b": None},
+        ])
+
+    def test_rolled_back_batch_reports_an_error_for_every_operation(self):
+        result = self.post([
+            {"query": "mutation { addOrder(productId: 1, quantity: 2, totalPrice: 0) { id } }"},
+            {"query": "mutation { addOrder(productId: 999, quantity: 1, totalPrice: 0) { id } }"},
+            {"query": "{ product(id: 1) { name } }"},
+        ])
+
+        self.assertEqual([item["data"] for item in result], [None, None, None])
+        self.assertEqual([item["errors"][0]["message"] for item in result],
+                         [ROLLED_BACK, "Product not found", ROLLED_BACK])
+        with self.sync_engine.connect() as conn:
+            self.assertEqual(conn.execute(select(func.count()).select_from(Order.__table__)).scalar(), 0)
+
+    def test_failed_query_fails_alone_in_a_batch_that_wrote_nothing(self):
+        result = self.post([{"query": "{ product(id: 1) { name } }"}, {"query": "{ nope }"}])
+
+        self.assertEqual(result[0]["data"], {"product": {"name": "Lamp"}})
+        self.assertIn("nope", result[1]["errors"][0]["message"])
+
+    def test_archived_order_is_read_off_the_event_loop(self):
+        with self.sync_engine.begin() as conn:
+            conn.execute(insert(Order), [{"id": 5, "product_id": 1, "quantity": 2, "total_price": 40.0,
+                                          "created_at": LONG_AGO}])
+        archive_table(self.sync_engine, Config.ARCHIVE_DIR, "orders", datetime.now(timezone.utc))
+        find = loaders.order_archive.find
+        on_loop = []
+
+        def find_and_note(ids):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+            return find(ids)
+
+        with mock.patch.object(loaders.order_archive, "find", find_and_note):
+            result = self.post({"query": "{ a: order(id: 5) { quantity totalPrice } b: order(id: 6) { id } }"})
+
+        self.assertEqual(result["data"], {"a": {"quantity": 2, "totalPrice": 40.0}, "b": None})
+        self.assertEqual(on_loop, [False])
+
+
+if __name__ == "__main__":
+    unittest.main()
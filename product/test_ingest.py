@@ -0,0 +1,125 @@
+"""What bulk ingestion accepts, and how it upserts by SKU, on SQLite.
+
+    cd product && PYTHONPATH=.. python -m unittest
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+from sqlalchemy import create_engine, select
+
+from ingest import ingest, main, parse_item
+from models import Comment, Product, Rating, db
+
+MUG = {"sku": "A-1", "name": "Mug", "description": "Blue", "price": 9.5, "comments": ["Nice"], "ratings": [4]}
+
+
+def item(**changes):
+    return parse_item({**MUG, **changes})
+
+
+class ParseItemTest(unittest.TestCase):
+    def test_valid_item(self):
+        self.assertEqual(item(), {"sku": "A-1", "name": "Mug", "description": "Blue", "price": 9.5,
+                                  "comments": ["Nice"], "ratings": [4.0]})
+
+    def test_comments_and_ratings_are_optional(self):
+        parsed = parse_item({key: MUG[key] for key in ("sku", "name", "description", "price")})
+        self.assertEqual((parsed["comments"], parsed["ratings"]), ([], []))
+        self.assertEqual(item(comments=None, ratings=None)["comments"], [])
+
+    def test_rejects(self):
+        cases = {
+            "a string of comments": {"comments": "Nice"},
+            "an object of comments": {"comments": {"text": "Nice"}},
+            "a number of ratings": {"ratings": 4},
+            "a string of ratings": {"ratings": "45"},
+            "a rating that is a boolean": {"ratings": [True]},
+            "a comment that is too long": {"comments": ["x" * (Comment.text.type.length + 1)]},
+            "an empty sku": {"sku": ""},
+            "a price that is a string": {"price": "9.5"},
+        }
+        for name, changes in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(ValueError):
+                    item(**changes)
+
+    def test_rejects_what_is_not_an_object(self):
+        with self.assertRaises(ValueError):
+            parse_item([MUG])
+
+
+class UpsertTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="ingest-test-")
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.uri = "sqlite:///" + os.path.join(self.workdir, "product.sqlite3")
+        self.engine = create_engine(self.uri)
+        self.addCleanup(self.engine.dispose)
+        db.metadata.create_all(self.engine)
+
+    def ingest(self, items, batch_size=1000):
+        with self.engine.begin() as connection:
+            return ingest(connection, items, batch_size)
+
+    def rows(self, model, *columns):
+        with self.engine.connect() as connection:
+            return sorted(connection.execute(select(*(getattr(model, column) for column in columns))).all())
+
+    def test_known_sku_keeps_its_id_and_gets_new_fields(self):
+        first, _, _ = self.ingest([item()])
+        again, comments, ratings = self.ingest([item(name="Big mug", price=12, comments=["Great"], ratings=[5])])
+
+        self.assertEqual(again, first)
+        self.assertEqual((comments, ratings), (1, 1))
+        self.assertEqual(self.rows(Product, "id", "sku", "name", "price"), [(first[0], "A-1", "Big mug", 12.0)])
+        # Comments and ratings are appended
+        self.assertEqual(self.rows(Comment, "text"), [("Great",), ("Nice",)])
+        self.assertEqual(self.rows(Rating, "score"), [(4.0,), (5.0,)])
+
+    def test_ids_come_back_in_input_order_across_batches(self):
+        items = [item(sku=f"S-{n}", comments=[], ratings=[]) for n in range(5)]
+        self.ingest(items[3:4])
+
+        ids, _, _ = self.ingest(items, batch_size=2)
+
+        self.assertEqual(len(set(ids)), 5)
+        skus = dict((id, sku) for id, sku in self.rows(Product, "id", "sku"))
+        self.assertEqual([skus[id] for id in ids], [f"S-{n}" for n in range(5)])
+
+    def test_repeated_sku_in_one_batch_takes_the_last(self):
+        ids, comments, _ = self.ingest([item(name="First"), item(name="Second")])
+
+        self.assertEqual(ids[0], ids[1])
+        self.assertEqual(self.rows(Product, "name"), [("Second",)])
+        self.assertEqual(comments, 2)
+
+    def test_cli_loads_a_file(self):
+        path = os.path.join(self.workdir, "catalog.jsonl")
+        with open(path, "w", encoding="utf-8") as catalog:
+            catalog.write(json.dumps(MUG) + "\n\n" + json.dumps({**MUG, "sku": "A-2"}) + "\n")
+
+        with redirect_stdout(io.StringIO()) as out:
+            main([path, "--batch-size", "1", "--database-uri", self.uri])
+
+        self.assertEqual(json.loads(out.getvalue())["products"], 2)
+        self.assertEqual(self.rows(Product, "sku"), [("A-1",), ("A-2",)])
+
+    def test_cli_stops_at_a_bad_line(self):
+        path = os.path.join(self.workdir, "catalog.jsonl")
+        with open(path, "w", encoding="utf-8") as catalog:
+            catalog.write(json.dumps(MUG) + "\n" + json.dumps({**MUG, "sku": "A-2", "ratings": 4}) + "\n")
+
+        with self.assertRaises(SystemExit), redirect_stderr(io.StringIO()) as err:
+            main([path, "--batch-size", "1", "--database-uri", self.uri])
+
+        self.assertIn("line 2: ratings must be a list", err.getvalue())
+        self.assertEqual(self.rows(Product, "sku"), [("A-1",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+"""Where a session's statements go with read replicas, on SQLite files.
+
+    cd product && PYTHONPATH=.. python -m unittest
+
+Every database holds a ``whoami`` row naming it, and a ``lag`` row a test
+sets to make that replica fall behind.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from sqlalchemy import Column, Float, MetaData, String, Table, create_engine, insert, select, update
+
+import routing
+from routing import AsyncRoutingSession, Replica, ReplicaRouter, is_sticky, read_primary_on_miss, sticky_until
+
+metadata = MetaData()
+whoami = Table("whoami", metadata, Column("name", String))
+lag = Table("lag", metadata, Column("seconds", Float))
+LAG_QUERY = "SELECT seconds FROM lag"
+
+
+class RoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="routing-test-")
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.primary = self.database("primary")
+        # Replicas print why they are skipped
+        patch = mock.patch("builtins.print")
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def database(self, name):
+        engine = create_engine("sqlite:///" + os.path.join(self.workdir, f"{name}.sqlite3"))
+        self.addCleanup(engine.dispose)
+        metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(whoami).values(name=name))
+            conn.execute(insert(lag).values(seconds=0))
+        return engine
+
+    def replicas(self, count, check_every=0):
+        return [Replica(f"replica-{n}", self.database(f"replica-{n}"), max_lag=5, check_every=check_every,
+                        lag_query=LAG_QUERY) for n in range(count)]
+
+    def session(self, router):
+        session_class = type("Session", (AsyncRoutingSession,), {"router": router})
+        session = session_class(bind=self.primary)
+        self.addCleanup(session.close)
+        return session
+
+    def read(self, session):
+        return session.scalar(select(whoami.c.name))
+
+    def fall_behind(self, replica, seconds):
+        with replica.bind.begin() as conn:
+            conn.execute(update(lag).values(seconds=seconds))
+
+    def test_reads_go_to_one_replica_per_session(self):
+        router = ReplicaRouter(self.replicas(2))
+        first, second = self.session(router), self.session(router)
+
+        self.assertEqual([self.read(first), self.read(second), self.read(first)],
+                         ["replica-0", "replica-1", "replica-0"])
+
+    def test_writes_and_the_reads_after_them_go_to_the_primary(self):
+        session = self.session(ReplicaRouter(self.replicas(1)))
+        self.assertEqual(self.read(session), "replica-0")
+
+        session.execute(insert(whoami).values(name="written"))
+
+        self.assertEqual(sorted(session.scalars(select(whoami.c.name))), ["primary", "written"])
+        self.assertTrue(session.info["wrote"])
+
+    def test_select_for_update_goes_to_the_primary(self):
+        session = self.session(ReplicaRouter(self.replicas(1)))
+
+        self.assertEqual(session.scalar(select(whoami.c.name).with_for_update()), "primary")
+
+    def test_session_told_to_read_from_the_primary_does(self):
+        session = self.session(ReplicaRouter(self.replicas(1)))
+        session.info["read_primary"] = True
+
+        self.assertEqual(self.read(session), "primary")
+        self.assertNotIn("wrote", session.info)
+
+    def test_lagging_replica_is_skipped(self):
+        replicas = self.replicas(2)
+        self.fall_behind(replicas[0], 30)
+        router = ReplicaRouter(replicas)
+
+        self.assertEqual([self.read(self.session(router)) for _ in range(3)], ["replica-1"] * 3)
+
+    def test_reads_go_to_the_primary_without_a_usable_replica(self):
+        replicas = self.replicas(2)
+        self.fall_behind(replicas[0], 30)
+        with replicas[1].bind.begin() as conn:
+            lag.drop(conn)
+
+        self.assertEqual(self.read(self.session(ReplicaRouter(replicas))), "primary")
+
+    def test_replica_is_used_again_once_it_catches_up(self):
+        replica, = self.replicas(1, check_every=60)
+        self.fall_behind(replica, 30)
+        self.assertFalse(replica.usable())
+        self.fall_behind(replica, 0)
+
+        # The last check stands until it is check_every old
+        self.assertFalse(replica.usable())
+        with mock.patch.object(routing.time, "monotonic", return_value=replica._checked_at + 60):
+            self.assertTrue(replica.usable())
+
+    def test_disconnected_replica_is_skipped_until_the_next_check(self):
+        replica, = self.replicas(1, check_every=60)
+        self.assertTrue(replica.usable())
+
+        replica._on_error(SimpleNamespace(is_disconnect=True, connection=object()))
+
+        self.assertFalse(replica.usable())
+
+    def test_short_lookup_on_a_replica_is_retried_on_the_primary(self):
+        session = self.session(ReplicaRouter(self.replicas(1)))
+        self.read(session)
+
+        self.assertTrue(read_primary_on_miss(session))
+        self.assertEqual(self.read(session), "primary")
+        # Nothing more to retry once reads are on the primary
+        self.assertFalse(read_primary_on_miss(session))
+
+    def test_short_lookup_on_the_primary_is_not_retried(self):
+        replicas = self.replicas(1)
+        self.fall_behind(replicas[0], 30)
+        session = self.session(ReplicaRouter(replicas))
+        self.read(session)
+
+        self.assertFalse(read_primary_on_miss(session))
+
+
+class StickyCookieTest(unittest.TestCase):
+    def test_fresh_cookie_is_sticky(self):
+        self.assertTrue(is_sticky(sticky_until()))
+
+    def test_cookie_runs_out(self):
+        cookie = sticky_until()
+        later = routing.time.time() + routing.Config.READ_YOUR_WRITES_SECONDS + 1
+        with mock.patch.object(routing.time, "time", return_value=later):
+            self.assertFalse(is_sticky(cookie))
+
+    def test_client_cannot_pick_the_expiry(self):
+        until, _, signature = sticky_until().rpartition(":")
+        for cookie in ("9999999999", f"9999999999:{signature}", f"{float(until) + 3600:.3f}:{signature}",
+                       f"{until}:", None, "", "not a time"):
+            with self.subTest(cookie=cookie):
+                self.assertFalse(is_sticky(cookie))
+
+
+if __name__ == "__main__":
+    unittest.main()